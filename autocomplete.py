@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+KSAE Formula Rules autocomplete
+Builds a prefix index over chapter/section titles, \\label{item:...} names and frequent
+technical terms of formula.tex, and answers search-as-you-type queries from it.
+Keys are Hangul decomposed into keystroke jamo (휠 → ㅎㅜㅣㄹ) with spaces and punctuation
+dropped, so half-typed input such as "휠보" or "ㅂ" still matches "휠 볼트 토크".
+Lookups are a bisect into a sorted array.
+"""
+
+import argparse
+import json
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+
+from export import build_rule_tree
+
+
+# ── Hangul jamo ────────────────────────────────────────────────────────────
+
+HANGUL_BASE = 0xAC00
+HANGUL_LAST = 0xD7A3
+CHOSEONG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+JUNGSEONG = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+JONGSEONG = ["", *"ㄱㄲㄳㄴㄵㄶㄷㄹㄺㄻㄼㄽㄾㄿㅀㅁㅂㅄㅅㅆㅇㅈㅊㅋㅌㅍㅎ"]
+
+# Compound vowels and finals as typed on a 2-set keyboard
+KEYSTROKES = {
+    "ㅘ": "ㅗㅏ", "ㅙ": "ㅗㅐ", "ㅚ": "ㅗㅣ", "ㅝ": "ㅜㅓ", "ㅞ": "ㅜㅔ", "ㅟ": "ㅜㅣ", "ㅢ": "ㅡㅣ",
+    "ㄳ": "ㄱㅅ", "ㄵ": "ㄴㅈ", "ㄶ": "ㄴㅎ", "ㄺ": "ㄹㄱ", "ㄻ": "ㄹㅁ", "ㄼ": "ㄹㅂ", "ㄽ": "ㄹㅅ",
+    "ㄾ": "ㄹㅌ", "ㄿ": "ㄹㅍ", "ㅀ": "ㄹㅎ", "ㅄ": "ㅂㅅ",
+}
+
+
+NON_WORD = re.compile(r"[\W_]+")
+
+
+def decompose(text: str) -> str:
+    """Lowercase, drop spaces and punctuation, and spell Hangul as keystroke jamo."""
+    out = []
+    for ch in NON_WORD.sub("", text.lower()):
+        code = ord(ch)
+        if HANGUL_BASE <= code <= HANGUL_LAST:
+            index = code - HANGUL_BASE
+            for jamo in (CHOSEONG[index // 588], JUNGSEONG[index % 588 // 28], JONGSEONG[index % 28]):
+                out.append(KEYSTROKES.get(jamo, jamo))
+        else:
+            out.append(KEYSTROKES.get(ch, ch))
+    return "".join(out)
+
+
+# ── Entries ────────────────────────────────────────────────────────────────
+
+TERM_PATTERN = re.compile(r"[가-힣]{2,}|[A-Za-z][A-Za-z0-9-]{2,}")
+MIN_TERM_FREQ = 3
+MAX_TERMS = 400
+
+# Particles stripped from the end of Hangul words, longest first
+JOSA = sorted(
+    ["은", "는", "이", "가", "을", "를", "의", "에", "에서", "에는", "으로", "로", "와", "과", "도", "만",
+     "으로서", "로서", "으로써", "로써", "에게", "까지", "부터", "보다", "이나", "나", "이며", "이고"],
+    key=len, reverse=True,
+)
+# Particles that can stack onto another one (시에는, 경로로도), and those nothing stacks onto
+STACKING_JOSA = ("은", "는", "도", "만", "의")
+CLOSING_JOSA = ("은", "는", "이", "가", "을", "를")
+# Predicate endings: words ending like this are verbs/adjectives, not terms
+PREDICATE_ENDINGS = ("다", "며", "고", "면", "록", "야", "거나", "하여", "되어",
+                     "된", "한", "할", "하는", "되는", "있는", "없는", "않은", "않는", "같은", "같이", "지만")
+STOPWORDS = {"경우", "다음", "모든", "반드시", "또는", "그리고", "해당", "위한", "대한", "이러한", "어떠한",
+             "각각", "아래", "이상", "이하", "미만", "초과", "사용", "모두", "따라", "의해", "통해", "위해", "하나",
+             "다른", "사이", "개의", "이내", "별도", "혹은",
+             # one-syllable stems left by particle stripping (bound nouns, pronouns, adjective stems)
+             "것", "등", "개", "내", "중", "시", "전", "상", "위", "때", "예", "이", "가", "있", "없", "높", "낮",
+             "the", "and", "for", "with"}
+
+KIND_WEIGHT = {"chapter": 3.0, "section": 3.0, "label": 2.5}
+
+
+def heading_anchor(text: str) -> str:
+    """Identifier pandoc gives a heading (lowercase, punctuation dropped, spaces → hyphens)."""
+    kept = "".join(c if c.isalnum() or c in "_-." else " " if c.isspace() else "" for c in text.lower())
+    return "-".join(kept.split())
+
+
+def term_stem(word: str, vocabulary: set[str] = frozenset()) -> str | None:
+    """
+    Strip a trailing particle; None for predicates, stopwords and bare particles.
+    A two-syllable word ending in a particle is ambiguous (팀은 vs 강도), so vocabulary,
+    the set of words in the corpus, decides: the word is a noun if it takes particles
+    itself (강도가, but not the stacked 시에는); otherwise its one-syllable stem is kept
+    only if it takes two or more different particles (팀은, 팀이), and dropped if not.
+    """
+    if word.isascii():
+        return word if word.lower() not in STOPWORDS else None
+    if word.endswith(PREDICATE_ENDINGS):
+        return None
+    for josa in JOSA:
+        if word.endswith(josa):
+            stem = word[:-len(josa)]
+            if not stem:
+                return None
+            if len(stem) == 1:
+                if any(word + j in vocabulary for j in JOSA if j not in STACKING_JOSA or josa in CLOSING_JOSA):
+                    break
+                if sum(stem + j in vocabulary for j in JOSA) < 2:
+                    return None
+            word = stem
+            break
+    return word if word not in STOPWORDS else None
+
+
+def extract_terms(tree: dict) -> list[dict]:
+    """The most frequent technical terms, each pointing at the section that uses it most."""
+    counts: Counter = Counter()
+    by_section: dict[str, Counter] = {}
+    spelling: dict[str, Counter] = {}
+
+    texts = [(section, " ".join([section["title"], section["text"]] + [item["text"] for item in section["items"]]))
+             for chapter in tree["chapters"] for section in chapter["sections"]]
+    vocabulary = {word for _, text in texts for word in TERM_PATTERN.findall(text)}
+
+    for section, text in texts:
+        for word in TERM_PATTERN.findall(text):
+            stem = term_stem(word, vocabulary)
+            if not stem:
+                continue
+            key = stem.lower()
+            counts[key] += 1
+            by_section.setdefault(key, Counter())[section["number"]] += 1
+            spelling.setdefault(key, Counter())[stem] += 1
+
+    sections = {s["number"]: (c, s) for c in tree["chapters"] for s in c["sections"]}
+    terms = []
+    for key, freq in counts.most_common(MAX_TERMS):
+        if freq < MIN_TERM_FREQ:
+            break
+        chapter, section = sections[by_section[key].most_common(1)[0][0]]
+        terms.append({
+            "text": spelling[key].most_common(1)[0][0],
+            "kind": "term",
+            "ref": section["ref"],
+            "anchor": heading_anchor(f"{section['ref']} ({section['title']})"),
+            "weight": round(min(2.0, 0.5 + math.log10(freq)), 3),
+        })
+    return terms
+
+
+def build_entries(tree: dict) -> list[dict]:
+    """
+    Suggestions: chapters, sections, labelled items and frequent terms, deduplicated by text.
+    Labelled items are cited by their .aux number (as printed in the PDF) when the tree has it.
+    """
+    entries = []
+    for chapter in tree["chapters"]:
+        ref = f"제{chapter['number']}장"
+        entries.append({"text": chapter["title"], "kind": "chapter", "ref": ref,
+                        "anchor": heading_anchor(f"{ref} {chapter['title']}")})
+        for section in chapter["sections"]:
+            entries.append({"text": section["title"], "kind": "section", "ref": section["ref"],
+                            "anchor": heading_anchor(f"{section['ref']} ({section['title']})")})
+            for item in section["items"]:
+                if item["label"]:
+                    display = tree["labels"].get(item["label"], {}).get("display")
+                    entries.append({"text": item["label"].split(":", 1)[1], "kind": "label",
+                                    "ref": " ".join(display.split()) if display else item["ref"],
+                                    "anchor": item["anchor"]})
+    for entry in entries:
+        entry["weight"] = KIND_WEIGHT[entry["kind"]]
+
+    seen = {e["text"].lower() for e in entries}
+    entries += [t for t in extract_terms(tree) if t["text"].lower() not in seen]
+    return entries
+
+
+# ── Prefix index ───────────────────────────────────────────────────────────
+
+def build_index(entries: list[dict]) -> dict:
+    """
+    Sorted (key, entry, word offset) arrays. Every word start of an entry is a key,
+    so "비율" and "tread" also find "전륜과 후륜의 트레드(Tread) 비율"; sections and
+    chapters are keyed by their number (제12조) as well.
+    """
+    rows = []
+    for entry_id, entry in enumerate(entries):
+        text = entry["text"]
+        for offset, word in enumerate(re.finditer(r"[^\W_]+", text)):
+            rows.append((decompose(text[word.start():]), entry_id, offset))
+        if entry["kind"] in ("chapter", "section"):
+            rows.append((decompose(f"{entry['ref']} {entry['text']}"), entry_id, 0))
+    rows.sort()
+    return {
+        "entries": entries,
+        "keys": [r[0] for r in rows],
+        "ids": [r[1] for r in rows],
+        "offsets": [r[2] for r in rows],
+    }
+
+
+class Completer:
+    """Prefix lookups over an index from build_index (or its JSON file)."""
+
+    MAX_SCAN = 2000  # keys examined per query; bounds latency for one-jamo prefixes
+
+    def __init__(self, index: dict):
+        self.entries = index["entries"]
+        self.keys = index["keys"]
+        self.ids = index["ids"]
+        self.offsets = index["offsets"]
+
+    @classmethod
+    def load(cls, path: str | Path) -> "Completer":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def complete(self, prefix: str, limit: int = 8) -> list[dict]:
+        """Suggestions for prefix, best first: title starts before mid-title words, then by weight and length."""
+        key = decompose(prefix).strip()
+        if not key:
+            return []
+
+        best: dict[int, tuple] = {}
+        start = bisect_left(self.keys, key)
+        for i in range(start, min(start + self.MAX_SCAN, len(self.keys))):
+            if not self.keys[i].startswith(key):
+                break
+            entry_id = self.ids[i]
+            entry = self.entries[entry_id]
+            rank = (self.offsets[i] > 0, -entry["weight"], len(entry["text"]))
+            if entry_id not in best or rank < best[entry_id]:
+                best[entry_id] = rank
+
+        ranked = sorted(best, key=lambda entry_id: (best[entry_id], entry_id))[:limit]
+        return [self.entries[entry_id] for entry_id in ranked]
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the KSAE Formula rules autocomplete index")
+    parser.add_argument(
+        "--tex",
+        default=str(Path(__file__).parent / "formula.tex"),
+        help="Path to formula.tex (default: ./formula.tex)",
+    )
+    parser.add_argument("--output", default="formula.autocomplete.json",
+                        help="Index file (default: formula.autocomplete.json)")
+    parser.add_argument("--query", action="append", help="Print suggestions for this prefix (repeatable)")
+    parser.add_argument("--limit", type=int, default=8, help="Suggestions per query (default: 8)")
+    args = parser.parse_args()
+
+    if args.query:
+        completer = Completer.load(args.output)
+        for query in args.query:
+            start = time.perf_counter()
+            suggestions = completer.complete(query, args.limit)
+            elapsed = (time.perf_counter() - start) * 1e6
+            print(f"\"{query}\" ({elapsed:.0f} µs)")
+            for s in suggestions:
+                print(f"  [{s['kind']}] {s['text']}  → {s['ref']} #{s['anchor']}")
+        return 0
+
+    from tex2html import assign_item_anchors, get_cache_dir, load_label_index
+
+    start = time.perf_counter()
+    tex_path = Path(args.tex)
+    aux_path = tex_path.with_suffix(".aux")
+    tex = tex_path.read_text(encoding="utf-8")
+    aux_labels = load_label_index(aux_path, get_cache_dir(tex_path))[0] if aux_path.exists() else {}
+    tree = build_rule_tree(tex, aux_labels, assign_item_anchors(tex)[1])
+    index = build_index(build_entries(tree))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+
+    kinds = Counter(e["kind"] for e in index["entries"])
+    print(f"Indexed {len(index['entries'])} suggestions ({', '.join(f'{n} {k}s' for k, n in kinds.items())}), "
+          f"{len(index['keys'])} keys in {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"Wrote {args.output} ({Path(args.output).stat().st_size / 1024:.1f} KB)")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
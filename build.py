@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Build driver for formula.pdf and formula.html.
+Runs lualatex only until the .aux/.toc stop changing, skips the PDF entirely when
+its inputs are unchanged, and starts the HTML conversion as soon as the .aux is stable.
+"""
+
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+
+from tex2html import IMAGE_VARIANT_DIR, get_cache_dir, file_hash, convert_to_html
+
+
+ENGINE = 'lualatex'
+MAX_PASSES = 5
+
+# Auxiliary files whose contents feed the next pass (references, TOC, bookmarks, lists)
+CONVERGENCE_SUFFIXES = ('.aux', '.toc', '.out', '.lof', '.lot')
+
+# Lines of LaTeX log context shown after an error
+ERROR_CONTEXT_LINES = 6
+
+
+def input_files(tex_path):
+    """Files the PDF depends on: the document, its template and figure assets."""
+    tex_path = Path(tex_path)
+    files = [tex_path, tex_path.with_name('template.tex')]
+    assets = tex_path.with_name('assets')
+    if assets.is_dir():
+        files += sorted(p for p in assets.rglob('*')
+                        if p.is_file() and IMAGE_VARIANT_DIR not in p.relative_to(assets).parts)
+    return [p for p in files if p.exists()]
+
+
+def inputs_hash(tex_path):
+    """Combined hash of the input file names and contents."""
+    digest = hashlib.sha256()
+    for path in input_files(tex_path):
+        digest.update(str(path.relative_to(Path(tex_path).parent)).encode('utf-8'))
+        digest.update(file_hash(path).encode('ascii'))
+    return digest.hexdigest()
+
+
+def aux_state(tex_path):
+    """Hash of each convergence file that exists after a pass."""
+    tex_path = Path(tex_path)
+    state = {}
+    for suffix in CONVERGENCE_SUFFIXES:
+        path = tex_path.with_suffix(suffix)
+        if path.exists():
+            state[suffix] = file_hash(path)
+    return state
+
+
+def load_state(cache_dir):
+    try:
+        with open(Path(cache_dir) / 'build.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(cache_dir, state):
+    with open(Path(cache_dir) / 'build.json', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+
+def latex_errors(log_path):
+    """Extract `! ...` errors from a LaTeX log, each with the lines up to its `l.<n>` location."""
+    try:
+        lines = Path(log_path).read_text(encoding='utf-8', errors='replace').splitlines()
+    except OSError:
+        return []
+
+    errors = []
+    for i, line in enumerate(lines):
+        if not line.startswith('!'):
+            continue
+        block = [line]
+        for following in lines[i + 1:i + 1 + ERROR_CONTEXT_LINES]:
+            if following.startswith('!'):
+                break
+            block.append(following)
+            if following.startswith('l.'):
+                break
+        errors.append('\n'.join(block))
+    return errors
+
+
+def run_latex(tex_path, engine):
+    """Run one LaTeX pass; returns the list of errors (empty on success)."""
+    tex_path = Path(tex_path)
+    cmd = [engine, '-interaction=nonstopmode', '-halt-on-error', '-file-line-error', tex_path.name]
+    try:
+        result = subprocess.run(cmd, cwd=tex_path.parent, capture_output=True)
+    except FileNotFoundError:
+        print(f"Error: {engine} not found. Please install TeX Live.")
+        sys.exit(1)
+
+    errors = latex_errors(tex_path.with_suffix('.log'))
+    if result.returncode != 0 and not errors:
+        output = result.stdout.decode('utf-8', errors='replace').strip().splitlines()
+        errors = ['\n'.join(output[-ERROR_CONTEXT_LINES:]) or f"{engine} exited with code {result.returncode}"]
+    return errors
+
+
+def build_pdf(tex_path, engine, cache_dir, force=False, on_aux_stable=None):
+    """
+    Compile the PDF, rerunning until the convergence files hash the same as after the
+    previous pass. on_aux_stable(aux_copy) is called once the .aux alone has stopped
+    changing, which can be a pass before the TOC settles.
+    Returns the number of passes run (0 when the PDF was up to date).
+    """
+    tex_path = Path(tex_path)
+    pdf_path = tex_path.with_suffix('.pdf')
+    aux_path = tex_path.with_suffix('.aux')
+    aux_copy = Path(cache_dir) / aux_path.name
+
+    state = load_state(cache_dir)
+    digest = inputs_hash(tex_path)
+    if (not force and state.get('inputs') == digest and pdf_path.exists()
+            and aux_state(tex_path) == state.get('aux')):
+        print(f"==> {pdf_path} is up to date, skipping LaTeX")
+        if on_aux_stable:
+            on_aux_stable(aux_path)
+        return 0
+
+    previous = aux_state(tex_path)
+    aux_reported = False
+    for n in range(1, MAX_PASSES + 1):
+        print(f"==> {engine} pass {n}...")
+        errors = run_latex(tex_path, engine)
+        if errors:
+            print(f"Error: {engine} failed on pass {n}:")
+            for error in errors:
+                print(error)
+            save_state(cache_dir, {})
+            sys.exit(1)
+
+        current = aux_state(tex_path)
+        if not aux_reported and on_aux_stable and current.get('.aux') == previous.get('.aux'):
+            # lualatex rewrites the .aux at the start of the next pass; hand over a snapshot
+            shutil.copyfile(aux_path, aux_copy)
+            on_aux_stable(aux_copy)
+            aux_reported = True
+        if current == previous:
+            break
+        previous = current
+    else:
+        print(f"Warning: references did not converge after {MAX_PASSES} passes")
+
+    print(f"==> PDF built in {n} passes: {pdf_path}")
+    save_state(cache_dir, {'inputs': digest, 'aux': current, 'passes': n})
+    if on_aux_stable and not aux_reported:
+        on_aux_stable(aux_path)
+    return n
+
+
+def build(tex_path, html_path=None, engine=ENGINE, force=False, **html_options):
+    """Build the PDF and, unless html_path is None, the HTML alongside the last LaTeX passes."""
+    tex_path = Path(tex_path)
+    cache_dir = get_cache_dir(tex_path)
+
+    html_thread = None
+    html_failed = []
+
+    def start_html(aux_path):
+        nonlocal html_thread
+
+        def run():
+            try:
+                convert_to_html(tex_path, html_path, aux_path=aux_path, **html_options)
+            except BaseException as e:
+                html_failed.append(e)
+
+        print("==> .aux is stable, starting HTML conversion")
+        html_thread = threading.Thread(target=run)
+        html_thread.start()
+
+    build_pdf(tex_path, engine, cache_dir, force=force,
+              on_aux_stable=start_html if html_path is not None else None)
+
+    if html_thread is not None:
+        html_thread.join()
+        if html_failed:
+            print(f"Error: HTML conversion failed: {html_failed[0]}")
+            sys.exit(1)
+        print(f"==> HTML built: {html_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build formula.pdf and formula.html")
+    parser.add_argument('input', nargs='?', default='formula.tex', help="Input .tex file (default: formula.tex)")
+    parser.add_argument('--html', metavar='FILE',
+                        help="HTML output file (default: input with .html suffix)")
+    parser.add_argument('--no-html', action='store_true', help="Only build the PDF")
+    parser.add_argument('--engine', default=ENGINE, help=f"LaTeX engine (default: {ENGINE})")
+    parser.add_argument('--force', action='store_true', help="Recompile even if the inputs are unchanged")
+    parser.add_argument('--split', action='store_true', help="Passed through to tex2html.py")
+    parser.add_argument('--publish', metavar='DIR', help="Passed through to tex2html.py")
+    parser.add_argument('--fonts', metavar='DIR', help="Passed through to tex2html.py (with --publish)")
+    args = parser.parse_args()
+
+    html_file = None if args.no_html else Path(args.html or Path(args.input).with_suffix('.html'))
+    build(args.input, html_file, engine=args.engine, force=args.force,
+          split=args.split, publish_dir=args.publish, fonts_dir=args.fonts)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+KSAE Formula Rules export
+Writes the rule tree of formula.tex (chapters, sections, items, labels, figures) as JSON
+and as a SQLite database with an FTS5 full-text index and a label → item table.
+rules_fts uses the trigram tokenizer, so MATCH needs at least three characters; shorter
+Korean queries (e.g. 제동) go through LIKE on the `rules` view.
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from indexer import parse_sections_text, split_section_clauses, strip_latex
+from rulesdiff import find_label, section_preamble
+
+
+FIG_PATTERN = re.compile(r'\\fig\{([^}]+)\}\{([^}]+)\}\{([^}]+)\}')
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE chapters (
+    number INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    label TEXT
+);
+CREATE TABLE sections (
+    number INTEGER PRIMARY KEY,          -- document-wide 제N조
+    chapter INTEGER NOT NULL REFERENCES chapters(number),
+    title TEXT NOT NULL,
+    label TEXT,
+    applies_to TEXT NOT NULL,            -- JSON array
+    text TEXT NOT NULL                   -- text before the first item
+);
+CREATE TABLE items (
+    id INTEGER PRIMARY KEY,
+    chapter INTEGER NOT NULL,
+    section INTEGER NOT NULL REFERENCES sections(number),
+    list INTEGER NOT NULL,               -- top-level list of the section (항 restart in each)
+    item INTEGER NOT NULL,
+    ref TEXT NOT NULL,                   -- 제N조 M항
+    anchor TEXT,                         -- id in formula.html
+    label TEXT,
+    applies_to TEXT NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (section, list, item)
+);
+CREATE TABLE labels (
+    label TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,                  -- chapter | section | item | fig
+    display TEXT,                        -- resolved number from the .aux
+    chapter INTEGER,
+    section INTEGER,
+    list INTEGER,
+    item INTEGER,
+    figure INTEGER
+);
+CREATE TABLE figures (
+    number INTEGER PRIMARY KEY,
+    caption TEXT NOT NULL,
+    file TEXT NOT NULL,
+    section INTEGER NOT NULL,
+    item INTEGER
+);
+-- Sections and items in one place, for LIKE on queries shorter than a trigram
+CREATE VIEW rules AS
+    SELECT '제' || number || '조' AS ref, 'section' AS kind, NULL AS anchor, title, text FROM sections
+    UNION ALL
+    SELECT i.ref, 'item', i.anchor, s.title, i.text FROM items i JOIN sections s ON s.number = i.section;
+"""
+
+
+# ── Rule tree ──────────────────────────────────────────────────────────────
+
+def extract_figures(raw: str, figures: list[dict], section: int, item: int | None) -> list[int]:
+    """Append the \\fig figures in raw to figures (document order) and return their numbers."""
+    numbers = []
+    for match in FIG_PATTERN.finditer(raw):
+        caption, folder = match.group(1), match.group(2)
+        figures.append({
+            "number": len(figures) + 1,
+            "caption": caption,
+            "file": f"assets/{folder}/{caption}.jpg",
+            "label": f"fig:{caption}",
+            "section": section,
+            "item": item,
+        })
+        numbers.append(len(figures))
+    return numbers
+
+
+def build_rule_tree(tex: str, aux_labels: dict[str, str], item_anchors: dict[str, str]) -> dict:
+    """Build the nested chapter → section → item tree plus flat label and figure tables."""
+    lines = tex.splitlines(keepends=True)
+    chapter_lines = [line for line in lines if '\\chapter{' in line]
+
+    chapters: list[dict] = []
+    figures: list[dict] = []
+    labels: dict[str, dict] = {}
+    section_num = 0
+
+    def add_label(label: str | None, kind: str, **position):
+        if label:
+            labels[label] = {"kind": kind, "display": aux_labels.get(label), **position}
+
+    for section in parse_sections_text(tex):
+        section_num += 1
+        if not chapters or chapters[-1]["number"] != section.chapter_num:
+            heading = chapter_lines[section.chapter_num - 1] if section.chapter_num <= len(chapter_lines) else ""
+            chapters.append({
+                "number": section.chapter_num,
+                "title": section.chapter,
+                "label": find_label(heading, "chapter"),
+                "sections": [],
+            })
+            add_label(chapters[-1]["label"], "chapter", chapter=section.chapter_num)
+
+        heading = lines[section.start_line - 1] if section.start_line > 0 else ""
+        content = section.raw_content
+        preamble = section_preamble(content)
+        node = {
+            "number": section_num,
+            "ref": f"제{section_num}조",
+            "title": section.section_title,
+            "label": find_label(heading + preamble, "section"),
+            "applies_to": section.applies_to,
+            "text": strip_latex(preamble),
+            "figures": extract_figures(preamble, figures, section_num, None),
+            "lines": [section.start_line + 1, section.end_line + 1],
+            "items": [],
+        }
+        add_label(node["label"], "section", chapter=section.chapter_num, section=section_num)
+
+        for clause in split_section_clauses(content):
+            item = {
+                "number": clause.number,
+                "list": clause.list_num,
+                "ref": f"제{section_num}조 {clause.number}항",
+                "anchor": item_anchors.get(f"{section.chapter_num}-{section_num}-{clause.path}"),
+                "label": find_label(clause.content, "item"),
+                "text": strip_latex(clause.content).lstrip("• ").strip(),
+                "figures": extract_figures(clause.content, figures, section_num, clause.number),
+            }
+            node["items"].append(item)
+            add_label(item["label"], "item", chapter=section.chapter_num, section=section_num,
+                      list=clause.list_num, item=clause.number)
+
+        chapters[-1]["sections"].append(node)
+
+    for figure in figures:
+        add_label(figure["label"], "fig", section=figure["section"], item=figure["item"], figure=figure["number"])
+
+    return {"chapters": chapters, "figures": figures, "labels": labels}
+
+
+# ── SQLite ─────────────────────────────────────────────────────────────────
+
+def fts_tokenizer(conn: sqlite3.Connection) -> str:
+    """trigram (substring matching for Korean, SQLite 3.34+) or unicode61 as a fallback."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.probe")
+        return "trigram"
+    except sqlite3.OperationalError:
+        return "unicode61"
+
+
+def write_database(tree: dict, db_path: Path, meta: dict[str, str]) -> str:
+    """Write the tree to a fresh SQLite database; returns the FTS5 tokenizer used."""
+    tmp_path = db_path.with_name(db_path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    tokenizer = fts_tokenizer(conn)
+    conn.executescript(SCHEMA)
+    conn.execute(
+        "CREATE VIRTUAL TABLE rules_fts USING fts5("
+        f"ref UNINDEXED, kind UNINDEXED, anchor UNINDEXED, title, text, tokenize='{tokenizer}')"
+    )
+
+    with conn:
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", sorted({**meta, "fts_tokenizer": tokenizer}.items()))
+        for chapter in tree["chapters"]:
+            conn.execute("INSERT INTO chapters VALUES (?, ?, ?)",
+                         (chapter["number"], chapter["title"], chapter["label"]))
+            for section in chapter["sections"]:
+                applies_to = json.dumps(section["applies_to"])
+                conn.execute("INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?)",
+                             (section["number"], chapter["number"], section["title"], section["label"],
+                              applies_to, section["text"]))
+                conn.execute("INSERT INTO rules_fts VALUES (?, 'section', NULL, ?, ?)",
+                             (section["ref"], section["title"], section["text"]))
+                for item in section["items"]:
+                    conn.execute(
+                        "INSERT INTO items (chapter, section, list, item, ref, anchor, label, applies_to, text) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (chapter["number"], section["number"], item["list"], item["number"], item["ref"],
+                         item["anchor"], item["label"], applies_to, item["text"]))
+                    conn.execute("INSERT INTO rules_fts VALUES (?, 'item', ?, ?, ?)",
+                                 (item["ref"], item["anchor"], section["title"], item["text"]))
+        conn.executemany(
+            "INSERT INTO labels VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(label, entry["kind"], entry["display"], entry.get("chapter"), entry.get("section"),
+              entry.get("list"), entry.get("item"), entry.get("figure")) for label, entry in tree["labels"].items()],
+        )
+        conn.executemany(
+            "INSERT INTO figures VALUES (?, ?, ?, ?, ?)",
+            [(f["number"], f["caption"], f["file"], f["section"], f["item"]) for f in tree["figures"]],
+        )
+        conn.execute("INSERT INTO rules_fts(rules_fts) VALUES ('optimize')")
+
+    conn.execute("VACUUM")
+    conn.close()
+    tmp_path.replace(db_path)
+    return tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export KSAE Formula rules as a JSON rule tree and a SQLite lookup database"
+    )
+    parser.add_argument(
+        "--tex",
+        default=str(Path(__file__).parent / "formula.tex"),
+        help="Path to formula.tex (default: ./formula.tex)",
+    )
+    parser.add_argument("--json", default="formula.rules.json",
+                        help="JSON rule tree output (default: formula.rules.json)")
+    parser.add_argument("--db", default="formula.rules.db",
+                        help="SQLite database output (default: formula.rules.db)")
+    args = parser.parse_args()
+
+    tex_path = Path(args.tex)
+    aux_path = tex_path.with_suffix(".aux")
+
+    start = time.perf_counter()
+    tex = tex_path.read_text(encoding="utf-8")
+
+    from tex2html import assign_item_anchors, get_cache_dir, load_label_index
+    if aux_path.exists():
+        aux_labels, _ = load_label_index(aux_path, get_cache_dir(tex_path))
+    else:
+        print(f"Warning: {aux_path} not found, label display numbers will be empty")
+        aux_labels = {}
+    item_anchors = assign_item_anchors(tex)[1]
+
+    tree = build_rule_tree(tex, aux_labels, item_anchors)
+    meta = {
+        "title": "Formula Student Korea 차량기술규정",
+        "source": tex_path.name,
+        "source_sha256": hashlib.sha256(tex.encode("utf-8")).hexdigest(),
+    }
+
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump({**meta, **tree}, f, ensure_ascii=False, indent=1)
+    tokenizer = write_database(tree, Path(args.db), meta)
+
+    sections = sum(len(c["sections"]) for c in tree["chapters"])
+    items = sum(len(s["items"]) for c in tree["chapters"] for s in c["sections"])
+    print(f"Exported {len(tree['chapters'])} chapters, {sections} sections, {items} items, "
+          f"{len(tree['labels'])} labels, {len(tree['figures'])} figures "
+          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"Wrote {args.json} and {args.db} (FTS5 tokenizer: {tokenizer})")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
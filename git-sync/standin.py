@@ -0,0 +1,147 @@
+"""
+Local stand-in for the Overleaf endpoints sync.py uses: /login with CSRF tokens and an
+overleaf.sid session, /project/<id>/updates and /project/<id>/download/zip serving a
+directory. The project version is bumped whenever a file under the directory changes.
+
+    python3 standin.py ../some-project-dir --port 8081
+    DOMAIN=http://127.0.0.1:8081 PROJECT_ID=test EMAIL=user@example.com PASSWORD=secret python3 sync.py --daemon
+"""
+
+import io
+import json
+import time
+import uuid
+import zipfile
+import argparse
+import threading
+import urllib.parse
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Project:
+    """Project files served as the zip, with a version bumped on every edit."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.lock = threading.Lock()
+        self.version = 1
+        self.snapshot = self.scan()
+
+    def scan(self):
+        return {str(p.relative_to(self.root)): p.stat().st_mtime_ns
+                for p in sorted(self.root.rglob("*")) if p.is_file()}
+
+    def current_version(self):
+        with self.lock:
+            snapshot = self.scan()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                self.version += 1
+            return self.version
+
+    def zip_bytes(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            for name in sorted(self.scan()):
+                info = zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                z.writestr(info, (self.root / name).read_bytes())
+        return buf.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "StandIn/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def session(self):
+        cookies = {}
+        for part in self.headers.get("Cookie", "").split(";"):
+            if "=" in part:
+                k, v = part.strip().split("=", 1)
+                cookies[k] = v
+        sid = cookies.get("overleaf.sid")
+        return sid if sid in self.server.sessions else None
+
+    def send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def login_page(self, token, status=200, headers=()):
+        body = f'<html><head><meta name="ol-csrfToken" content="{token}"></head><body>login</body></html>'
+        self.send(status, body.encode(), headers=headers)
+
+    def redirect_to_login(self):
+        self.send(302, headers=[("Location", "/login")])
+
+    def do_GET(self):
+        stats = self.server.stats
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path
+        stats[path.split("/")[-1] or "/"] = stats.get(path.split("/")[-1] or "/", 0) + 1
+
+        if path == "/__stats":
+            return self.send(200, json.dumps(stats).encode(), "application/json")
+        if path == "/login":
+            token = str(uuid.uuid4())
+            self.server.tokens.add(token)
+            return self.login_page(token)
+
+        project = f"/project/{self.server.project_id}"
+        if path in (f"{project}/updates", f"{project}/download/zip"):
+            if self.session() is None:
+                return self.redirect_to_login()
+            if path.endswith("/updates"):
+                version = self.server.project.current_version()
+                body = json.dumps({"updates": [{"fromV": version - 1, "toV": version,
+                                                "meta": {"end_ts": int(time.time() * 1000)}}]})
+                return self.send(200, body.encode(), "application/json")
+            return self.send(200, self.server.project.zip_bytes(), "application/zip")
+
+        self.send(404, b"not found")
+
+    def do_POST(self):
+        self.server.stats["POST " + self.path] = self.server.stats.get("POST " + self.path, 0) + 1
+        if self.path != "/login":
+            return self.send(404, b"not found")
+        length = int(self.headers.get("Content-Length", 0))
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        email = form.get("email", [""])[0]
+        password = form.get("password", [""])[0]
+        token = form.get("_csrf", [""])[0]
+        if token not in self.server.tokens or (email, password) != self.server.credentials:
+            return self.send(403, b"forbidden")
+        sid = uuid.uuid4().hex
+        self.server.sessions.add(sid)
+        new_token = str(uuid.uuid4())
+        self.server.tokens.add(new_token)
+        self.login_page(new_token, headers=[("Set-Cookie", f"overleaf.sid={sid}; Path=/; HttpOnly")])
+
+
+def make_server(root, project_id="test", email="user@example.com", password="secret", port=0, verbose=False):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.project = Project(root)
+    server.project_id = project_id
+    server.credentials = (email, password)
+    server.sessions = set()
+    server.tokens = set()
+    server.stats = {}
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a directory as a fake Overleaf project")
+    parser.add_argument("root", help="Directory served as the project zip")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--project-id", default="test")
+    args = parser.parse_args()
+    make_server(args.root, project_id=args.project_id, port=args.port, verbose=True).serve_forever()
@@ -1,5 +1,17 @@
+import os
 import re
+import json
+import time
+import zlib
+import shlex
+import random
+import hashlib
+import argparse
+import threading
+import subprocess
+import shutil
 import zipfile
+import tempfile
 import requests
 import urllib.parse
 from lxml import html
@@ -9,6 +21,24 @@ from environs import Env
 env = Env()
 env.read_env()
 
+CHUNK_SIZE = 1024 * 1024
+REQUEST_TIMEOUT = 60  # seconds to connect / between received bytes
+
+# Session cookie, CSRF token and last synced project version, kept between runs
+STATE_FILE = Path(__file__).with_name(".sync-state.json")
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Daemon: downstream stages, in run order, with the synced paths (or prefixes) that trigger them
+STAGES = {
+    "html": ("formula.tex", "template.tex", "assets/"),
+    "index": ("formula.tex",),
+}
+STAGE_COMMANDS = {
+    "html": env("BUILD_COMMAND", "make html"),
+    "index": env("INDEX_COMMAND", "python3 indexer.py --incremental"),
+}
+
 class Client:
     def __init__(self, *, domain="", project_id="", username="", password=""):
         if domain == "" or project_id == "" or username == "" or password == "":
@@ -20,26 +50,166 @@ class Client:
         self.password = password
 
         self.client = requests.session()
-        self.login_data, self.cookie = self.authenticate()
+        self.state = self.load_state()
+
+        if self.state.get("cookies") and self.state.get("csrf"):
+            # Reuse the previous session; request() logs in again if it has expired
+            self.client.cookies.update(self.state["cookies"])
+            self.csrf = self.state["csrf"]
+            self.login_data = dict(email=self.username, _csrf=self.csrf)
+            self.cookie = {"overleaf.sid": self.state["cookies"].get("overleaf.sid")}
+        else:
+            self.login_data, self.cookie = self.authenticate()
+            self.save_state()
+
+    def load_state(self):
+        try:
+            with open(STATE_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # A state file written for another account or project is ignored
+        if state.get("domain") != self.domain or state.get("email") != self.username \
+                or state.get("project_id") != self.project_id:
+            return {}
+        return state
+
+    def save_state(self):
+        self.state.update(
+            domain=self.domain,
+            email=self.username,
+            project_id=self.project_id,
+            cookies=requests.utils.dict_from_cookiejar(self.client.cookies),
+            csrf=self.login_data.get("_csrf"),
+        )
+        tmp = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, STATE_FILE)
+
+    @staticmethod
+    def needs_login(r):
+        """True for 401/403 or when the request ended up on the login page."""
+        return r.status_code in (401, 403) or urllib.parse.urlsplit(r.url).path.rstrip("/") == "/login"
+
+    def request(self, method, path, **kwargs):
+        """Request with the stored session, logging in again (once) when it has expired."""
+        url = urllib.parse.urljoin(self.domain, path)
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+        r = self.client.request(method, url, **kwargs)
+        if self.needs_login(r):
+            print("Session expired, logging in again")
+            r.close()
+            self.login_data, self.cookie = self.authenticate()
+            self.save_state()
+            r = self.client.request(method, url, **kwargs)
+        return r
+
+    def project_version(self):
+        """Latest history version of the project, or None when the updates endpoint isn't available."""
+        try:
+            r = self.request("GET", f"/project/{self.project_id}/updates", params={"min_count": 1})
+            if r.status_code != 200:
+                return None
+            updates = r.json().get("updates") or []
+        except (requests.RequestException, ValueError, AttributeError):
+            return None
+        if not updates:
+            return None
+        latest = updates[0]
+        version = latest.get("toV")
+        return version if version is not None else latest.get("meta", {}).get("end_ts")
+
+    def sync(self, target="../"):
+        """
+        Download the project zip and write only the entries whose size or CRC32 differ
+        from the working tree, each atomically. Returns {"added": [...], "modified": [...],
+        "unchanged": n} so callers can skip work when nothing changed.
+        The download is skipped when the project history version is the one last synced,
+        and extraction is skipped when the zip hashes the same as last time.
+        """
+        changes = {"added": [], "modified": [], "unchanged": 0}
+
+        version = self.project_version()
+        if version is not None and version == self.state.get("version"):
+            print(f"Project unchanged (version {version}), skipping download")
+            return changes
+
+        r = self.request("GET", f"/project/{self.project_id}/download/zip", stream=True)
+        r.raise_for_status()
+
+        root = Path(target).resolve()
+
+        with tempfile.TemporaryFile() as f:
+            digest = hashlib.sha256()
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+            f.seek(0)
+
+            if digest.hexdigest() == self.state.get("zip_sha256"):
+                print("Project zip unchanged, skipping extraction")
+                self.state["version"] = version
+                self.save_state()
+                return changes
+
+            with zipfile.ZipFile(f) as zip_file:
+                for info in zip_file.infolist():
+                    if info.is_dir():
+                        continue
 
-    def sync(self):
-        r = self.client.get(f"{self.domain}/project/{self.project_id}/download/zip", stream=True)
-        zip = Path(f"{self.project_id}.zip")
+                    dest = (root / info.filename).resolve()
+                    if not dest.is_relative_to(root):
+                        raise Exception(f"Refusing to write outside {root}: {info.filename}")
 
-        with open(zip, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+                    if dest.exists():
+                        if self.unchanged(dest, info):
+                            changes["unchanged"] += 1
+                            continue
+                        changes["modified"].append(info.filename)
+                    else:
+                        changes["added"].append(info.filename)
 
-        with zipfile.ZipFile(zip) as zip_file:
-            zip_file.extractall('../')
+                    self.write_atomic(zip_file, info, dest)
 
-        zip.unlink()
+        self.state.update(version=version, zip_sha256=digest.hexdigest())
+        self.save_state()
+
+        for kind in ("added", "modified"):
+            for name in changes[kind]:
+                print(f"{kind}: {name}")
+        print(f"{len(changes['added'])} added, {len(changes['modified'])} modified, {changes['unchanged']} unchanged")
+        return changes
+
+    @staticmethod
+    def unchanged(path, info):
+        """Compare a working tree file with a zip entry by size, then CRC32."""
+        if path.stat().st_size != info.file_size:
+            return False
+        crc = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+        return crc == info.CRC
+
+    @staticmethod
+    def write_atomic(zip_file, info, dest):
+        """Extract one entry next to dest and rename it into place."""
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out, zip_file.open(info) as src:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            os.chmod(tmp, dest.stat().st_mode & 0o777 if dest.exists() else 0o644)
+            os.replace(tmp, dest)
+        except BaseException:
+            os.unlink(tmp)
+            raise
 
     def authenticate(self, login_path="/login"):
         login_url = urllib.parse.urljoin(self.domain, login_path)
 
-        r = self.client.get(login_url, verify=True)
+        r = self.client.get(login_url, verify=True, timeout=REQUEST_TIMEOUT)
         csrf = self.get_csrf_Token(r.text)
 
         if csrf is None:
@@ -48,7 +218,7 @@ class Client:
         self.csrf = csrf
         self.login_data = dict(email=self.username, password=self.password, _csrf=self.csrf)
 
-        r = self.client.post(login_url, data=self.login_data, verify=True)
+        r = self.client.post(login_url, data=self.login_data, verify=True, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
 
         csrf = self.get_csrf_Token(r.text)
@@ -73,5 +243,104 @@ class Client:
                     return meta[0].get("content")
         return None
 
-client = Client(domain=env("DOMAIN"), project_id=env("PROJECT_ID"), username=env("EMAIL"), password=env("PASSWORD"))
-client.sync()
+
+def affected_stages(changes):
+    """Downstream stages whose inputs are among the added/modified paths."""
+    paths = changes["added"] + changes["modified"]
+    return [stage for stage, triggers in STAGES.items()
+            if any(path == t or (t.endswith("/") and path.startswith(t)) for path in paths for t in triggers)]
+
+
+class JobQueue:
+    """
+    Debounced stage runner: a submitted stage runs once no further submit arrived for
+    `debounce` seconds, so a burst of syncs triggers one build. Stages run one at a
+    time in STAGES order on a worker thread.
+    """
+
+    def __init__(self, commands, debounce=30.0, cwd=REPO_ROOT):
+        self.commands = commands
+        self.debounce = debounce
+        self.cwd = cwd
+        self.pending = set()
+        self.deadline = None
+        self.cond = threading.Condition()
+        self.runs = []
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def submit(self, stages):
+        with self.cond:
+            self.pending.update(stages)
+            self.deadline = time.monotonic() + self.debounce
+            self.cond.notify()
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.pending or time.monotonic() < self.deadline:
+                    self.cond.wait(None if not self.pending else self.deadline - time.monotonic())
+                stages = [stage for stage in STAGES if stage in self.pending]
+                self.pending.clear()
+
+            for stage in stages:
+                command = self.commands.get(stage)
+                if not command:
+                    continue
+                print(f"Running {stage}: {command}")
+                start = time.monotonic()
+                result = subprocess.run(shlex.split(command), cwd=self.cwd)
+                self.runs.append((stage, result.returncode))
+                print(f"{stage} finished with exit code {result.returncode} in {time.monotonic() - start:.1f}s")
+                if result.returncode != 0:
+                    break  # later stages depend on this one
+
+
+def daemon(make_client, interval=60.0, jitter=0.1, max_backoff=900.0, queue=None, target=REPO_ROOT, stop=None):
+    """
+    Poll Overleaf every interval (±jitter) seconds, reusing one logged-in client.
+    Failures back off exponentially (with full jitter) up to max_backoff. Synced changes
+    are handed to the job queue as the stages they affect.
+    """
+    stop = stop or threading.Event()
+    client = None
+    failures = 0
+
+    while not stop.is_set():
+        try:
+            if client is None:
+                client = make_client()
+            changes = client.sync(target)
+            failures = 0
+            stages = affected_stages(changes)
+            if stages and queue is not None:
+                print(f"Queued: {', '.join(stages)}")
+                queue.submit(stages)
+            delay = interval * random.uniform(1 - jitter, 1 + jitter)
+        except Exception as e:
+            failures += 1
+            delay = random.uniform(0, min(max_backoff, interval * 2 ** failures))
+            print(f"Sync failed ({failures}): {e}; retrying in {delay:.0f}s")
+        stop.wait(delay)
+
+
+def make_client():
+    return Client(domain=env("DOMAIN"), project_id=env("PROJECT_ID"), username=env("EMAIL"), password=env("PASSWORD"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the Overleaf project into this repository")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep polling and run the affected build/index stages after changes")
+    parser.add_argument("--interval", type=float, default=env.float("SYNC_INTERVAL", 60.0),
+                        help="Seconds between polls (default: 60)")
+    parser.add_argument("--debounce", type=float, default=env.float("SYNC_DEBOUNCE", 30.0),
+                        help="Quiet seconds before queued stages run (default: 30)")
+    args = parser.parse_args()
+
+    if args.daemon:
+        try:
+            daemon(make_client, args.interval, queue=JobQueue(STAGE_COMMANDS, args.debounce))
+        except KeyboardInterrupt:
+            pass
+    else:
+        make_client().sync()
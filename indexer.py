@@ -6,7 +6,11 @@ Parses formula.tex, chunks by section/item hierarchy, and indexes into Qdrant.
 
 import argparse
 import hashlib
+import json
+import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 
@@ -14,9 +18,40 @@ from pathlib import Path
 # Configuration
 QDRANT_URL = "https://vectordb.luftaquila.io"
 COLLECTION_NAME = "ksae-formula-rules"
+DEFAULT_DOCUMENT_ID = "ksae-formula"  # also the point-id namespace of the single-document index
+DEFAULT_DOCUMENT_TITLE = "Formula Student Korea 차량기술규정"
 EMBEDDING_MODEL = "BAAI/bge-m3"
 EMBEDDING_DIM = 1024
 
+# Upload
+UPLOAD_BATCH = 100  # points per upsert request
+UPLOAD_CONCURRENCY = 1  # in-flight upsert requests; >1 switches to the async client
+UPLOAD_RETRIES = 5
+UPLOAD_BACKOFF = 0.5  # seconds, doubled on every retry
+GRPC_PORT = 6334
+CONSISTENCY_TIMEOUT = 300  # seconds to wait for unacknowledged writes to land
+
+# Hierarchical search: centroids live in "<collection>-sections"
+HIERARCHY_SUFFIX = "-sections"
+SECTION_FANOUT = 8  # sections whose chunks are scored in the second stage
+RECALL_FANOUTS = (2, 4, 8, 16)
+
+# Citation lookup map written at index time (see --citations)
+CITATIONS_SUFFIX = ".citations.json"
+CITATIONS_FORMAT = 2  # bumped when the citation map layout changes; older maps are ignored
+
+# Optional cross-encoder rerank of the first-stage candidates
+RERANK_MODEL = "BAAI/bge-reranker-v2-m3"
+RERANK_CANDIDATES = 20
+RERANK_BATCH = 8
+RERANK_BUDGET_MS = 300  # scoring time per query; model loading is not counted
+RERANK_CACHE = Path(__file__).parent / ".rerank-cache.sqlite"
+
+# Exported query encoder (see --export-encoder)
+ENCODER_DIR = Path(__file__).parent / "encoder"
+ENCODER_MAX_TOKENS = 512  # queries are short; chunks stay under MAX_CHUNK_TOKENS
+ONNX_OPSET = 17
+
 # Chunking
 MAX_CHUNK_TOKENS = 512  # target max tokens per chunk (approx)
 # Korean chars ≈ 1~2 tokens each; conservative estimate: 1 char ≈ 1.5 tokens
@@ -142,7 +177,12 @@ def detect_applies_to(title: str, content: str) -> list[str]:
 def parse_sections(tex_path: str) -> list[Section]:
     """Parse LaTeX file into sections."""
     with open(tex_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+        return parse_sections_text(f.read())
+
+
+def parse_sections_text(text: str) -> list[Section]:
+    """Parse LaTeX source text (e.g. formula.tex at a git revision) into sections."""
+    lines = text.splitlines(keepends=True)
 
     sections = []
     current_chapter = ""
@@ -215,17 +255,73 @@ def parse_sections(tex_path: str) -> list[Section]:
 
 # ── Chunking ───────────────────────────────────────────────────────────────
 
-@dataclass
-class Chunk:
-    text: str
+@dataclass(frozen=True, slots=True)
+class SectionMeta:
+    """Per-section fields, shared by every chunk of the section."""
+    document: str
     chapter: str
     chapter_num: int
     section: str
     section_num: int
-    item_range: str
-    applies_to: list[str]
+    applies_to: tuple[str, ...]
     source_lines: str
 
+    @classmethod
+    def of(cls, section: Section, document: str = DEFAULT_DOCUMENT_ID) -> "SectionMeta":
+        return cls(
+            document=sys.intern(document),
+            chapter=sys.intern(section.chapter),
+            chapter_num=section.chapter_num,
+            section=sys.intern(section.section_title),
+            section_num=section.section_num,
+            applies_to=tuple(sys.intern(a) for a in section.applies_to),
+            source_lines=f"{section.start_line}-{section.end_line}",
+        )
+
+
+@dataclass(slots=True)
+class Chunk:
+    text: str
+    meta: SectionMeta
+    item_range: str
+
+    @property
+    def chapter(self) -> str:
+        return self.meta.chapter
+
+    @property
+    def chapter_num(self) -> int:
+        return self.meta.chapter_num
+
+    @property
+    def section(self) -> str:
+        return self.meta.section
+
+    @property
+    def section_num(self) -> int:
+        return self.meta.section_num
+
+    @property
+    def applies_to(self) -> list[str]:
+        return list(self.meta.applies_to)
+
+    @property
+    def source_lines(self) -> str:
+        return self.meta.source_lines
+
+    def payload(self) -> dict:
+        return {
+            "content": self.text,
+            "document": self.meta.document,
+            "chapter": self.meta.chapter,
+            "chapter_num": self.meta.chapter_num,
+            "section": self.meta.section,
+            "section_num": self.meta.section_num,
+            "item_range": self.item_range,
+            "applies_to": list(self.meta.applies_to),
+            "source_lines": self.meta.source_lines,
+        }
+
 
 def estimate_tokens(text: str) -> int:
     return int(len(text) / CHARS_PER_TOKEN)
@@ -285,10 +381,74 @@ def split_section_by_items(content: str) -> list[tuple[str, str]]:
     return items
 
 
-def chunk_section(section: Section) -> list[Chunk]:
+LIST_TOKEN_PATTERN = re.compile(r'\\(begin|end)\{(enumerate|itemize|description)\}|\\item\b')
+
+
+@dataclass(slots=True)
+class Clause:
+    """A 항: an \\item of one of the section's top-level enumerate lists."""
+    list_num: int    # 1 for the section's first top-level list, 2 for the next, ...
+    number: int      # 항 number; restarts with every list, like \\arabic*항 in template.tex
+    chunk_items: tuple[int, int]  # first and last split_section_by_items item it spans (chunk item ranges)
+    content: str
+
+    @property
+    def path(self) -> str:
+        """Item path of tex2html's item anchors: "3", or "l2-3" in a later list."""
+        return f"l{self.list_num}-{self.number}" if self.list_num > 1 else str(self.number)
+
+
+def split_section_clauses(content: str) -> list[Clause]:
+    """
+    Split section content into its 항, numbered as the PDF numbers them: only the \\items
+    of top-level enumerate lists count, from 1 in each list. Nested lists and itemize
+    bullets stay in the text of their item, and text after a list (tables, notes) in
+    that of the list's last item. Text before the first item is not part of any 항.
+    """
+    clauses = []
+    lines: list[list[str]] = []
+    stack = []  # open list environments
+    list_num = number = 0
+    walk_started, walk_depth, walk_item = False, 0, 0  # split_section_by_items' line-based count
+
+    for line in content.split('\n'):
+        if re.search(r'\\begin\{enumerate\}', line):
+            walk_depth = walk_depth + 1 if walk_started else 1
+            walk_started = True
+        if re.search(r'\\end\{enumerate\}', line):
+            walk_depth = max(walk_depth - 1, 0)
+        if walk_depth == 1 and re.match(r'\s*\\item\b', line):
+            walk_item += 1
+
+        for match in LIST_TOKEN_PATTERN.finditer(line):
+            if match.group(1) == 'begin':
+                if match.group(2) == 'enumerate' and 'enumerate' not in stack:
+                    list_num += 1
+                    number = 0
+                stack.append(match.group(2))
+            elif match.group(1) == 'end':
+                if stack:
+                    stack.pop()
+            elif stack and stack[-1] == 'enumerate' and stack.count('enumerate') == 1:
+                number += 1
+                clauses.append(Clause(list_num, number, (walk_item, walk_item), ""))
+                lines.append([])
+        if lines:
+            lines[-1].append(line)
+
+    for i, (clause, clause_lines) in enumerate(zip(clauses, lines)):
+        clause.content = '\n'.join(clause_lines)
+        last = clauses[i + 1].chunk_items[0] - 1 if i + 1 < len(clauses) else walk_item
+        clause.chunk_items = (clause.chunk_items[0], max(last, clause.chunk_items[0]))
+    return clauses
+
+
+def chunk_section(section: Section, document: str = DEFAULT_DOCUMENT_ID,
+                  document_title: str = DEFAULT_DOCUMENT_TITLE) -> list[Chunk]:
     """Chunk a section into appropriately sized pieces."""
+    meta = SectionMeta.of(section, document)
     clean_content = strip_latex(section.raw_content)
-    prefix = f"[Formula Student Korea 차량기술규정] 제{section.chapter_num}장 {section.chapter} > {section.section_title}\n\n"
+    prefix = f"[{document_title}] 제{section.chapter_num}장 {section.chapter} > {section.section_title}\n\n"
 
     total_tokens = estimate_tokens(prefix + clean_content)
 
@@ -296,13 +456,8 @@ def chunk_section(section: Section) -> list[Chunk]:
     if total_tokens <= MAX_CHUNK_TOKENS:
         return [Chunk(
             text=prefix + clean_content,
-            chapter=section.chapter,
-            chapter_num=section.chapter_num,
-            section=section.section_title,
-            section_num=section.section_num,
+            meta=meta,
             item_range="all",
-            applies_to=section.applies_to,
-            source_lines=f"{section.start_line}-{section.end_line}",
         )]
 
     # Split by top-level items
@@ -311,13 +466,8 @@ def chunk_section(section: Section) -> list[Chunk]:
     if not items:
         return [Chunk(
             text=prefix + clean_content,
-            chapter=section.chapter,
-            chapter_num=section.chapter_num,
-            section=section.section_title,
-            section_num=section.section_num,
+            meta=meta,
             item_range="all",
-            applies_to=section.applies_to,
-            source_lines=f"{section.start_line}-{section.end_line}",
         )]
 
     # Group items into chunks that fit within token limit
@@ -335,13 +485,8 @@ def chunk_section(section: Section) -> list[Chunk]:
             # Flush current group
             chunks.append(Chunk(
                 text=prefix + current_text,
-                chapter=section.chapter,
-                chapter_num=section.chapter_num,
-                section=section.section_title,
-                section_num=section.section_num,
+                meta=meta,
                 item_range=f"{current_item_start}-{current_item_end}",
-                applies_to=section.applies_to,
-                source_lines=f"{section.start_line}-{section.end_line}",
             ))
             current_items = []
             current_text = ""
@@ -358,13 +503,8 @@ def chunk_section(section: Section) -> list[Chunk]:
     if current_items:
         chunks.append(Chunk(
             text=prefix + current_text,
-            chapter=section.chapter,
-            chapter_num=section.chapter_num,
-            section=section.section_title,
-            section_num=section.section_num,
+            meta=meta,
             item_range=f"{current_item_start}-{current_item_end}",
-            applies_to=section.applies_to,
-            source_lines=f"{section.start_line}-{section.end_line}",
         ))
 
     # Handle oversized single items - split by paragraphs
@@ -395,13 +535,8 @@ def split_oversized_chunk(chunk: Chunk, prefix: str) -> list[Chunk]:
         if estimate_tokens(prefix + candidate) > MAX_CHUNK_TOKENS and current_text:
             sub_chunks.append(Chunk(
                 text=prefix + current_text,
-                chapter=chunk.chapter,
-                chapter_num=chunk.chapter_num,
-                section=chunk.section,
-                section_num=chunk.section_num,
+                meta=chunk.meta,
                 item_range=f"{chunk.item_range} (part {part})",
-                applies_to=chunk.applies_to,
-                source_lines=chunk.source_lines,
             ))
             current_text = para
             part += 1
@@ -411,88 +546,1074 @@ def split_oversized_chunk(chunk: Chunk, prefix: str) -> list[Chunk]:
     if current_text:
         sub_chunks.append(Chunk(
             text=prefix + current_text,
-            chapter=chunk.chapter,
-            chapter_num=chunk.chapter_num,
-            section=chunk.section,
-            section_num=chunk.section_num,
+            meta=chunk.meta,
             item_range=f"{chunk.item_range} (part {part})" if part > 1 else chunk.item_range,
-            applies_to=chunk.applies_to,
-            source_lines=chunk.source_lines,
         ))
 
     return sub_chunks if sub_chunks else [chunk]
 
 
+# ── Corpus ─────────────────────────────────────────────────────────────────
+
+@dataclass
+class Document:
+    id: str
+    title: str
+    tex: str
+
+
+def load_manifest(path: str) -> tuple[str, list[Document]]:
+    """
+    Read a corpus manifest:
+        {"collection": "...", "documents": [{"id": "...", "title": "...", "tex": "path.tex"}, ...]}
+    tex paths are relative to the manifest. Returns (collection, documents).
+    """
+    manifest_path = Path(path)
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    documents = []
+    for entry in manifest["documents"]:
+        tex = Path(entry["tex"])
+        if not tex.is_absolute():
+            tex = manifest_path.parent / tex
+        documents.append(Document(id=entry["id"], title=entry["title"], tex=str(tex)))
+
+    ids = [d.id for d in documents]
+    duplicates = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicates:
+        raise ValueError(f"{path}: duplicate document ids: {', '.join(duplicates)}")
+    return manifest.get("collection", COLLECTION_NAME), documents
+
+
+def chunk_document(document: Document) -> tuple[Document, int, list[Chunk], str]:
+    """
+    Parse and chunk one document (runs in a worker process).
+    Returns (document, section count, chunks, digest of the chunk texts and payload fields).
+    """
+    sections = parse_sections(document.tex)
+    chunks = []
+    for section in sections:
+        chunks.extend(chunk_section(section, document.id, document.title))
+
+    digest = hashlib.sha256(EMBEDDING_MODEL.encode())
+    for chunk in chunks:
+        digest.update(json.dumps(chunk.payload(), ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return document, len(sections), chunks, digest.hexdigest()
+
+
+def chunk_corpus(documents: list[Document], workers: int | None = None) -> list[tuple[Document, int, list[Chunk], str]]:
+    """Chunk every document, in parallel worker processes when there is more than one."""
+    workers = min(len(documents), workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [chunk_document(d) for d in documents]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(chunk_document, documents))
+
+
 # ── Indexing ───────────────────────────────────────────────────────────────
 
-def generate_point_id(chapter: int, section: int, chunk_index: int) -> int:
-    hash_input = f"ksae-formula:{chapter}:{section}:{chunk_index}"
+def generate_point_id(chapter: int, section: int, chunk_index: int, document: str = DEFAULT_DOCUMENT_ID) -> int:
+    hash_input = f"{document}:{chapter}:{section}:{chunk_index}"
     hash_bytes = hashlib.md5(hash_input.encode()).digest()
     return int.from_bytes(hash_bytes[:8], byteorder="big") & 0x7FFFFFFFFFFFFFFF
 
 
-def index_chunks(client, model, chunks: list[Chunk], recreate: bool = False, batch_size: int = 8) -> None:
-    """Embed chunks and upload to Qdrant."""
-    from qdrant_client.models import Distance, VectorParams, PointStruct
+@dataclass
+class QdrantConnection:
+    url: str
+    api_key: str | None = None
+    grpc: bool = False
+    grpc_port: int = GRPC_PORT
+
+    def _options(self) -> dict:
+        return dict(
+            host=self.url.replace("https://", "").replace("http://", "").rstrip("/"),
+            port=443,
+            grpc_port=self.grpc_port,
+            https=self.url.startswith("https"),
+            api_key=self.api_key,
+            prefer_grpc=self.grpc,
+            timeout=60,
+        )
+
+    def client(self):
+        from qdrant_client import QdrantClient
+        return QdrantClient(**self._options())
+
+    def async_client(self):
+        from qdrant_client import AsyncQdrantClient
+        return AsyncQdrantClient(**self._options())
+
+
+def is_transient(error: Exception) -> bool:
+    """Network failures, 429 and 5xx responses, and the equivalent gRPC status codes."""
+    from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+    if isinstance(error, (ResponseHandlingException, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code == 429 or error.status_code >= 500
+    try:
+        import grpc
+    except ImportError:
+        return False
+    if isinstance(error, grpc.RpcError):
+        return error.code() in (
+            grpc.StatusCode.UNAVAILABLE,
+            grpc.StatusCode.DEADLINE_EXCEEDED,
+            grpc.StatusCode.RESOURCE_EXHAUSTED,
+        )
+    return False
+
+
+def embed_chunks(model, chunks: list[Chunk], batch_size: int = 8):
+    """Embed chunk texts into one contiguous (len(chunks), EMBEDDING_DIM) float32 matrix."""
+    import numpy as np
     from tqdm import tqdm
 
+    vectors = np.empty((len(chunks), EMBEDDING_DIM), dtype=np.float32)
+    for i in tqdm(range(0, len(chunks), batch_size), desc="Embedding"):
+        batch = [c.text for c in chunks[i:i + batch_size]]
+        vectors[i:i + len(batch)] = model.encode(batch, show_progress_bar=False)
+    return vectors
+
+
+def point_batches(ids: list[int], vectors, chunks: list[Chunk], upload_batch: int = UPLOAD_BATCH,
+                  document_hashes: dict[str, str] | None = None):
+    """
+    Yield PointStruct batches built from row slices of the vector matrix, so
+    Python float lists and payload dicts only ever exist for one batch.
+    """
+    from qdrant_client.models import PointStruct
+
+    document_hashes = document_hashes or {}
+    for start in range(0, len(chunks), upload_batch):
+        end = min(start + upload_batch, len(chunks))
+        rows = vectors[start:end].tolist()
+        batch = []
+        for i in range(start, end):
+            payload = chunks[i].payload()
+            if payload["document"] in document_hashes:
+                payload["document_hash"] = document_hashes[payload["document"]]
+            batch.append(PointStruct(id=ids[i], vector=rows[i - start], payload=payload))
+        yield batch
+
+
+def document_filter(document_ids, document_hash: str | None = None):
+    """Qdrant filter on the `document` payload (and optionally `document_hash`)."""
+    from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue
+
+    must = [FieldCondition(key="document", match=MatchAny(any=list(document_ids)))]
+    if document_hash is not None:
+        must.append(FieldCondition(key="document_hash", match=MatchValue(value=document_hash)))
+    return Filter(must=must)
+
+
+def hierarchy_collection(collection: str) -> str:
+    return collection + HIERARCHY_SUFFIX
+
+
+def section_key_filter(document: str, chapter_num: int, section_num: int | None = None):
+    """Filter matching one chapter (or one section of it) of a document."""
+    from qdrant_client.models import FieldCondition, Filter, MatchValue
+
+    must = [
+        FieldCondition(key="document", match=MatchValue(value=document)),
+        FieldCondition(key="chapter_num", match=MatchValue(value=chapter_num)),
+    ]
+    if section_num is not None:
+        must.append(FieldCondition(key="section_num", match=MatchValue(value=section_num)))
+    return Filter(must=must)
+
+
+def centroid_points(chunks: list[Chunk], vectors) -> list:
+    """
+    Section and chapter centroids: the L2-normalized mean of the section's chunk
+    vectors, and of the chapter's section centroids.
+    """
+    import numpy as np
+    from qdrant_client.models import PointStruct
+
+    sections: dict[tuple, list[int]] = {}
+    for row, chunk in enumerate(chunks):
+        sections.setdefault((chunk.meta.document, chunk.chapter_num, chunk.section_num), []).append(row)
+
+    def normalize(v):
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    points = []
+    chapters: dict[tuple, list] = {}
+    for (document, chapter_num, section_num), rows in sections.items():
+        meta = chunks[rows[0]].meta
+        centroid = normalize(vectors[rows].mean(axis=0))
+        chapters.setdefault((document, chapter_num), []).append(centroid)
+        points.append(PointStruct(
+            id=generate_point_id(chapter_num, section_num, 0, f"{document}:section"),
+            vector=centroid.tolist(),
+            payload={"level": "section", "document": document, "chapter_num": chapter_num,
+                     "chapter": meta.chapter, "section_num": section_num, "section": meta.section,
+                     "chunks": len(rows)},
+        ))
+    for (document, chapter_num), centroids in chapters.items():
+        points.append(PointStruct(
+            id=generate_point_id(chapter_num, 0, 0, f"{document}:chapter"),
+            vector=normalize(np.mean(centroids, axis=0)).tolist(),
+            payload={"level": "chapter", "document": document, "chapter_num": chapter_num,
+                     "sections": len(centroids)},
+        ))
+    return points
+
+
+def upload_points(client, batches, total: int, collection: str = COLLECTION_NAME) -> None:
+    """Sequential upload, waiting for each batch to be applied."""
+    from tqdm import tqdm
+
+    progress = tqdm(total=total, desc="Uploading")
+    for batch in batches:
+        client.upsert(collection_name=collection, points=batch)
+        progress.update(len(batch))
+    progress.close()
+
+
+async def upload_points_async(connection: QdrantConnection, batches, total: int, concurrency: int = 4,
+                              collection: str = COLLECTION_NAME, count_filter=None) -> None:
+    """
+    Upload with up to `concurrency` upserts in flight. Batches are sent with
+    wait=False and retried with exponential backoff on transient errors; the
+    upload finishes with a barrier that waits until every point is readable
+    (counting only points matching count_filter, when given).
+    """
+    import asyncio
+    from tqdm import tqdm
+
+    client = connection.async_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=total, desc="Uploading")
+    pending = set()
+
+    async def send(batch: list) -> None:
+        try:
+            for attempt in range(UPLOAD_RETRIES + 1):
+                try:
+                    await client.upsert(collection_name=collection, points=batch, wait=False)
+                    break
+                except Exception as e:
+                    if attempt == UPLOAD_RETRIES or not is_transient(e):
+                        raise
+                    delay = UPLOAD_BACKOFF * 2 ** attempt
+                    tqdm.write(f"Upsert failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+            progress.update(len(batch))
+        finally:
+            semaphore.release()
+
+    try:
+        # The next batch is only built once a slot frees up, so at most `concurrency` exist at a time
+        for batch in batches:
+            await semaphore.acquire()
+            pending.add(asyncio.ensure_future(send(batch)))
+            done = {task for task in pending if task.done()}
+            for task in done:
+                task.result()
+            pending -= done
+        await asyncio.gather(*pending)
+        progress.close()
+
+        # Consistency barrier: unacknowledged upserts are queued server-side
+        print("Waiting for writes to be applied...")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONSISTENCY_TIMEOUT
+        while True:
+            count = (await client.count(collection_name=collection, count_filter=count_filter, exact=True)).count
+            if count >= total:
+                break
+            if loop.time() > deadline:
+                raise TimeoutError(f"only {count}/{total} points visible after {CONSISTENCY_TIMEOUT}s")
+            await asyncio.sleep(0.5)
+    finally:
+        for task in pending:
+            task.cancel()
+        progress.close()
+        await client.close()
+
+
+def index_documents(client, model, corpus: list[tuple[Document, int, list[Chunk], str]],
+                    collection: str = COLLECTION_NAME, recreate: bool = False, incremental: bool = False,
+                    prune: bool = False, batch_size: int = 8, connection: QdrantConnection | None = None,
+                    concurrency: int = UPLOAD_CONCURRENCY, upload_batch: int = UPLOAD_BATCH) -> None:
+    """
+    Embed the chunked corpus and upload it to Qdrant (concurrently through
+    `connection` when concurrency > 1). With incremental, documents whose
+    points already carry the same document_hash are skipped, changed ones are
+    replaced, and with prune documents missing from the corpus are deleted.
+    """
+    from qdrant_client.models import Distance, FilterSelector, PayloadSchemaType, VectorParams
+
     collections = [c.name for c in client.get_collections().collections]
+    exists = collection in collections
+    sections_collection = hierarchy_collection(collection)
+
+    if exists and recreate:
+        print(f"Deleting existing collection: {collection}")
+        client.delete_collection(collection)
+        exists = False
+    if sections_collection in collections and not exists:
+        client.delete_collection(sections_collection)
+    elif exists and not incremental:
+        info = client.get_collection(collection)
+        print(f"Collection already exists: {collection} ({info.points_count} points)")
+        print("Use --recreate to rebuild or --incremental to update changed documents")
+        return
+
+    if not exists:
+        print(f"Creating collection: {collection}")
+        client.create_collection(
+            collection_name=collection,
+            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+        )
+        client.create_payload_index(collection, "document", PayloadSchemaType.KEYWORD)
+        client.create_payload_index(collection, "chapter_num", PayloadSchemaType.INTEGER)
+        client.create_payload_index(collection, "section_num", PayloadSchemaType.INTEGER)
+
+    # Indexes built before centroids existed are re-embedded in full to fill them in
+    has_hierarchy = exists and sections_collection in collections
+    if not has_hierarchy:
+        client.create_collection(
+            collection_name=sections_collection,
+            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+        )
+        client.create_payload_index(sections_collection, "level", PayloadSchemaType.KEYWORD)
+        client.create_payload_index(sections_collection, "document", PayloadSchemaType.KEYWORD)
+
+    pending = []
+    for document, _, chunks, digest in corpus:
+        if exists:
+            current = client.count(collection, count_filter=document_filter([document.id], digest), exact=True).count
+            total = client.count(collection, count_filter=document_filter([document.id]), exact=True).count
+            if has_hierarchy and current == total == len(chunks):
+                print(f"  {document.id}: unchanged ({len(chunks)} chunks)")
+                continue
+            if total:
+                print(f"  {document.id}: changed, replacing {total} points")
+                client.delete(collection, points_selector=FilterSelector(filter=document_filter([document.id])))
+            if has_hierarchy:
+                client.delete(sections_collection,
+                              points_selector=FilterSelector(filter=document_filter([document.id])))
+        pending.append((document, chunks, digest))
+
+    if exists and prune:
+        from qdrant_client.models import FieldCondition, Filter, MatchAny
+
+        indexed = [document.id for document, *_ in corpus]
+        stale = Filter(must_not=[FieldCondition(key="document", match=MatchAny(any=indexed))])
+        removed = client.count(collection, count_filter=stale, exact=True).count
+        if removed:
+            print(f"  Removing {removed} points of documents no longer in the manifest")
+            client.delete(collection, points_selector=FilterSelector(filter=stale))
+            client.delete(sections_collection, points_selector=FilterSelector(filter=stale))
+
+    if not pending:
+        print("\nNothing to index, every document is up to date")
+        return
+
+    chunks = [chunk for _, document_chunks, _ in pending for chunk in document_chunks]
+    ids = [
+        generate_point_id(chunk.chapter_num, chunk.section_num, idx, document.id)
+        for document, document_chunks, _ in pending
+        for idx, chunk in enumerate(document_chunks)
+    ]
+    hashes = {document.id: digest for document, _, digest in pending}
+
+    # Generate embeddings (one model instance for every document)
+    print(f"\nGenerating embeddings for {len(chunks)} chunks from {len(pending)} document(s)...")
+    vectors = embed_chunks(model, chunks, batch_size)
+    print(f"Embedding matrix: {vectors.shape[0]}×{vectors.shape[1]} float32 ({vectors.nbytes / 1e6:.1f} MB)")
 
-    if COLLECTION_NAME in collections:
-        if recreate:
-            print(f"Deleting existing collection: {COLLECTION_NAME}")
-            client.delete_collection(COLLECTION_NAME)
+    print("\nUploading to Qdrant...")
+    batches = point_batches(ids, vectors, chunks, upload_batch, hashes)
+    if concurrency > 1 and connection is not None:
+        import asyncio
+        asyncio.run(upload_points_async(connection, batches, len(chunks), concurrency,
+                                        collection, document_filter(hashes)))
+    else:
+        upload_points(client, batches, len(chunks), collection)
+
+    centroids = centroid_points(chunks, vectors)
+    print(f"Uploading {len(centroids)} section/chapter centroids to {sections_collection}...")
+    for i in range(0, len(centroids), upload_batch):
+        client.upsert(collection_name=sections_collection, points=centroids[i:i + upload_batch])
+
+    info = client.get_collection(collection)
+    print(f"\nDone! Collection '{collection}': {info.points_count} points")
+
+
+# ── Query encoder ──────────────────────────────────────────────────────────
+
+BENCHMARK_QUERIES = [
+    "휠 볼트 토크",
+    "브레이크 페달이 견뎌야 하는 최소 하중",
+    "롤 후프 튜브의 최소 두께",
+    "고전압 배터리 절연 저항 측정",
+    "셧다운 회로 구성",
+    "운전자 헬멧 규정",
+    "연료 탱크 벤트 위치",
+    "냉각수로 사용할 수 있는 액체",
+]
+
+# Section that answers each benchmark query, for rerank quality (hit@k, MRR)
+BENCHMARK_TARGETS = {
+    "휠 볼트 토크": "휠 - Wheel",
+    "브레이크 페달이 견뎌야 하는 최소 하중": "제동장치 - Brake System",
+    "롤 후프 튜브의 최소 두께": "재료의 최소 요구조건 - Minimum Material Requirements",
+    "고전압 배터리 절연 저항 측정": "절연 저항 측정 검사 - Insulation Resistance Measurement Test, IMT",
+    "셧다운 회로 구성": "구동시스템 활성화 및 차단 회로 - Tractive System Activation and Shutdown Circuit, SDC",
+    "운전자 헬멧 규정": "드라이버 안전 장비 - Drivers Equipment",
+    "연료 탱크 벤트 위치": "연료 장치 - Fuel System",
+    "냉각수로 사용할 수 있는 액체": "동력장치 - Powertrain",
+}
+
+
+class OnnxEncoder:
+    """BGE-M3 dense encoder exported by --export-encoder (onnxruntime + tokenizers only, no torch)."""
+
+    def __init__(self, encoder_dir: Path, device: str = "cpu"):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(encoder_dir / "encoder.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(str(encoder_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.meta["max_tokens"])
+        self.tokenizer.enable_padding(pad_id=self.meta["pad_id"], pad_token=self.meta["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(str(encoder_dir / self.meta["model"]), options, providers=providers)
+
+    def encode(self, sentences, show_progress_bar: bool = False, batch_size: int = 8):
+        """Same contract as SentenceTransformer.encode: one text → 1-D array, a list → 2-D array."""
+        import numpy as np
+
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        batches = []
+        for i in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[i:i + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            batches.append(self.session.run(
+                ["embedding"], {"input_ids": input_ids, "attention_mask": attention_mask}
+            )[0])
+        embeddings = np.concatenate(batches) if batches else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def export_encoder(output_dir: Path, quantize: bool = False) -> None:
+    """
+    Export the BGE-M3 dense head (CLS pooling + L2 normalization, as in its
+    sentence-transformers config) to ONNX, optionally int8 dynamic-quantized,
+    together with its fast tokenizer.
+    """
+    import shutil
+    import tempfile
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    class DenseEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            hidden = self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            return torch.nn.functional.normalize(hidden[:, 0], p=2, dim=1)
+
+    print(f"Loading model: {EMBEDDING_MODEL}...")
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    model = AutoModel.from_pretrained(EMBEDDING_MODEL).eval()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["휠 볼트 토크"], return_tensors="pt")
+    with tempfile.TemporaryDirectory() as tmp:
+        # The fp32 graph is ~2.2 GB, so torch writes its weights as external data next to it
+        fp32_path = Path(tmp) / "model.onnx"
+        print(f"Exporting ONNX graph (opset {ONNX_OPSET})...")
+        with torch.no_grad():
+            torch.onnx.export(
+                DenseEncoder(model),
+                (sample["input_ids"], sample["attention_mask"]),
+                str(fp32_path),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["embedding"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "embedding": {0: "batch"},
+                },
+                opset_version=ONNX_OPSET,
+            )
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            model_name = "model.int8.onnx"
+            print("Quantizing weights to int8...")
+            quantize_dynamic(str(fp32_path), str(output_dir / model_name), weight_type=QuantType.QInt8)
         else:
-            info = client.get_collection(COLLECTION_NAME)
-            print(f"Collection already exists: {COLLECTION_NAME} ({info.points_count} points)")
-            print("Use --recreate to rebuild")
-            return
+            model_name = "model.onnx"
+            for path in Path(tmp).iterdir():
+                shutil.move(str(path), output_dir / path.name)
+
+    for stale in ("model.onnx", "model.int8.onnx"):
+        if stale != model_name:
+            (output_dir / stale).unlink(missing_ok=True)
+
+    meta = {
+        "source_model": EMBEDDING_MODEL,
+        "model": model_name,
+        "quantized": quantize,
+        "dim": EMBEDDING_DIM,
+        "max_tokens": ENCODER_MAX_TOKENS,
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+    }
+    with open(output_dir / "encoder.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    size = sum(p.stat().st_size for p in output_dir.iterdir() if p.is_file())
+    print(f"Encoder written to {output_dir} ({model_name}, {size / 1e6:.0f} MB)")
+
+
+def load_full_model(device: str):
+    from sentence_transformers import SentenceTransformer
 
-    print(f"Creating collection: {COLLECTION_NAME}")
-    client.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+    device = device if device != "auto" else get_device()
+    print(f"Using device: {device}")
+    print(f"Loading model: {EMBEDDING_MODEL}...")
+    return SentenceTransformer(EMBEDDING_MODEL, device=device)
+
+
+def load_query_encoder(encoder_dir: Path, device: str):
+    """The exported encoder when present, the full SentenceTransformer model otherwise."""
+    if (encoder_dir / "encoder.json").exists():
+        try:
+            encoder = OnnxEncoder(encoder_dir, "cpu" if device == "auto" else device)
+            print(f"Using exported encoder: {encoder_dir} ({encoder.meta['model']})")
+            return encoder
+        except ImportError as e:
+            print(f"Warning: {e.name} is not installed, falling back to the full model")
+    return load_full_model(device)
+
+
+def benchmark_encoder(encoder_dir: Path, device: str) -> None:
+    """Compare load time, query latency and embeddings of the exported encoder against the full model."""
+    import time
+    import numpy as np
+
+    def measure(load):
+        start = time.perf_counter()
+        encoder = load()
+        load_time = time.perf_counter() - start
+        encoder.encode(BENCHMARK_QUERIES[0])  # warm-up
+        latencies, vectors = [], []
+        for query in BENCHMARK_QUERIES:
+            start = time.perf_counter()
+            vectors.append(encoder.encode(query))
+            latencies.append(time.perf_counter() - start)
+        return load_time, latencies, np.array(vectors, dtype=np.float32)
+
+    exported = measure(lambda: OnnxEncoder(encoder_dir, "cpu" if device == "auto" else device))
+    full = measure(lambda: load_full_model(device))
+
+    similarity = np.sum(exported[2] * full[2], axis=1) / (
+        np.linalg.norm(exported[2], axis=1) * np.linalg.norm(full[2], axis=1)
     )
+    print(f"\n── Encoder benchmark ({len(BENCHMARK_QUERIES)} queries) ──")
+    print(f"{'':<12}{'load':>10}{'median':>10}{'max':>10}")
+    for name, (load_time, latencies, _) in (("exported", exported), ("full", full)):
+        print(f"{name:<12}{load_time:>9.2f}s{np.median(latencies) * 1000:>8.1f}ms{max(latencies) * 1000:>8.1f}ms")
+    print(f"Cosine similarity to full model: mean {similarity.mean():.4f}, min {similarity.min():.4f}")
 
-    # Generate embeddings
-    print(f"\nGenerating embeddings for {len(chunks)} chunks...")
-    texts = [c.text for c in chunks]
-    embeddings = []
 
-    for i in tqdm(range(0, len(texts), batch_size), desc="Embedding"):
-        batch = texts[i:i + batch_size]
-        batch_emb = model.encode(batch, show_progress_bar=False)
-        embeddings.extend(batch_emb)
+# ── Citations ──────────────────────────────────────────────────────────────
 
-    # Build points
-    print("\nUploading to Qdrant...")
-    points = []
+CITATION_LABEL = re.compile(r'^(?:item|section|chapter|fig):.+$')
+CITATION_SECTION = re.compile(r'^제?\s*(\d+)\s*조(?:\s*(?:제\s*)?(\d+)\s*항)?\s*(.*)$')
+CITATION_CHAPTER = re.compile(r'^제?\s*(\d+)\s*장\s*(.*)$')
+CITATION_DOTTED = re.compile(r'^(\d+)(?:\.(\d+))?(?:\.(\d+))?\.?$')
 
-    for idx, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        point_id = generate_point_id(chunk.chapter_num, chunk.section_num, idx)
-        points.append(PointStruct(  # noqa: imported above
-            id=point_id,
-            vector=embedding.tolist(),
-            payload={
-                "content": chunk.text,
-                "chapter": chunk.chapter,
-                "chapter_num": chunk.chapter_num,
-                "section": chunk.section,
-                "section_num": chunk.section_num,
-                "item_range": chunk.item_range,
-                "applies_to": chunk.applies_to,
-                "source_lines": chunk.source_lines,
-            },
-        ))
 
-    # Upload in batches
-    upload_batch = 100
-    for i in tqdm(range(0, len(points), upload_batch), desc="Uploading"):
-        batch = points[i:i + upload_batch]
-        client.upsert(collection_name=COLLECTION_NAME, points=batch)
+def citations_path(collection: str) -> Path:
+    return Path(__file__).parent / (collection + CITATIONS_SUFFIX)
+
+
+def build_citation_map(corpus: list[tuple[Document, int, list[Chunk], str]]) -> dict:
+    """
+    Per document: chapters, document-wide sections (제N조) with their per-chapter
+    number, items (항, numbered per list as in the PDF) with their anchors and the
+    split_section_by_items span their chunks are counted in, the point ids of the
+    section's chunks, plus every \\label with its .aux display number and position.
+    Item labels whose .aux number disagrees with the 항 numbering are reported.
+    """
+    from autocomplete import heading_anchor
+    from export import build_rule_tree
+    from tex2html import assign_item_anchors, get_cache_dir, load_label_index
+
+    documents = {}
+    for document, _, chunks, _ in corpus:
+        tex_path = Path(document.tex)
+        tex = tex_path.read_text(encoding="utf-8")
+        aux_path = tex_path.with_suffix(".aux")
+        aux_labels = load_label_index(aux_path, get_cache_dir(tex_path))[0] if aux_path.exists() else {}
+        tree = build_rule_tree(tex, aux_labels, assign_item_anchors(tex)[1])
+        section_contents = {n: section.raw_content for n, section in enumerate(parse_sections_text(tex), 1)}
+
+        points: dict[tuple, list] = {}
+        for idx, chunk in enumerate(chunks):
+            points.setdefault((chunk.chapter_num, chunk.section_num), []).append(
+                [chunk.item_range, generate_point_id(chunk.chapter_num, chunk.section_num, idx, document.id)]
+            )
+
+        chapters, sections = {}, {}
+        for chapter in tree["chapters"]:
+            ref = f"제{chapter['number']}장"
+            chapters[str(chapter["number"])] = {
+                "title": chapter["title"],
+                "anchor": heading_anchor(f"{ref} {chapter['title']}"),
+                "sections": [s["number"] for s in chapter["sections"]],
+            }
+            for local, section in enumerate(chapter["sections"], 1):
+                clauses = split_section_clauses(section_contents[section["number"]])
+                items: dict[str, list] = {}
+                for item, clause in zip(section["items"], clauses):
+                    items.setdefault(str(item["number"]), []).append(
+                        {"list": item["list"], "anchor": item["anchor"], "chunk_items": list(clause.chunk_items)}
+                    )
+                sections[str(section["number"])] = {
+                    "chapter": chapter["number"],
+                    "local": local,
+                    "title": section["title"],
+                    "anchor": heading_anchor(f"{section['ref']} ({section['title']})"),
+                    "items": items,
+                    "points": points.get((chapter["number"], local), []),
+                }
+
+        mismatched = [f"{label} (.aux {entry['display']})" for label, entry in tree["labels"].items()
+                      if entry["kind"] == "item" and entry["display"]
+                      and "".join(entry["display"].split()) != f"제{entry['section']}조{entry['item']}항"]
+        if mismatched:
+            print(f"Warning: {len(mismatched)} item labels of {document.id} disagree with the .aux "
+                  f"(stale .aux?): {', '.join(mismatched[:5])}")
+
+        documents[document.id] = {
+            "title": document.title,
+            "chapters": chapters,
+            "sections": sections,
+            "labels": {label: {k: entry.get(k) for k in ("kind", "display", "chapter", "section", "list", "item")}
+                       for label, entry in tree["labels"].items()},
+        }
+    return {"format": CITATIONS_FORMAT, "documents": documents}
+
+
+def parse_citation(query: str) -> dict | None:
+    """
+    Classify citation-style input: a label ("item:휠 볼트 토크"), 제N조 [M항],
+    제N장 [title words] or dotted chapter.section.item ("4.2.3", sections counted
+    per chapter). Returns None for anything else.
+    """
+    query = " ".join(query.split())
+    if CITATION_LABEL.match(query):
+        return {"label": query}
+    if m := CITATION_SECTION.match(query):
+        return {"section": int(m.group(1)), "item": int(m.group(2)) if m.group(2) else None, "rest": m.group(3)}
+    if m := CITATION_CHAPTER.match(query):
+        return {"chapter": int(m.group(1)), "rest": m.group(2)}
+    if m := CITATION_DOTTED.match(query):
+        return {"chapter": int(m.group(1)), "local": int(m.group(2)) if m.group(2) else None,
+                "item": int(m.group(3)) if m.group(3) else None, "rest": ""}
+    return None
+
+
+def item_in_range(item_range: str, item: int) -> bool:
+    """Whether a chunk's item_range ("all", "3-5", "3-5 (part 2)") covers item."""
+    span = item_range.split(" ", 1)[0]
+    if span == "all":
+        return True
+    first, _, last = span.partition("-")
+    return int(first) <= item <= int(last or first)
+
+
+def resolve_citation(query: str, citation_map: dict, document: str | None = None) -> tuple[list[dict], list]:
+    """
+    Resolve a citation to exact targets: [{document, ref, title, anchor, points}].
+    When a chapter matches but the words after it name none of its sections,
+    returns ([], [(document, chapter)]) so the caller can search within the chapter.
+    """
+    citation = parse_citation(query)
+    if citation is None:
+        return [], []
+
+    def normalized(text: str) -> str:
+        return re.sub(r'\W+', '', text.lower())
+
+    def section_targets(doc_id: str, doc: dict, number: int, item: int | None,
+                        list_num: int | None = None) -> list[dict]:
+        """
+        The section, or its 항 item: one target per list numbering an item so (unless list_num
+        is given), none if no list does, so a citation of a missing 항 falls through to search.
+        """
+        section = doc["sections"].get(str(number))
+        if section is None:
+            return []
+        target = {"document": doc_id, "ref": f"제{number}조", "title": section["title"],
+                  "anchor": section["anchor"], "points": [pid for _, pid in section["points"]]}
+        entries = [e for e in section["items"].get(str(item), []) if list_num in (None, e["list"])]
+        if item is None:
+            return [target]
+        targets = []
+        for entry in entries:
+            first, last = entry["chunk_items"]
+            targets.append(target | {
+                "ref": f"제{number}조 {item}항",
+                "anchor": entry["anchor"] or section["anchor"],
+                "points": [pid for item_range, pid in section["points"]
+                           if any(item_in_range(item_range, n) for n in range(first, last + 1))],
+            })
+        return targets
+
+    targets, scopes = [], []
+    for doc_id, doc in citation_map["documents"].items():
+        if document and doc_id != document:
+            continue
+
+        if "label" in citation:
+            label = doc["labels"].get(citation["label"])
+            if label and label["section"]:
+                for target in section_targets(doc_id, doc, label["section"], label["item"], label["list"]):
+                    target["ref"] = label["display"] or target["ref"]
+                    targets.append(target)
+            elif label and label["chapter"]:
+                chapter = doc["chapters"][str(label["chapter"])]
+                targets.append({"document": doc_id, "ref": label["display"] or f"제{label['chapter']}장",
+                                "title": chapter["title"], "anchor": chapter["anchor"],
+                                "points": [pid for n in chapter["sections"]
+                                           for _, pid in doc["sections"][str(n)]["points"]]})
+            continue
+
+        if "section" in citation:
+            targets += section_targets(doc_id, doc, citation["section"], citation["item"])
+            continue
+
+        chapter = doc["chapters"].get(str(citation["chapter"]))
+        if chapter is None:
+            continue
+        numbers = chapter["sections"]
+        if citation.get("local"):
+            if citation["local"] <= len(numbers):
+                targets += section_targets(doc_id, doc, numbers[citation["local"] - 1], citation["item"])
+            continue
+
+        rest = normalized(citation["rest"])
+        if rest:
+            named = [n for n in numbers if rest in normalized(doc["sections"][str(n)]["title"])]
+            if not named:
+                scopes.append((doc_id, citation["chapter"]))
+            for n in named:
+                targets += section_targets(doc_id, doc, n, None)
+        else:
+            targets.append({"document": doc_id, "ref": f"제{citation['chapter']}장", "title": chapter["title"],
+                            "anchor": chapter["anchor"],
+                            "points": [pid for n in numbers for _, pid in doc["sections"][str(n)]["points"]]})
+    return targets, scopes
+
+
+# ── Search ─────────────────────────────────────────────────────────────────
+
+def flat_search(client, query_vector: list[float], collection: str = COLLECTION_NAME,
+                limit: int = 5, document: str | None = None) -> list:
+    """Score the query against every chunk."""
+    return client.query_points(
+        collection_name=collection,
+        query=query_vector,
+        query_filter=document_filter([document]) if document else None,
+        limit=limit,
+    ).points
+
+
+def hierarchical_search(client, query_vector: list[float], collection: str = COLLECTION_NAME,
+                        limit: int = 5, fanout: int = SECTION_FANOUT, chapter_fanout: int | None = None,
+                        document: str | None = None) -> list:
+    """
+    Coarse-to-fine search: pick the `fanout` sections whose centroids are closest
+    (optionally only within the `chapter_fanout` closest chapters), then score
+    only the chunks of those sections.
+    """
+    from qdrant_client.models import FieldCondition, Filter, MatchValue
+
+    def level(name: str) -> list:
+        must = [FieldCondition(key="level", match=MatchValue(value=name))]
+        if document:
+            must.append(document_filter([document]))
+        return must
+
+    sections_collection = hierarchy_collection(collection)
+    section_must = level("section")
+    if chapter_fanout:
+        chapters = client.query_points(
+            collection_name=sections_collection,
+            query=query_vector,
+            query_filter=Filter(must=level("chapter")),
+            limit=chapter_fanout,
+        ).points
+        section_must.append(Filter(should=[
+            section_key_filter(c.payload["document"], c.payload["chapter_num"]) for c in chapters
+        ]))
+
+    sections = client.query_points(
+        collection_name=sections_collection,
+        query=query_vector,
+        query_filter=Filter(must=section_must),
+        limit=fanout,
+    ).points
+    if not sections:
+        return []
+
+    return client.query_points(
+        collection_name=collection,
+        query=query_vector,
+        query_filter=Filter(should=[
+            section_key_filter(s.payload["document"], s.payload["chapter_num"], s.payload["section_num"])
+            for s in sections
+        ]),
+        limit=limit,
+    ).points
+
+
+def compare_recall(client, model, collection: str = COLLECTION_NAME, limit: int = 5,
+                   chapter_fanout: int | None = None, document: str | None = None) -> None:
+    """Recall@limit of hierarchical search against flat search, per section fan-out."""
+    import time
+    import statistics
+
+    vectors = [model.encode(query).tolist() for query in BENCHMARK_QUERIES]
+
+    def timed(search) -> tuple[list[set], float]:
+        results, latencies = [], []
+        for vector in vectors:
+            start = time.perf_counter()
+            results.append({hit.id for hit in search(vector)})
+            latencies.append(time.perf_counter() - start)
+        return results, statistics.median(latencies)
+
+    flat, flat_latency = timed(lambda v: flat_search(client, v, collection, limit, document))
+    print(f"\n── Recall@{limit} vs flat search ({len(BENCHMARK_QUERIES)} queries) ──")
+    print(f"{'mode':<20}{'recall':>8}{'median':>10}")
+    print(f"{'flat':<20}{1:>8.3f}{flat_latency * 1000:>8.1f}ms")
+    for fanout in RECALL_FANOUTS:
+        hierarchical, latency = timed(
+            lambda v: hierarchical_search(client, v, collection, limit, fanout, chapter_fanout, document)
+        )
+        recall = statistics.mean(len(h & f) / len(f) if f else 1.0 for h, f in zip(hierarchical, flat))
+        print(f"{f'sections={fanout}':<20}{recall:>8.3f}{latency * 1000:>8.1f}ms")
+
+
+# ── Reranking ──────────────────────────────────────────────────────────────
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()[:32]
+
+
+class ScoreCache:
+    """Persistent (model, query hash, chunk hash) → score table, plus the measured cost per pair."""
+
+    def __init__(self, path: Path):
+        import sqlite3
+
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scores (
+                model TEXT NOT NULL, query TEXT NOT NULL, chunk TEXT NOT NULL, score REAL NOT NULL,
+                PRIMARY KEY (model, query, chunk)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def get(self, model: str, query: str, chunks: list[str]) -> dict[str, float]:
+        marks = ",".join("?" * len(chunks))
+        rows = self.conn.execute(
+            f"SELECT chunk, score FROM scores WHERE model = ? AND query = ? AND chunk IN ({marks})",
+            [model, query, *chunks],
+        )
+        return dict(rows.fetchall())
+
+    def put(self, model: str, query: str, scores: dict[str, float]) -> None:
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                                  [(model, query, chunk, score) for chunk, score in scores.items()])
+
+    def pair_cost(self, model: str, device: str) -> float | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?",
+                                (f"ms_per_pair:{model}:{device}",)).fetchone()
+        return float(row[0]) if row else None
+
+    def set_pair_cost(self, model: str, device: str, ms: float) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (f"ms_per_pair:{model}:{device}", str(ms)))
+
 
-    info = client.get_collection(COLLECTION_NAME)
-    print(f"\nDone! Collection '{COLLECTION_NAME}': {info.points_count} points")
+class Reranker:
+    """
+    Cross-encoder rerank of first-stage hits within a scoring-time budget.
+    Cached pairs cost nothing; uncached ones are scored in first-stage order, in
+    batches, and the remaining candidates are dropped from scoring once the next
+    batch would not fit in the budget. Batches are sized from the cost per pair last
+    measured for this model on this device; without one, the first batch is a single
+    pair. The model is loaded on the first cache miss.
+    """
+
+    def __init__(self, device: str = "auto", cache_path: Path = RERANK_CACHE, model_name: str = RERANK_MODEL):
+        self.device = device
+        self.model_name = model_name
+        self.cache = ScoreCache(cache_path)
+        self.model = None
+        self.load_ms = 0.0
+
+    def resolved_device(self) -> str:
+        """The device actually used ("auto" resolved; deferred so cache-only queries skip torch)."""
+        if self.device == "auto":
+            self.device = get_device()
+        return self.device
+
+    def load(self):
+        import time
+        from sentence_transformers import CrossEncoder
+
+        start = time.perf_counter()
+        print(f"Loading reranker: {self.model_name}...")
+        self.model = CrossEncoder(self.model_name, device=self.resolved_device())
+        self.load_ms = (time.perf_counter() - start) * 1000
+
+    def rerank(self, query: str, hits: list, budget_ms: float = RERANK_BUDGET_MS,
+               batch_size: int = RERANK_BATCH) -> tuple[list, dict, dict]:
+        """Returns (hits in new order, {point id: rerank score}, stats)."""
+        import time
+
+        query_key = text_hash(query)
+        chunk_keys = [text_hash(hit.payload["content"]) for hit in hits]
+        scores = self.cache.get(self.model_name, query_key, chunk_keys) if hits else {}
+        todo = [i for i, key in enumerate(chunk_keys) if key not in scores]
+        stats = {"candidates": len(hits), "cached": len(hits) - len(todo), "scored": 0, "truncated": 0}
+
+        start = time.perf_counter()
+        pair_ms = self.cache.pair_cost(self.model_name, self.resolved_device()) if todo else None
+        new_scores = {}
+        while todo:
+            elapsed = (time.perf_counter() - start) * 1000
+            if pair_ms is None:
+                size = 1 if elapsed < budget_ms else 0
+            else:
+                size = min(batch_size, int((budget_ms - elapsed) / pair_ms))
+            if size <= 0:
+                break
+            batch, todo = todo[:size], todo[size:]
+            if self.model is None:
+                self.load()
+                start = time.perf_counter() - elapsed / 1000
+            batch_start = time.perf_counter()
+            predicted = self.model.predict([(query, hits[i].payload["content"]) for i in batch],
+                                           batch_size=len(batch), show_progress_bar=False)
+            pair_ms = (time.perf_counter() - batch_start) * 1000 / len(batch)
+            for i, score in zip(batch, predicted):
+                new_scores[chunk_keys[i]] = float(score)
+            stats["scored"] += len(batch)
+
+        stats["truncated"] = len(todo)
+        stats["ms"] = (time.perf_counter() - start) * 1000
+        if new_scores:
+            self.cache.put(self.model_name, query_key, new_scores)
+            self.cache.set_pair_cost(self.model_name, self.device, pair_ms)
+        scores.update(new_scores)
+
+        # Scored candidates by rerank score, then the unscored ones in first-stage order
+        order = sorted(range(len(hits)),
+                       key=lambda i: (chunk_keys[i] not in scores, -scores.get(chunk_keys[i], 0.0), i))
+        rerank_scores = {hits[i].id: scores[chunk_keys[i]] for i in order if chunk_keys[i] in scores}
+        return [hits[i] for i in order], rerank_scores, stats
+
+
+def benchmark_rerank(client, model, collection: str = COLLECTION_NAME, limit: int = 5,
+                     candidates: int = RERANK_CANDIDATES, budget_ms: float = RERANK_BUDGET_MS,
+                     device: str = "auto", document: str | None = None) -> None:
+    """Rerank cost (cold and cached) and quality gain (hit@limit, MRR of the expected section)."""
+    import statistics
+    import tempfile
+
+    def target_rank(hits: list, query: str) -> int | None:
+        target = BENCHMARK_TARGETS.get(query)
+        for rank, hit in enumerate(hits[:limit], 1):
+            if hit.payload["section"] == target:
+                return rank
+        return None
+
+    first_stage = {
+        query: flat_search(client, model.encode(query).tolist(), collection, max(limit, candidates), document)
+        for query in BENCHMARK_QUERIES
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        reranker = Reranker(device, Path(tmp) / "scores.sqlite")
+        cold, warm, reranked, truncated = [], [], {}, 0
+        for query, hits in first_stage.items():
+            reranked[query], _, stats = reranker.rerank(query, hits, budget_ms)
+            cold.append(stats["ms"])
+            truncated += stats["truncated"]
+        for query, hits in first_stage.items():
+            warm.append(reranker.rerank(query, hits, budget_ms)[2]["ms"])
+
+    def quality(results: dict) -> tuple[float, float]:
+        ranks = [target_rank(results[q], q) for q in BENCHMARK_QUERIES if q in BENCHMARK_TARGETS]
+        return (sum(r is not None for r in ranks) / len(ranks),
+                statistics.mean(1 / r if r else 0 for r in ranks))
+
+    before, after = quality(first_stage), quality(reranked)
+    print(f"\n── Rerank benchmark ({len(BENCHMARK_QUERIES)} queries, {candidates} candidates, "
+          f"budget {budget_ms:.0f} ms) ──")
+    print(f"Model load: {reranker.load_ms:.0f} ms (not counted against the budget)")
+    print(f"Cold rerank: median {statistics.median(cold):.1f} ms, max {max(cold):.1f} ms, "
+          f"{truncated} candidates truncated by the budget")
+    print(f"Cached rerank: median {statistics.median(warm):.2f} ms")
+    print(f"{'':<12}{f'hit@{limit}':>8}{'MRR':>8}")
+    print(f"{'first stage':<12}{before[0]:>8.3f}{before[1]:>8.3f}")
+    print(f"{'reranked':<12}{after[0]:>8.3f}{after[1]:>8.3f}")
+
+
+def print_results(query: str, points: list, anchors: dict | None = None,
+                  rerank_scores: dict | None = None) -> None:
+    """Print hits; citation hits (no score) come with their HTML anchor from `anchors`."""
+    print(f"\nSearch: \"{query}\"\n")
+    for i, hit in enumerate(points, 1):
+        p = hit.payload
+        score = getattr(hit, "score", None)
+        label = f"score: {score:.4f}" if score is not None else "citation"
+        if rerank_scores and hit.id in rerank_scores:
+            label += f", rerank: {rerank_scores[hit.id]:.4f}"
+        print(f"── Result {i} ({label}) ──")
+        if anchors and hit.id in anchors:
+            print(f"  Cited: {anchors[hit.id][0]} → #{anchors[hit.id][1]}")
+        print(f"  Document: {p.get('document', DEFAULT_DOCUMENT_ID)}")
+        print(f"  Chapter {p['chapter_num']}: {p['chapter']}")
+        print(f"  Section: {p['section']}")
+        print(f"  Items: {p['item_range']} | Applies to: {', '.join(p['applies_to'])}")
+        print(f"  Lines: {p['source_lines']}")
+        print(f"  Content:\n{p['content'][:400]}...")
+        print()
 
 
 # ── CLI ────────────────────────────────────────────────────────────────────
@@ -506,6 +1627,30 @@ def main():
         default=str(Path(__file__).parent / "formula.tex"),
         help="Path to formula.tex (default: ./formula.tex)",
     )
+    parser.add_argument(
+        "--manifest",
+        help="Corpus manifest (JSON) listing the documents to index, instead of --tex",
+    )
+    parser.add_argument(
+        "--collection",
+        default=None,
+        help=f"Qdrant collection (default: the manifest's, else {COLLECTION_NAME})",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Re-embed only documents whose chunks changed; with --manifest also drop removed documents",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes for parsing and chunking (default: one per document, up to the CPU count)",
+    )
+    parser.add_argument(
+        "--document",
+        help="With --search: only search this document id",
+    )
     parser.add_argument(
         "--url",
         default=QDRANT_URL,
@@ -517,6 +1662,29 @@ def main():
         default=None,
         help="Qdrant API key",
     )
+    parser.add_argument(
+        "--grpc",
+        action="store_true",
+        help=f"Talk to Qdrant over gRPC (port --grpc-port, default {GRPC_PORT})",
+    )
+    parser.add_argument(
+        "--grpc-port",
+        type=int,
+        default=GRPC_PORT,
+        help=f"Qdrant gRPC port (default: {GRPC_PORT})",
+    )
+    parser.add_argument(
+        "--upload-concurrency",
+        type=int,
+        default=UPLOAD_CONCURRENCY,
+        help=f"Upsert requests in flight; >1 uses the async client (default: {UPLOAD_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--upload-batch",
+        type=int,
+        default=UPLOAD_BATCH,
+        help=f"Points per upsert request (default: {UPLOAD_BATCH})",
+    )
     parser.add_argument(
         "--recreate",
         action="store_true",
@@ -550,57 +1718,170 @@ def main():
         default=5,
         help="Number of search results (default: 5)",
     )
+    parser.add_argument(
+        "--citations",
+        default=None,
+        help=f"Citation lookup map, written when indexing and read by --search "
+             f"(default: ./<collection>{CITATIONS_SUFFIX})",
+    )
+    parser.add_argument(
+        "--hierarchical",
+        action="store_true",
+        help="With --search: route through section centroids before scoring chunks",
+    )
+    parser.add_argument(
+        "--fanout",
+        type=int,
+        default=SECTION_FANOUT,
+        help=f"Sections searched in the second stage of --hierarchical (default: {SECTION_FANOUT})",
+    )
+    parser.add_argument(
+        "--chapter-fanout",
+        type=int,
+        default=None,
+        help="Also restrict --hierarchical to the closest N chapters (default: off)",
+    )
+    parser.add_argument(
+        "--recall",
+        action="store_true",
+        help=f"Compare hierarchical against flat search (recall@--limit, fan-outs {RECALL_FANOUTS}) and exit",
+    )
+    parser.add_argument(
+        "--rerank",
+        action="store_true",
+        help=f"With --search: rerank the first-stage candidates with {RERANK_MODEL}",
+    )
+    parser.add_argument(
+        "--rerank-candidates",
+        type=int,
+        default=RERANK_CANDIDATES,
+        help=f"First-stage candidates passed to --rerank (default: {RERANK_CANDIDATES})",
+    )
+    parser.add_argument(
+        "--rerank-budget-ms",
+        type=float,
+        default=RERANK_BUDGET_MS,
+        help=f"Scoring time per query; candidates that do not fit keep their order (default: {RERANK_BUDGET_MS})",
+    )
+    parser.add_argument(
+        "--benchmark-rerank",
+        action="store_true",
+        help="Report rerank cost and hit@--limit/MRR gain on the benchmark queries and exit",
+    )
+    parser.add_argument(
+        "--encoder",
+        default=str(ENCODER_DIR),
+        help="Exported query encoder directory used by --search (default: ./encoder)",
+    )
+    parser.add_argument(
+        "--full-model",
+        action="store_true",
+        help="Search with the full SentenceTransformer model even if an exported encoder exists",
+    )
+    parser.add_argument(
+        "--export-encoder",
+        action="store_true",
+        help="Export the query encoder to ONNX (into --encoder) and exit",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="With --export-encoder: int8 dynamic quantization of the weights",
+    )
+    parser.add_argument(
+        "--benchmark-encoder",
+        action="store_true",
+        help="Compare the exported encoder with the full model and exit",
+    )
 
     args = parser.parse_args()
+    encoder_dir = Path(args.encoder)
+    connection = QdrantConnection(args.url, args.api_key, args.grpc, args.grpc_port)
+
+    if args.manifest:
+        collection, documents = load_manifest(args.manifest)
+    else:
+        collection = COLLECTION_NAME
+        documents = [Document(DEFAULT_DOCUMENT_ID, DEFAULT_DOCUMENT_TITLE, args.tex)]
+    collection = args.collection or collection
+
+    # ── Encoder export / benchmark ───────────────────────────────────
+    if args.export_encoder:
+        export_encoder(encoder_dir, args.quantize)
+        return 0
+    if args.benchmark_encoder:
+        benchmark_encoder(encoder_dir, args.device)
+        return 0
 
     # ── Search mode ──────────────────────────────────────────────────
-    if args.search:
-        from qdrant_client import QdrantClient
-        from sentence_transformers import SentenceTransformer
+    if args.search or args.recall or args.benchmark_rerank:
+        client = connection.client()
+        scope_filter = None
+
+        # Citations ("제12조 2항", "item:…", "4.2.3") resolve to exact chunks without the model
+        citations = Path(args.citations) if args.citations else citations_path(collection)
+        citation_map = None
+        if args.search and citations.exists():
+            with open(citations, "r", encoding="utf-8") as f:
+                citation_map = json.load(f)
+            if citation_map.get("format") != CITATIONS_FORMAT:
+                print(f"Warning: {citations} is from an older version, re-run indexing to rebuild it")
+                citation_map = None
+        if citation_map is not None:
+            targets, scopes = resolve_citation(args.search, citation_map, args.document)
+            if targets:
+                anchors = {pid: (t["ref"], t["anchor"]) for t in targets for pid in t["points"]}
+                records = client.retrieve(collection, ids=list(anchors), with_payload=True)
+                order = {pid: i for i, pid in enumerate(anchors)}
+                print_results(args.search, sorted(records, key=lambda r: order[r.id]), anchors)
+                return 0
+            if scopes:
+                # A chapter was cited but no section title matched: search only within it
+                from qdrant_client.models import Filter
+                scope_filter = Filter(should=[section_key_filter(d, c) for d, c in scopes])
+
+        if args.full_model:
+            model = load_full_model(args.device)
+        else:
+            model = load_query_encoder(encoder_dir, args.device)
 
-        device = args.device if args.device != "auto" else get_device()
-        print(f"Using device: {device}")
-        print(f"Loading model: {EMBEDDING_MODEL}...")
-        model = SentenceTransformer(EMBEDDING_MODEL, device=device)
+        if args.recall:
+            compare_recall(client, model, collection, args.limit, args.chapter_fanout, args.document)
+            return 0
+        if args.benchmark_rerank:
+            benchmark_rerank(client, model, collection, args.limit, args.rerank_candidates,
+                             args.rerank_budget_ms, args.device, args.document)
+            return 0
 
-        client = QdrantClient(
-            host=args.url.replace("https://", "").replace("http://", "").rstrip("/"),
-            port=443,
-            https=args.url.startswith("https"),
-            api_key=args.api_key,
-            prefer_grpc=False,
-            timeout=60,
-        )
         query_vector = model.encode(args.search).tolist()
+        limit = max(args.limit, args.rerank_candidates) if args.rerank else args.limit
+        if scope_filter is not None:
+            points = client.query_points(collection_name=collection, query=query_vector,
+                                         query_filter=scope_filter, limit=limit).points
+        elif args.hierarchical:
+            points = hierarchical_search(client, query_vector, collection, limit,
+                                         args.fanout, args.chapter_fanout, args.document)
+        else:
+            points = flat_search(client, query_vector, collection, limit, args.document)
 
-        results = client.query_points(
-            collection_name=COLLECTION_NAME,
-            query=query_vector,
-            limit=args.limit,
-        )
+        rerank_scores = None
+        if args.rerank:
+            reranker = Reranker(args.device)
+            points, rerank_scores, stats = reranker.rerank(args.search, points, args.rerank_budget_ms)
+            points = points[:args.limit]
+            print(f"Reranked {stats['candidates']} candidates in {stats['ms']:.1f} ms "
+                  f"({stats['cached']} cached, {stats['scored']} scored, {stats['truncated']} over budget)")
 
-        print(f"\nSearch: \"{args.search}\"\n")
-        for i, hit in enumerate(results.points, 1):
-            p = hit.payload
-            print(f"── Result {i} (score: {hit.score:.4f}) ──")
-            print(f"  Chapter {p['chapter_num']}: {p['chapter']}")
-            print(f"  Section: {p['section']}")
-            print(f"  Items: {p['item_range']} | Applies to: {', '.join(p['applies_to'])}")
-            print(f"  Lines: {p['source_lines']}")
-            print(f"  Content:\n{p['content'][:400]}...")
-            print()
+        print_results(args.search, points, rerank_scores=rerank_scores)
         return 0
 
     # ── Parse & chunk ────────────────────────────────────────────────
-    print(f"Parsing {args.tex}...")
-    sections = parse_sections(args.tex)
-    print(f"Found {len(sections)} sections")
-
-    all_chunks = []
-    for section in sections:
-        chunks = chunk_section(section)
-        all_chunks.extend(chunks)
+    print(f"Parsing {len(documents)} document(s)...")
+    corpus = chunk_corpus(documents, args.workers)
+    for document, section_count, chunks, _ in corpus:
+        print(f"  {document.id}: {document.tex} → {section_count} sections, {len(chunks)} chunks")
 
+    all_chunks = [chunk for _, _, chunks, _ in corpus for chunk in chunks]
     print(f"Created {len(all_chunks)} chunks")
 
     # Stats
@@ -617,25 +1898,19 @@ def main():
         return 0
 
     # ── Index ────────────────────────────────────────────────────────
-    from qdrant_client import QdrantClient
-    from sentence_transformers import SentenceTransformer
-
-    device = args.device if args.device != "auto" else get_device()
-    print(f"\nUsing device: {device}")
-    print(f"Loading model: {EMBEDDING_MODEL}...")
-    model = SentenceTransformer(EMBEDDING_MODEL, device=device)
+    model = load_full_model(args.device)
 
     print(f"Connecting to Qdrant at {args.url}...")
-    client = QdrantClient(
-            host=args.url.replace("https://", "").replace("http://", "").rstrip("/"),
-            port=443,
-            https=args.url.startswith("https"),
-            api_key=args.api_key,
-            prefer_grpc=False,
-            timeout=60,
-        )
+    client = connection.client()
+
+    index_documents(client, model, corpus, collection, args.recreate, args.incremental,
+                    prune=bool(args.manifest), batch_size=args.batch_size, connection=connection,
+                    concurrency=args.upload_concurrency, upload_batch=args.upload_batch)
 
-    index_chunks(client, model, all_chunks, args.recreate, args.batch_size)
+    citations = Path(args.citations) if args.citations else citations_path(collection)
+    with open(citations, "w", encoding="utf-8") as f:
+        json.dump(build_citation_map(corpus), f, ensure_ascii=False, separators=(",", ":"))
+    print(f"Citation map written to {citations}")
 
     return 0
 
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+KSAE Formula Rules structural diff
+Compares formula.tex between two git revisions chapter by chapter, section by section
+and item by item, and writes an HTML changes page and a JSON changelog.
+"""
+
+import argparse
+import difflib
+import hashlib
+import html
+import json
+import re
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from indexer import parse_sections_text, split_section_clauses, strip_latex
+
+
+# Matching thresholds (difflib ratio of the plain text)
+SIMILAR_IN_SECTION = 0.5  # same item number within a matched section
+SIMILAR_ANYWHERE = 0.7    # best match among the remaining units of the same kind
+
+KIND_ORDER = {"chapter": 0, "section": 1, "item": 2}
+
+
+# ── Rule units ─────────────────────────────────────────────────────────────
+
+@dataclass
+class Unit:
+    kind: str              # chapter | section | item
+    number: str            # 제3장, 제12조, 제12조 2항
+    title: str
+    label: str | None
+    text: str              # plain text used for hashing and similarity
+    digest: str
+    position: int          # document order
+    chapter_num: int
+    section_num: int       # document-wide 제N조 number (0 for chapters)
+    item_num: int = 0      # 항 number, restarting in each top-level list (as in the PDF)
+    list_num: int = 0      # top-level list of the section the item is in
+    item_path: str = ""    # "3" or "l2-3", the item path of tex2html's anchors
+    parent: int | None = None  # index of the enclosing section unit
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+
+def find_label(text: str, kind: str) -> str | None:
+    match = re.search(r'\\label\{(' + kind + r':[^}]+)\}', text)
+    return match.group(1) if match else None
+
+
+def section_preamble(content: str) -> str:
+    """Section text before its first list (not part of any item)."""
+    match = re.search(r'\\begin\{enumerate\}', content)
+    return content[:match.start()] if match else content
+
+
+def parse_units(tex: str) -> list[Unit]:
+    """Flatten formula.tex into chapter, section and top-level item units in document order."""
+    lines = tex.splitlines(keepends=True)
+    chapter_lines = [line for line in lines if '\\chapter{' in line]
+
+    units: list[Unit] = []
+    seen_chapters = set()
+    section_num = 0
+
+    for section in parse_sections_text(tex):
+        section_num += 1
+        if section.chapter_num not in seen_chapters:
+            seen_chapters.add(section.chapter_num)
+            heading = chapter_lines[section.chapter_num - 1] if section.chapter_num <= len(chapter_lines) else ""
+            units.append(Unit(
+                kind="chapter",
+                number=f"제{section.chapter_num}장",
+                title=section.chapter,
+                label=find_label(heading, "chapter"),
+                text=section.chapter,
+                digest=text_digest(section.chapter),
+                position=len(units),
+                chapter_num=section.chapter_num,
+                section_num=0,
+            ))
+
+        heading = lines[section.start_line - 1] if section.start_line > 0 else ""
+        content = section.raw_content
+        preamble = section_preamble(content)
+        section_text = section.section_title + "\n" + strip_latex(preamble)
+        section_index = len(units)
+        units.append(Unit(
+            kind="section",
+            number=f"제{section_num}조",
+            title=section.section_title,
+            label=find_label(heading + preamble, "section"),
+            text=section_text,
+            digest=text_digest(section_text),
+            position=len(units),
+            chapter_num=section.chapter_num,
+            section_num=section_num,
+        ))
+
+        for clause in split_section_clauses(content):
+            text = strip_latex(clause.content).lstrip("• ").strip()
+            units.append(Unit(
+                kind="item",
+                number=f"제{section_num}조 {clause.number}항",
+                title=text.split("\n", 1)[0][:60],
+                label=find_label(clause.content, "item"),
+                text=text,
+                digest=text_digest(text),
+                position=len(units),
+                chapter_num=section.chapter_num,
+                section_num=section_num,
+                item_num=clause.number,
+                list_num=clause.list_num,
+                item_path=clause.path,
+                parent=section_index,
+            ))
+
+    return units
+
+
+# ── Matching ───────────────────────────────────────────────────────────────
+
+def similarity(a: str, b: str) -> float:
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.real_quick_ratio() < SIMILAR_IN_SECTION or matcher.quick_ratio() < SIMILAR_IN_SECTION:
+        return 0.0
+    return matcher.ratio()
+
+
+def match_units(old: list[Unit], new: list[Unit]) -> dict[int, int]:
+    """
+    Pair old unit indices with new ones, kind by kind:
+    same label, then identical content, then similar content (items first within their
+    matched section, then anywhere).
+    """
+    pairs: dict[int, int] = {}
+    used: set[int] = set()
+
+    def unmatched(kind: str):
+        return ([i for i, u in enumerate(old) if u.kind == kind and i not in pairs],
+                [j for j, u in enumerate(new) if u.kind == kind and j not in used])
+
+    def pair_by(kind: str, key_old, key_new):
+        """Pair units whose key is equal and unique on both sides."""
+        olds, news = unmatched(kind)
+        by_key: dict = {}
+        for j in news:
+            key = key_new(j)
+            if key is not None:
+                by_key.setdefault(key, []).append(j)
+        old_keys: dict = {}
+        for i in olds:
+            key = key_old(i)
+            if key is not None:
+                old_keys.setdefault(key, []).append(i)
+        for key, candidates in old_keys.items():
+            if len(candidates) == 1 and len(by_key.get(key, [])) == 1:
+                pairs[candidates[0]] = by_key[key][0]
+                used.add(by_key[key][0])
+
+    def pair_similar(kind: str, threshold: float, scope_old=None, scope_new=None):
+        olds, news = unmatched(kind)
+        for i in olds:
+            best, best_ratio = None, threshold
+            for j in news:
+                if j in used or (scope_old and scope_old(i) != scope_new(j)):
+                    continue
+                ratio = similarity(old[i].text, new[j].text)
+                if ratio >= best_ratio:
+                    best, best_ratio = j, ratio
+            if best is not None:
+                pairs[i] = best
+                used.add(best)
+
+    for kind in ("chapter", "section"):
+        pair_by(kind, lambda i: old[i].label, lambda j: new[j].label)
+        pair_by(kind, lambda i: old[i].title, lambda j: new[j].title)
+        pair_by(kind, lambda i: old[i].digest, lambda j: new[j].digest)
+        pair_similar(kind, SIMILAR_ANYWHERE)
+
+    # Items: scoped to the matched section first
+    matched_section = lambda i: pairs.get(old[i].parent)
+    own_section = lambda j: new[j].parent
+    pair_by("item", lambda i: old[i].label, lambda j: new[j].label)
+    pair_by("item", lambda i: (matched_section(i), old[i].digest), lambda j: (own_section(j), new[j].digest))
+    pair_by("item", lambda i: (matched_section(i), old[i].list_num, old[i].item_num),
+            lambda j: (own_section(j), new[j].list_num, new[j].item_num))
+    # the number match above is only kept if the text is still similar
+    for i, j in list(pairs.items()):
+        if old[i].kind == "item" and old[i].digest != new[j].digest \
+                and similarity(old[i].text, new[j].text) < SIMILAR_IN_SECTION:
+            del pairs[i]
+            used.discard(j)
+    pair_similar("item", SIMILAR_IN_SECTION, matched_section, own_section)
+    pair_by("item", lambda i: old[i].digest, lambda j: new[j].digest)
+    pair_similar("item", SIMILAR_ANYWHERE)
+
+    return pairs
+
+
+# ── Diff ───────────────────────────────────────────────────────────────────
+
+def diff_text(a: str, b: str) -> list[tuple[str, str]]:
+    """Word-level diff as (op, text) segments with op in equal/delete/insert."""
+    a_tokens = re.findall(r'\s+|[^\s]+', a)
+    b_tokens = re.findall(r'\s+|[^\s]+', b)
+    segments = []
+    matcher = difflib.SequenceMatcher(None, a_tokens, b_tokens, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            segments.append(("equal", "".join(a_tokens[i1:i2])))
+            continue
+        if op in ("delete", "replace"):
+            segments.append(("delete", "".join(a_tokens[i1:i2])))
+        if op in ("insert", "replace"):
+            segments.append(("insert", "".join(b_tokens[j1:j2])))
+    return segments
+
+
+def compare(old: list[Unit], new: list[Unit]) -> list[dict]:
+    """Changelog entries (unchanged units omitted) in new document order."""
+    pairs = match_units(old, new)
+    new_to_old = {j: i for i, j in pairs.items()}
+    changes = []
+
+    for j, unit in enumerate(new):
+        i = new_to_old.get(j)
+        if i is None:
+            status = "added"
+        elif old[i].digest != unit.digest:
+            status = "modified"
+        elif unit.kind == "item" and old[i].item_path == unit.item_path and pairs.get(old[i].parent) == unit.parent:
+            continue  # only the enclosing section was renumbered
+        elif old[i].number != unit.number:
+            status = "renumbered"
+        else:
+            continue
+        entry = {
+            "kind": unit.kind,
+            "status": status,
+            "old_number": old[i].number if i is not None else None,
+            "new_number": unit.number,
+            "label": unit.label,
+            "title": unit.title,
+            "anchor": (unit.chapter_num, unit.section_num, unit.item_path),
+            "sort": (unit.position, 0),
+        }
+        if status == "modified":
+            entry["old_text"] = old[i].text
+            entry["new_text"] = unit.text
+            entry["diff"] = diff_text(old[i].text, unit.text)
+        elif status == "added":
+            entry["new_text"] = unit.text
+        changes.append(entry)
+
+    # Removed units go right after the new position of the closest preceding matched unit
+    after = -1
+    for i, unit in enumerate(old):
+        if i in pairs:
+            after = pairs[i]
+            continue
+        changes.append({
+            "kind": unit.kind,
+            "status": "removed",
+            "old_number": unit.number,
+            "new_number": None,
+            "label": unit.label,
+            "title": unit.title,
+            "old_text": unit.text,
+            "anchor": None,
+            "sort": (after, 1 + i),
+        })
+
+    changes.sort(key=lambda c: c["sort"])
+    for entry in changes:
+        del entry["sort"]
+    return changes
+
+
+def summarize(changes: list[dict]) -> dict:
+    summary = {}
+    for entry in changes:
+        counts = summary.setdefault(entry["kind"], {})
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return summary
+
+
+# ── Sources ────────────────────────────────────────────────────────────────
+
+def read_revision(tex_path: Path, revision: str | None) -> str:
+    """formula.tex at a git revision, or the working tree when revision is None."""
+    if revision is None:
+        return tex_path.read_text(encoding="utf-8")
+    result = subprocess.run(
+        ["git", "show", f"{revision}:./{tex_path.name}"],
+        cwd=tex_path.parent, capture_output=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Error: cannot read {tex_path.name} at {revision}: "
+                         f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+    return result.stdout.decode("utf-8")
+
+
+def item_anchors(tex: str) -> dict:
+    """Anchor ids of the HTML build (tex2html item anchors) keyed by chapter-section-item path."""
+    from tex2html import assign_item_anchors
+    return assign_item_anchors(tex)[1]
+
+
+# ── Output ─────────────────────────────────────────────────────────────────
+
+STATUS_NAMES = {"added": "신설", "removed": "삭제", "modified": "개정", "renumbered": "번호 변경"}
+KIND_NAMES = {"chapter": "장", "section": "조", "item": "항"}
+
+CHANGES_STYLE = """
+body { font-family: 'Noto Sans KR', sans-serif; max-width: 860px; margin: 0 auto; padding: 1rem; line-height: 1.7; color: #1a202c; }
+h1 { font-size: 1.4rem; color: #1a365d; }
+.summary { color: #4a5568; margin-bottom: 1.5rem; }
+.change { border: 1px solid #e2e8f0; border-radius: 8px; padding: 0.75rem 1rem; margin: 0.75rem 0; }
+.change.chapter { border-left: 4px solid #1a365d; }
+.change.section { border-left: 4px solid #3182ce; }
+.change-header { font-weight: 700; }
+.change-header a { color: inherit; }
+.badge { display: inline-block; font-size: 0.75rem; border-radius: 4px; padding: 0 0.4rem; margin-right: 0.4rem; color: #fff; }
+.badge.added { background: #2f855a; } .badge.removed { background: #c53030; }
+.badge.modified { background: #b7791f; } .badge.renumbered { background: #718096; }
+.text { white-space: pre-wrap; margin-top: 0.4rem; }
+del { background: #fed7d7; color: #9b2c2c; } ins { background: #c6f6d5; color: #22543d; text-decoration: none; }
+.old-number { color: #718096; font-weight: 400; font-size: 0.85rem; }
+"""
+
+
+def render_html(changes: list[dict], old_name: str, new_name: str, anchors: dict, link: str) -> str:
+    parts = []
+    for entry in changes:
+        number = entry["new_number"] or entry["old_number"]
+        heading = html.escape(f"{number} {entry['title']}" if entry["kind"] != "item" else number)
+        anchor = entry["anchor"]
+        if anchor and link:
+            chapter, section, item = anchor
+            target = anchors.get(f"{chapter}-{section}-{item}") if entry["kind"] == "item" else None
+            if target:
+                heading = f'<a href="{html.escape(link)}#{html.escape(target)}">{heading}</a>'
+        if entry["old_number"] and entry["new_number"] and entry["old_number"] != entry["new_number"]:
+            heading += f' <span class="old-number">(종전 {html.escape(entry["old_number"])})</span>'
+
+        if entry["status"] == "modified":
+            body = "".join(
+                html.escape(text) if op == "equal" else f"<{op[:3]}>{html.escape(text)}</{op[:3]}>"
+                for op, text in entry["diff"]
+            )
+        elif entry["status"] == "added" and entry["kind"] == "item":
+            body = f"<ins>{html.escape(entry['new_text'])}</ins>"
+        elif entry["status"] == "removed" and entry["kind"] == "item":
+            body = f"<del>{html.escape(entry['old_text'])}</del>"
+        else:
+            body = ""
+
+        parts.append(
+            f'<div class="change {entry["kind"]}">'
+            f'<div class="change-header"><span class="badge {entry["status"]}">{STATUS_NAMES[entry["status"]]}</span>{heading}</div>'
+            + (f'<div class="text">{body}</div>' if body else "")
+            + "</div>"
+        )
+
+    summary = summarize(changes)
+    summary_text = " · ".join(
+        f"{KIND_NAMES[kind]} {', '.join(f'{STATUS_NAMES[s]} {n}' for s, n in counts.items())}"
+        for kind, counts in sorted(summary.items(), key=lambda kv: KIND_ORDER[kv[0]])
+    ) or "변경 사항 없음"
+    title = f"차량기술규정 변경 사항 ({old_name} → {new_name})"
+
+    return f"""<!DOCTYPE html>
+<html lang="ko">
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <title>{html.escape(title)}</title>
+  <style>{CHANGES_STYLE}</style>
+</head>
+<body>
+  <h1>{html.escape(title)}</h1>
+  <p class="summary">{html.escape(summary_text)}</p>
+  {"".join(parts)}
+</body>
+</html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Structural diff of formula.tex between two git revisions"
+    )
+    parser.add_argument("old", help="Old git revision (tag, branch or commit)")
+    parser.add_argument("new", nargs="?", default=None,
+                        help="New git revision (default: working tree)")
+    parser.add_argument(
+        "--tex",
+        default=str(Path(__file__).parent / "formula.tex"),
+        help="Path to formula.tex (default: ./formula.tex)",
+    )
+    parser.add_argument("--html", default="changes.html", help="HTML changes page (default: changes.html)")
+    parser.add_argument("--json", default="changes.json", help="JSON changelog (default: changes.json)")
+    parser.add_argument("--link", default="formula.html",
+                        help="HTML rulebook that changed items link to (default: formula.html, '' for none)")
+    args = parser.parse_args()
+
+    tex_path = Path(args.tex).resolve()
+    old_name = args.old
+    new_name = args.new or "working tree"
+
+    start = time.perf_counter()
+    old_tex = read_revision(tex_path, args.old)
+    new_tex = read_revision(tex_path, args.new)
+    old_units = parse_units(old_tex)
+    new_units = parse_units(new_tex)
+    changes = compare(old_units, new_units)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump({
+            "old": old_name,
+            "new": new_name,
+            "summary": summarize(changes),
+            "changes": [{k: v for k, v in entry.items() if k not in ("anchor", "diff")} for entry in changes],
+        }, f, ensure_ascii=False, indent=2)
+
+    with open(args.html, "w", encoding="utf-8") as f:
+        f.write(render_html(changes, old_name, new_name, item_anchors(new_tex) if args.link else {}, args.link))
+
+    print(f"Compared {len(old_units)} → {len(new_units)} units in {elapsed:.0f} ms: {len(changes)} changes")
+    for kind, counts in sorted(summarize(changes).items(), key=lambda kv: KIND_ORDER[kv[0]]):
+        print(f"  {kind}: " + ", ".join(f"{n} {status}" for status, n in counts.items()))
+    print(f"Wrote {args.html} and {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -5,11 +5,106 @@ Parses .aux file to resolve references, then converts to HTML.
 For pdflatex branch (formula.tex)
 """
 
+import os
 import re
 import sys
+import argparse
+import json
+import time
+import gzip
+import queue
+import atexit
+import html
+import shutil
+import hashlib
+import threading
 import subprocess
+import urllib.parse
+import http.server
+import concurrent.futures
 from pathlib import Path
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CACHE_DIR_NAME = '.tex2html-cache'
+
+REF_PATTERN = re.compile(r'\\(figref|cref|Cref|ref|pageref)\{([^}]+)\}')
+
+# Pandoc runs once per chapter chunk; fragments are cached by chunk hash
+PANDOC_ARGS = ['-f', 'latex', '-t', 'html5', '--mathjax', '--wrap=none']
+PANDOC_JOBS = 8
+DOCUMENT_TITLE = 'Formula Student Korea 차량기술규정'
+
+# Long-lived `pandoc lua` workers: length-prefixed LaTeX in on stdin, HTML out on stdout.
+# Writer options mirror PANDOC_ARGS (html5, --wrap=none, --mathjax).
+PANDOC_WORKER_LUA = r"""
+local opts = {wrap_text = 'none', html_math_method = 'mathjax'}
+local logged = 0
+while true do
+  local header = io.read('l')
+  if not header then break end
+  local text = io.read(tonumber(header))
+  local ok, result = pcall(function()
+    return pandoc.write(pandoc.read(text, 'latex'), 'html5', opts)
+  end)
+  result = tostring(result)
+  -- Warnings the CLI would print to stderr at its default verbosity
+  local log, warnings = PANDOC_STATE.log, {}
+  for i = logged + 1, #log do
+    local entry = pandoc.json.decode(pandoc.json.encode(log[i]))
+    if entry.verbosity ~= 'INFO' then
+      table.insert(warnings, '[' .. entry.verbosity .. '] ' .. entry.pretty .. '\n')
+    end
+  end
+  logged = #log
+  warnings = table.concat(warnings)
+  io.write(ok and 'ok' or 'error', ' ', #result, ' ', #warnings, '\n', result, warnings)
+  io.flush()
+end
+"""
+PANDOC_WORKER_TIMEOUT = 120  # seconds per chunk before a worker is killed
+
+# --watch polling interval (seconds) and server-sent reload endpoint for --serve
+WATCH_INTERVAL = 0.2
+RELOAD_PATH = '/__reload'
+RELOAD_SCRIPT = (
+    "<script>new EventSource('" + RELOAD_PATH + "')"
+    ".addEventListener('reload', () => location.reload());</script>\n"
+)
+
+# Responsive figure variants (assets/responsive/), widths in px
+IMAGE_VARIANT_DIR = 'responsive'
+IMAGE_WIDTHS = (480, 960, 1600)
+IMAGE_CONTENT_WIDTH = 912  # #content max-width minus padding in style.css
+
+# Files precompressed by --publish
+COMPRESSIBLE_SUFFIXES = ('.html', '.css', '.js', '.json')
+
+# Web font subsetting (--fonts): @font-face blocks in style.css and glyphs always kept
+FONT_FACE_PATTERN = re.compile(r'@font-face\s*\{[^}]*\}')
+FONT_URL_PATTERN = re.compile(r"""src:\s*url\(['"]?([^'")]+)['"]?\)(?:\s*format\(['"]?[^'")]+['"]?\))?""")
+FONT_BASE_CHARS = ''.join(chr(c) for c in range(0x20, 0x7F)) + '\u00a0\u00b7\u2013\u2014\u2018\u2019\u201c\u201d\u2026'
+
+# Page script listener registrations reported by --script-stats
+LISTENER_PATTERN = re.compile(r"""(\w+)\.addEventListener\(\s*['"](\w+)['"]""")
+OBSERVER_PATTERN = re.compile(r'new\s+(\w+Observer)\b')
+
+
+def get_cache_dir(tex_path):
+    """Return the build cache directory next to the tex file, creating it if needed."""
+    cache_dir = Path(tex_path).parent / CACHE_DIR_NAME
+    cache_dir.mkdir(exist_ok=True)
+    return cache_dir
+
+
+def file_hash(path):
+    """Return the sha256 hex digest of a file's contents."""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
 
 def parse_nested_braces(s, start=0):
     """Parse content within nested braces starting at position start."""
@@ -75,20 +170,49 @@ def parse_aux_file(aux_path):
     return labels
 
 
-def resolve_refs_in_tex(tex_content, labels):
-    """Replace ref, cref, Cref with resolved values as links."""
+def load_label_index(aux_path, cache_dir):
+    """
+    Load the label table from the cached index, re-parsing .aux only when it changed.
+    Returns (labels, from_cache).
+    """
+    aux_hash = file_hash(aux_path)
+    index_path = Path(cache_dir) / 'labels.json'
+
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('aux_hash') == aux_hash:
+            return index['labels'], True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    labels = parse_aux_file(aux_path)
+
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump({'aux_hash': aux_hash, 'labels': labels}, f,
+                  ensure_ascii=False, separators=(',', ':'))
+
+    return labels, False
+
+
+def resolve_refs_in_tex(tex_content, labels, unresolved=None):
+    """
+    Replace figref, cref, Cref, ref with resolved values as links and drop pageref.
+    Labels missing from the .aux are added to the unresolved set if given.
+    """
 
     def get_label_display(label):
         if label in labels:
             return labels[label]
+        if unresolved is not None:
+            unresolved.add(label)
         return f'[{label}]'
 
     def make_link(label, text):
         anchor = label.replace(':', '-').replace(' ', '-')
         return f'\\hyperlink{{{anchor}}}{{{text}}}'
 
-    def replace_cref(match):
-        label = match.group(1)
+    def replace_cref(label):
         ref_text = get_label_display(label)
 
         if label.startswith('fig:'):
@@ -104,17 +228,88 @@ def resolve_refs_in_tex(tex_content, labels):
 
         return make_link(label, display)
 
-    def replace_ref(match):
-        label = match.group(1)
+    def replace_ref(label):
         return make_link(label, get_label_display(label))
 
-    tex_content = re.sub(r'\\figref\{([^}]+)\}', replace_cref, tex_content)
-    tex_content = re.sub(r'\\cref\{([^}]+)\}', replace_cref, tex_content)
-    tex_content = re.sub(r'\\Cref\{([^}]+)\}', replace_cref, tex_content)
-    tex_content = re.sub(r'\\ref\{([^}]+)\}', replace_ref, tex_content)
-    tex_content = re.sub(r'\\pageref\{([^}]+)\}', '', tex_content)
+    def replace_any(match):
+        command, label = match.group(1), match.group(2)
+        if command == 'pageref':
+            return ''
+        if command == 'ref':
+            return replace_ref(label)
+        return replace_cref(label)
+
+    # Single pass over figref, cref, Cref, ref and pageref
+    return REF_PATTERN.sub(replace_any, tex_content)
+
+
+ITEM_TOKEN_PATTERN = re.compile(
+    r'\\(chapter|section)\{|\\(begin|end)\{(enumerate|itemize|description)\}|\\item\b(?:\[[^\]]*\])?'
+)
+
+
+def assign_item_anchors(tex_content):
+    """
+    Give every enumerate \\item a stable anchor placed right after \\item.
+    Items with a \\label{item:...} keep their label-derived anchor (the label is moved
+    to the start of the item); others get item-<chapter>-<section>-<item>[-<subitem>...],
+    where section is the document-wide 제N조 number (0 before a chapter's first section)
+    and later top-level lists in the same section are prefixed l2, l3, ...
+    Returns (tex_content, item_map) with item_map mapping the path to the anchor.
+    """
+    chapter = 0
+    section = 0
+    chapter_section = 0
+    stack = []  # [list type, item count]
+    scope_lists = 0  # top-level enumerate lists seen in the current chapter/section
+    item_map = {}
+    pieces = []
+    pos = 0
 
-    return tex_content
+    matches = list(ITEM_TOKEN_PATTERN.finditer(tex_content))
+    for i, match in enumerate(matches):
+        if match.group(1) == 'chapter':
+            chapter += 1
+            chapter_section = 0
+            scope_lists = 0
+        elif match.group(1) == 'section':
+            section += 1
+            chapter_section = section
+            scope_lists = 0
+        elif match.group(2) == 'begin':
+            if match.group(3) == 'enumerate' and not any(kind == 'enumerate' for kind, _ in stack):
+                scope_lists += 1
+            stack.append([match.group(3), 0])
+        elif match.group(2) == 'end':
+            if stack:
+                stack.pop()
+        elif stack and stack[-1][0] == 'enumerate':
+            stack[-1][1] += 1
+            numbers = [str(count) for kind, count in stack if kind == 'enumerate']
+            if scope_lists > 1:
+                numbers.insert(0, f'l{scope_lists}')
+            path = '-'.join([str(chapter), str(chapter_section)] + numbers)
+
+            # A label anywhere in the item's own text (before the next list token) names it
+            extent_end = matches[i + 1].start() if i + 1 < len(matches) else len(tex_content)
+            label = re.compile(r'\\label\{(item:[^}]+)\}').search(tex_content, match.end(), extent_end)
+
+            if label:
+                anchor = label.group(1).replace(':', '-').replace(' ', '-')
+                pieces.append(tex_content[pos:match.end()])
+                pieces.append(f' \\hypertarget{{{anchor}}}{{}}')
+                pieces.append(tex_content[match.end():label.start()])
+                pos = label.end()
+            else:
+                anchor = f'item-{path}'
+                pieces.append(tex_content[pos:match.end()])
+                pieces.append(f' \\hypertarget{{{anchor}}}{{}}')
+                pos = match.end()
+
+            item_map[path] = anchor
+
+    pieces.append(tex_content[pos:])
+    return ''.join(pieces), item_map
 
 
 def preprocess_tex_for_pandoc(tex_content):
@@ -389,9 +584,185 @@ def generate_toc(html_content):
     return '\n      '.join(toc_items)
 
 
+MATHJAX_SCRIPT = """  <script>
+    MathJax = {
+      tex: {
+        inlineMath: [['\\\\(', '\\\\)']],
+        displayMath: [['\\\\[', '\\\\]']]
+      }
+    };
+  </script>
+  <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
+"""
+
+# TeX math commands the build-time MathML renderer understands: command -> (element, text)
+MATH_SYMBOLS = {
+    'times': ('mo', '×'), 'cdot': ('mo', '⋅'), 'div': ('mo', '÷'), 'pm': ('mo', '±'),
+    'le': ('mo', '≤'), 'leq': ('mo', '≤'), 'ge': ('mo', '≥'), 'geq': ('mo', '≥'),
+    'neq': ('mo', '≠'), 'approx': ('mo', '≈'), 'sim': ('mo', '∼'), 'to': ('mo', '→'),
+    'rightarrow': ('mo', '→'), 'circ': ('mo', '∘'), 'infty': ('mi', '∞'),
+    'varnothing': ('mi', '∅'), 'emptyset': ('mi', '∅'), 'phi': ('mi', 'ϕ'), 'varphi': ('mi', 'φ'),
+    'alpha': ('mi', 'α'), 'beta': ('mi', 'β'), 'gamma': ('mi', 'γ'), 'delta': ('mi', 'δ'),
+    'epsilon': ('mi', 'ϵ'), 'varepsilon': ('mi', 'ε'), 'eta': ('mi', 'η'), 'theta': ('mi', 'θ'),
+    'lambda': ('mi', 'λ'), 'mu': ('mi', 'μ'), 'pi': ('mi', 'π'), 'rho': ('mi', 'ρ'),
+    'sigma': ('mi', 'σ'), 'tau': ('mi', 'τ'), 'omega': ('mi', 'ω'),
+    'Delta': ('mi', 'Δ'), 'Sigma': ('mi', 'Σ'), 'Omega': ('mi', 'Ω'),
+    '%': ('mo', '%'), '&': ('mo', '&'), '$': ('mo', '$'), '{': ('mo', '{'), '}': ('mo', '}'),
+}
+MATH_SPACES = {' ': '0.25em', ',': '0.1667em', ';': '0.2778em', 'quad': '1em', 'qquad': '2em'}
+MATH_TEXT_COMMANDS = ('mathrm', 'text', 'textrm', 'mbox')
+MATH_OPERATORS = set('=+-<>()[]/,.:;|!\'*')
+
+
+class MathConversionError(Exception):
+    """Raised when a TeX math expression uses constructs the MathML renderer does not handle."""
+
+
+def tex_math_to_mathml(tex, display=False):
+    """
+    Render a simple TeX math expression to MathML Core.
+    Supports symbols, Greek letters, sub/superscripts, \\frac, \\sqrt and \\mathrm/\\text runs;
+    raises MathConversionError for anything else.
+    """
+    tokens = re.findall(r'\\[a-zA-Z]+|\\.|[가-힣]+|[0-9]+(?:\.[0-9]+)?|\s+|.', tex)
+    pos = 0
+
+    def take():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise MathConversionError('unexpected end of expression')
+        tok = tokens[pos]
+        pos += 1
+        return tok
+
+    def parse_text_group():
+        if take() != '{':
+            raise MathConversionError('expected { after text command')
+        parts = []
+        while True:
+            tok = take()
+            if tok == '}':
+                return ''.join(parts)
+            if tok.startswith('\\'):
+                name = tok[1:]
+                if name in MATH_SPACES:
+                    parts.append(' ')
+                elif name in ('%', '&', '$', '_'):
+                    parts.append(name)
+                else:
+                    raise MathConversionError(f'unsupported command in text: {tok}')
+            elif tok == '{':
+                raise MathConversionError('nested group in text')
+            else:
+                parts.append(tok)
+
+    def parse_atom():
+        tok = take()
+        if tok == '{':
+            return f'<mrow>{"".join(parse_sequence("}"))}</mrow>'
+        if tok.startswith('\\'):
+            name = tok[1:]
+            if name in MATH_TEXT_COMMANDS:
+                return f'<mtext>{html.escape(parse_text_group())}</mtext>'
+            if name == 'frac':
+                return f'<mfrac>{parse_atom()}{parse_atom()}</mfrac>'
+            if name == 'sqrt':
+                return f'<msqrt>{parse_atom()}</msqrt>'
+            if name in MATH_SPACES:
+                return f'<mspace width="{MATH_SPACES[name]}"></mspace>'
+            if name in MATH_SYMBOLS:
+                element, text = MATH_SYMBOLS[name]
+                return f'<{element}>{html.escape(text)}</{element}>'
+            raise MathConversionError(f'unsupported command: {tok}')
+        if tok[0].isdigit():
+            return f'<mn>{tok}</mn>'
+        if '가' <= tok[0] <= '힣':
+            return f'<mtext>{tok}</mtext>'
+        if tok.isascii() and tok.isalpha():
+            return f'<mi>{tok}</mi>'
+        if tok in MATH_OPERATORS:
+            return f'<mo>{html.escape(tok)}</mo>'
+        raise MathConversionError(f'unsupported token: {tok!r}')
+
+    def parse_sequence(stop=None):
+        nonlocal pos
+        items = []
+        while pos < len(tokens):
+            tok = tokens[pos]
+            if tok.isspace():
+                pos += 1
+                continue
+            if tok == '}':
+                if stop != '}':
+                    raise MathConversionError('unbalanced }')
+                pos += 1
+                return items
+            if tok in ('_', '^'):
+                raise MathConversionError(f'{tok} without base')
+
+            base = parse_atom()
+            sub = sup = None
+            while pos < len(tokens) and tokens[pos] in ('_', '^'):
+                marker = take()
+                script = parse_atom()
+                if marker == '_':
+                    sub = script
+                else:
+                    sup = script
+            if sub and sup:
+                base = f'<msubsup>{base}{sub}{sup}</msubsup>'
+            elif sub:
+                base = f'<msub>{base}{sub}</msub>'
+            elif sup:
+                base = f'<msup>{base}{sup}</msup>'
+            items.append(base)
+
+        if stop is not None:
+            raise MathConversionError('unbalanced {')
+        return items
+
+    body = ''.join(parse_sequence())
+    mode = 'block' if display else 'inline'
+    return f'<math display="{mode}"><mrow>{body}</mrow></math>'
+
+
+def prerender_math(html_content):
+    """
+    Replace pandoc's MathJax math spans with static MathML.
+    Returns (html_content, converted, failed); failed expressions keep their TeX for MathJax.
+    """
+    counts = {'converted': 0, 'failed': 0}
+
+    def replace_math(match):
+        mode = match.group(1)
+        tex = html.unescape(match.group(2))
+        tex = re.sub(r'^\\[(\[]|\\[)\]]$', '', tex)
+        try:
+            mathml = tex_math_to_mathml(tex, display=(mode == 'display'))
+        except MathConversionError as e:
+            print(f"Warning: math left to MathJax ({e}): {tex}")
+            counts['failed'] += 1
+            return match.group(0)
+        counts['converted'] += 1
+        return f'<span class="math {mode}">{mathml}</span>'
+
+    html_content = re.sub(
+        r'<span class="math (inline|display)">(.*?)</span>',
+        replace_math,
+        html_content,
+        flags=re.DOTALL
+    )
+    return html_content, counts['converted'], counts['failed']
+
+
 def postprocess_html(html_content):
     """Post-process the HTML output for better formatting."""
 
+    # Render math at build time; MathJax is only loaded if something could not be converted
+    html_content, converted, failed = prerender_math(html_content)
+    print(f"Math: {converted} expressions prerendered to MathML, {failed} left to MathJax")
+    html_content = html_content.replace('  <!-- MATHJAX_PLACEHOLDER -->\n', MATHJAX_SCRIPT if failed else '')
+
     def convert_hyperlink(match):
         target = match.group(1)
         text = match.group(2)
@@ -413,6 +784,13 @@ def postprocess_html(html_content):
         html_content
     )
 
+    # Move item anchors from the leading empty span/div onto the <li> itself
+    html_content = re.sub(
+        r'<li>(\s*<p>)?\s*<(span|div) id="(item-[^"]+)">\s*</\2>\s*',
+        lambda m: f'<li id="{m.group(3)}">{m.group(1) or ""}',
+        html_content
+    )
+
     html_content = html_content.replace('\\%', '%')
     html_content = html_content.replace('\\&', '&amp;')
     html_content = html_content.replace('\\$', '$')
@@ -427,6 +805,459 @@ def postprocess_html(html_content):
     return html_content
 
 
+def optimize_images(html_content, output_dir, cache_dir):
+    """
+    Replace figure <img> tags with <picture> elements serving downscaled AVIF/WebP variants.
+    Variants are written to assets/responsive/ named by source hash, so unchanged
+    images are never re-encoded. Skipped when Pillow is not installed.
+    """
+    try:
+        from PIL import Image, features
+    except ImportError:
+        print("Warning: Pillow not installed, skipping responsive images (pip install pillow)")
+        return html_content
+
+    output_dir = Path(output_dir)
+    variant_dir = output_dir / 'assets' / IMAGE_VARIANT_DIR
+    variant_dir.mkdir(parents=True, exist_ok=True)
+
+    formats = [('avif', 'image/avif', {'quality': 50})] if features.check('avif') else []
+    formats.append(('webp', 'image/webp', {'quality': 80, 'method': 6}))
+
+    cache_path = Path(cache_dir) / 'images.json'
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    stats = {'encoded': 0, 'cached': 0, 'original': 0}
+    full_size = {ext: 0 for ext, _, _ in formats}
+
+    def variants_for(src):
+        source = output_dir / urllib.parse.unquote(src)
+        if not source.is_file():
+            return None
+
+        digest = file_hash(source)
+        entry = cache.get(src)
+        if entry is None or entry['hash'] != digest:
+            with Image.open(source) as img:
+                entry = {'hash': digest, 'width': img.width, 'height': img.height}
+            cache[src] = entry
+
+        widths = [w for w in IMAGE_WIDTHS if w < entry['width']] + [entry['width']]
+        img = None
+        result = {}
+        for ext, mime, options in formats:
+            srcset = []
+            for width in widths:
+                name = f'{digest[:16]}-{width}.{ext}'
+                target = variant_dir / name
+                if target.exists():
+                    stats['cached'] += 1
+                else:
+                    if img is None:
+                        with Image.open(source) as src_img:
+                            img = src_img.convert('RGB')
+                    height = round(entry['height'] * width / entry['width'])
+                    resized = img if width == entry['width'] else img.resize((width, height), Image.LANCZOS)
+                    resized.save(target, ext.upper(), **options)
+                    stats['encoded'] += 1
+                srcset.append(f'assets/{IMAGE_VARIANT_DIR}/{name} {width}w')
+            result[mime] = ', '.join(srcset)
+            full_size[ext] += (variant_dir / f'{digest[:16]}-{widths[-1]}.{ext}').stat().st_size
+        stats['original'] += source.stat().st_size
+        return entry, result
+
+    def replace_img(match):
+        attrs = match.group(1)
+        src = re.search(r'src="([^"]+)"', attrs)
+        if not src or not src.group(1).startswith('assets/'):
+            return match.group(0)
+
+        found = variants_for(src.group(1))
+        if found is None:
+            return match.group(0)
+        entry, srcsets = found
+
+        # Rendered width from the \\fig width (style="width:NN%") relative to #content
+        percent = re.search(r'width:\s*([\d.]+)%', attrs)
+        percent = float(percent.group(1)) if percent else 100.0
+        sizes = f'(max-width: 1024px) {percent:.0f}vw, {round(IMAGE_CONTENT_WIDTH * percent / 100)}px'
+
+        sources = ''.join(
+            f'<source type="{mime}" srcset="{srcset}" sizes="{sizes}">'
+            for mime, srcset in srcsets.items()
+        )
+        img_attrs = (f'{attrs.strip()} width="{entry["width"]}" height="{entry["height"]}" '
+                     f'loading="lazy" decoding="async"')
+        return f'<picture>{sources}<img {img_attrs} /></picture>'
+
+    html_content = re.sub(r'<img\s([^>]*?)\s*/?>', replace_img, html_content)
+
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+
+    sizes = ', '.join(f'{ext} {size / 1024:.0f} KB' for ext, size in full_size.items())
+    print(f"Images: {stats['encoded']} variants encoded, {stats['cached']} cached; "
+          f"originals {stats['original'] / 1024:.0f} KB -> full-width {sizes}")
+    return html_content
+
+
+def page_script_name(output_path):
+    """Return the file name of the page script written next to the HTML output."""
+    return f'{Path(output_path).stem}.js'
+
+
+def page_script_stats(script):
+    """
+    Static statistics of the page script for --script-stats: size (raw and gzip) and the
+    event listeners and observers it registers, by event type. Counts are of registrations
+    in the source; a listener added inside a loop is counted once.
+    """
+    raw = script.encode('utf-8')
+    listeners = {}
+    for _, event in LISTENER_PATTERN.findall(script):
+        listeners[event] = listeners.get(event, 0) + 1
+    return {
+        'script_bytes': len(raw),
+        'script_gzip_bytes': len(gzip.compress(raw, compresslevel=9)),
+        'listeners': listeners,
+        'observers': OBSERVER_PATTERN.findall(script),
+    }
+
+
+def search_index_name(output_path):
+    """Return the file name of the search index written next to the HTML output."""
+    return f'{Path(output_path).stem}.search.json.gz'
+
+
+def tokenize_search_text(text):
+    """
+    Tokenize text for the search index: Hangul runs become bigrams
+    (single syllables are kept as-is), Latin/digit runs become lowercase words.
+    Must stay in sync with tokenize() in the page search script.
+    """
+    tokens = set()
+    for word in re.findall(r'[가-힣]+|[0-9a-z]+', text.lower()):
+        if '가' <= word[0] <= '힣' and len(word) > 1:
+            tokens.update(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.add(word)
+    return tokens
+
+
+def html_to_text(html_fragment):
+    """Strip tags and decode entities from an HTML fragment."""
+    text = re.sub(r'<[^>]+>', ' ', html_fragment)
+    return re.sub(r'\s+', ' ', html.unescape(text)).strip()
+
+
+def build_search_index(html_content, manifest=None):
+    """
+    Build a compact search index with one document per chapter/section heading and item anchor.
+    Postings are delta-encoded document numbers per token, sorted by token.
+    """
+    main_open = html_content.find('<main id="content">')
+    main_close = html_content.rfind('</main>')
+    body = html_content[main_open:main_close] if main_open != -1 else html_content
+
+    anchor_pattern = re.compile(
+        r'<(h1|h2)[^>]*\sid="([^"]+)"[^>]*>(.*?)</\1>|<[a-z]+[^>]*\sid="(item-[^"]+)"[^>]*>'
+    )
+    matches = list(anchor_pattern.finditer(body))
+
+    pages = [page['file'] for page in manifest['pages']] if manifest else []
+    page_index = {name: i for i, name in enumerate(pages)}
+
+    docs = []
+    postings = {}
+    heading = ''
+    for i, match in enumerate(matches):
+        if match.group(1):
+            anchor = match.group(2)
+            heading = html_to_text(match.group(3))
+            text_start = match.end()
+        else:
+            anchor = match.group(4)
+            text_start = match.end()
+        text_end = matches[i + 1].start() if i + 1 < len(matches) else len(body)
+        text = html_to_text(body[text_start:text_end])
+
+        doc_id = len(docs)
+        page = page_index.get(manifest['anchors'].get(anchor), 0) if manifest else 0
+        docs.append([anchor, page, heading, text[:80]])
+
+        for token in tokenize_search_text(heading + ' ' + text):
+            postings.setdefault(token, []).append(doc_id)
+
+    terms = sorted(postings)
+    encoded = []
+    for term in terms:
+        ids = postings[term]
+        encoded.append([ids[0]] + [b - a for a, b in zip(ids, ids[1:])])
+
+    return {'pages': pages, 'docs': docs, 'terms': terms, 'postings': encoded}
+
+
+def split_html_pages(html_content, output_path):
+    """
+    Split the rendered HTML into one page per chapter sharing the same TOC/nav shell.
+    The first page keeps the output file name and also holds the title block.
+    Returns (pages, manifest) where pages maps file name to HTML content.
+    """
+    output_path = Path(output_path)
+
+    main_open = re.search(r'<main id="content">\n?', html_content)
+    main_close = html_content.rfind('</main>')
+    if not main_open or main_close == -1:
+        return {output_path.name: html_content}, {'pages': [], 'anchors': {}}
+
+    shell_head = html_content[:main_open.end()]
+    shell_tail = html_content[main_close:]
+    body = html_content[main_open.end():main_close]
+
+    chunks = re.split(r'(?=<h1[\s>])', body)
+    if len(chunks) > 1 and not re.search(r'<h1[\s>]', chunks[0]):
+        chunks[1] = chunks[0] + chunks[1]
+        chunks = chunks[1:]
+
+    page_names = [output_path.name] + [
+        f'{output_path.stem}-{n}{output_path.suffix}' for n in range(2, len(chunks) + 1)
+    ]
+    manifest_name = f'{output_path.stem}.manifest.json'
+
+    manifest = {'pages': [], 'anchors': {}}
+    for name, chunk in zip(page_names, chunks):
+        heading = re.search(r'<h1[^>]*>([^<]*)</h1>', chunk)
+        title = heading.group(1).strip() if heading else ''
+        manifest['pages'].append({'file': name, 'title': title})
+        for anchor in re.findall(r'\sid="([^"]+)"', chunk):
+            manifest['anchors'].setdefault(anchor, name)
+
+    # Old single-page deep links land on the first page; forward them to the right one
+    redirect_script = f'''  <script>
+    (function() {{
+      const id = decodeURIComponent(window.location.hash.slice(1));
+      if (!id) return;
+      document.addEventListener('DOMContentLoaded', () => {{
+        if (document.getElementById(id)) return;
+        fetch('{manifest_name}')
+          .then(r => r.json())
+          .then(m => {{
+            const page = m.anchors[id];
+            if (page) window.location.replace(page + window.location.search + window.location.hash);
+          }});
+      }});
+    }})();
+  </script>
+'''
+
+    pages = {}
+    for i, (name, chunk) in enumerate(zip(page_names, chunks)):
+        def rewrite_href(match):
+            anchor = match.group(1)
+            page = manifest['anchors'].get(anchor)
+            if page is None or page == name:
+                return match.group(0)
+            return f'href="{page}#{anchor}"'
+
+        head_extra = ''
+        for neighbour in (i - 1, i + 1):
+            if 0 <= neighbour < len(page_names):
+                head_extra += f'  <link rel="prefetch" href="{page_names[neighbour]}">\n'
+        head_extra += redirect_script
+
+        page_head = shell_head.replace('</head>', head_extra + '</head>', 1)
+        title = manifest['pages'][i]['title']
+        if title:
+            page_head = page_head.replace('<title>', f'<title>{title} - ', 1)
+
+        page = page_head + chunk + shell_tail
+        pages[name] = re.sub(r'href="#([^"]+)"', rewrite_href, page)
+
+    return pages, manifest
+
+
+def split_tex_chunks(tex_content):
+    """Split the document body of preprocessed LaTeX at each \\chapter so chapters convert independently."""
+    body = re.search(r'\\begin\{document\}(.*)\\end\{document\}', tex_content, re.S)
+    if body:
+        tex_content = body.group(1)
+    return [chunk for chunk in re.split(r'(?=^\\chapter\{)', tex_content, flags=re.M) if chunk.strip()]
+
+
+def pandoc_version():
+    """Return the `pandoc --version` banner (part of the fragment cache key)."""
+    global _pandoc_version
+    if _pandoc_version is None:
+        result = subprocess.run(['pandoc', '--version'], capture_output=True, text=True)
+        _pandoc_version = result.stdout.splitlines()[0] if result.stdout else ''
+    return _pandoc_version
+
+
+_pandoc_version = None
+
+
+class PandocError(Exception):
+    pass
+
+
+class PandocWorkerError(Exception):
+    pass
+
+
+class PandocWorker:
+    """One `pandoc lua` process converting documents sent over its stdin, restarted if it dies."""
+
+    def __init__(self, script_path):
+        self.script_path = script_path
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(['pandoc', 'lua', str(self.script_path)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+
+    def convert(self, text):
+        """Return (html, warnings) for text; raises PandocWorkerError if pandoc fails or hangs."""
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        data = text.encode('utf-8')
+        timer = threading.Timer(PANDOC_WORKER_TIMEOUT, self.process.kill)
+        timer.start()
+        try:
+            self.process.stdin.write(f'{len(data)}\n'.encode('ascii') + data)
+            self.process.stdin.flush()
+            status, length, warnings_length = self.process.stdout.readline().split()
+            length, warnings_length = int(length), int(warnings_length)
+            reply = self.process.stdout.read(length + warnings_length)
+            if len(reply) != length + warnings_length:
+                raise ValueError('truncated reply')
+            output = reply[:length].decode('utf-8')
+            warnings = reply[length:].decode('utf-8')
+        except (OSError, ValueError) as e:
+            timed_out = not timer.is_alive()
+            self.close()
+            if timed_out:
+                raise PandocWorkerError(f'no response in {PANDOC_WORKER_TIMEOUT} s, worker killed')
+            raise PandocWorkerError(f'worker died: {e}')
+        finally:
+            timer.cancel()
+        if status != b'ok':
+            raise PandocWorkerError(output)
+        return output + '\n', warnings  # the CLI ends its output with a newline
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+_pandoc_workers = None
+
+
+def pandoc_workers(cache_dir):
+    """
+    Queue of persistent pandoc workers shared by every build in this process (e.g. --watch),
+    or None when `pandoc lua` is unavailable (pandoc < 3, no Lua support).
+    """
+    global _pandoc_workers
+    if _pandoc_workers is None:
+        script_path = Path(cache_dir) / 'pandoc-worker.lua'
+        script_path.write_text(PANDOC_WORKER_LUA, encoding='utf-8')
+        first = PandocWorker(script_path)
+        try:
+            first.convert('x')
+        except (OSError, PandocWorkerError):
+            first.close()
+            _pandoc_workers = False
+            return None
+
+        _pandoc_workers = queue.Queue()
+        _pandoc_workers.put(first)
+        for _ in range(min(PANDOC_JOBS, os.cpu_count() or 1) - 1):
+            _pandoc_workers.put(PandocWorker(script_path))
+        atexit.register(lambda: [worker.close() for worker in list(_pandoc_workers.queue)])
+    return _pandoc_workers or None
+
+
+def run_pandoc(tex_content, cache_dir, use_worker=True):
+    """
+    Convert preprocessed LaTeX to an HTML body fragment.
+    Each chapter is converted separately (in parallel) and cached in .tex2html-cache/pandoc/
+    by content hash, so an edit only reconverts the chapters it touches. Chapters go to the
+    persistent pandoc workers when available, otherwise to one pandoc subprocess each.
+    Returns (body, converted, cached, backend); raises PandocError if a chunk fails to
+    convert, in which case nothing is cached for it.
+    """
+    fragment_dir = Path(cache_dir) / 'pandoc'
+    fragment_dir.mkdir(parents=True, exist_ok=True)
+    version = pandoc_version()
+
+    chunks = split_tex_chunks(tex_content)
+    paths = []
+    for chunk in chunks:
+        key = hashlib.sha256((version + ' '.join(PANDOC_ARGS) + chunk).encode('utf-8')).hexdigest()
+        paths.append(fragment_dir / f'{key[:32]}.html')
+
+    todo = [(chunk, path) for chunk, path in zip(chunks, paths) if not path.exists()]
+    workers = pandoc_workers(cache_dir) if use_worker and todo else None
+
+    def store(path, fragment):
+        # Write beside the target and rename, so an interrupted build never leaves a partial fragment
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp.write_text(fragment, encoding='utf-8')
+        os.replace(tmp, path)
+
+    def convert(chunk, path):
+        if workers:
+            worker = workers.get()
+            try:
+                output, warnings = worker.convert(chunk)
+                if warnings:
+                    print(f"Pandoc warnings/errors:\n{warnings}")
+                store(path, output)
+                return True
+            except PandocWorkerError as e:
+                print(f"Pandoc worker failed, retrying with a pandoc subprocess: {e}")
+            finally:
+                workers.put(worker)
+
+        result = subprocess.run(['pandoc', *PANDOC_ARGS], input=chunk, capture_output=True,
+                                text=True, encoding='utf-8')
+        if result.returncode != 0 or result.stderr.strip():
+            print(f"Pandoc warnings/errors:\n{result.stderr}")
+        if result.returncode != 0:
+            return False
+        store(path, result.stdout)
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(PANDOC_JOBS) as pool:
+        failed = sum(not ok for ok in pool.map(lambda job: convert(*job), todo))
+    if failed:
+        raise PandocError(f"pandoc failed on {failed} of {len(todo)} chapter chunks")
+
+    # Drop fragments of chunks that no longer exist
+    used = set(paths)
+    for path in fragment_dir.glob('*.html'):
+        if path not in used:
+            path.unlink()
+    for path in fragment_dir.glob('*.tmp'):
+        path.unlink(missing_ok=True)
+
+    body = ''.join(path.read_text(encoding='utf-8') for path in paths)
+    backend = 'pandoc workers' if workers else 'pandoc subprocesses'
+    return body, len(todo), len(paths) - len(todo), backend
+
+
+def fill_template(template, variables):
+    """Substitute $name$ variables in a pandoc-style template."""
+    return re.sub(r'\$([a-z-]+)\$', lambda m: variables.get(m.group(1), ''), template)
+
+
 def create_pandoc_template():
     """Create a custom pandoc HTML template."""
     return '''<!DOCTYPE html>
@@ -436,15 +1267,8 @@ def create_pandoc_template():
   <meta name="viewport" content="width=device-width, initial-scale=1.0">
   <title>$title$</title>
   <link rel="stylesheet" href="style.css">
-  <script>
-    MathJax = {
-      tex: {
-        inlineMath: [['$$', '$$'], ['\\\\(', '\\\\)']],
-        displayMath: [['\\\\[', '\\\\]']]
-      }
-    };
-  </script>
-  <script src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
+  <script src="$page-script$" defer></script>
+  <!-- MATHJAX_PLACEHOLDER -->
 </head>
 <body>
   <nav id="toc">
@@ -452,6 +1276,10 @@ def create_pandoc_template():
       <button id="toc-close" aria-label="Close TOC">✕</button>
       <span>목차</span>
     </div>
+    <div class="toc-search">
+      <input id="search-input" type="search" placeholder="규정 검색" autocomplete="off" data-index="$search-index$">
+      <div id="search-results"></div>
+    </div>
     <div class="toc-content">
       <!-- TOC_PLACEHOLDER -->
     </div>
@@ -463,424 +1291,880 @@ def create_pandoc_template():
   <main id="content">
 $body$
   </main>
-  <script>
-    // TOC Toggle
-    const tocToggle = document.getElementById('toc-toggle');
-    const tocClose = document.getElementById('toc-close');
-    const toc = document.getElementById('toc');
-    
-    tocToggle.addEventListener('click', () => {
-      toc.classList.add('open');
-    });
-    
-    tocClose.addEventListener('click', () => {
-      toc.classList.remove('open');
-    });
-    
-    // Close TOC when clicking a link on mobile
-    toc.querySelectorAll('a').forEach(link => {
-      link.addEventListener('click', () => {
-        if (window.innerWidth <= 1024) {
-          toc.classList.remove('open');
-        }
-      });
-    });
+</body>
+</html>
+'''
 
-    // TOC active section highlighting
-    const tocLinks = toc.querySelectorAll('a[href^="#"]');
-    const headings = [];
 
-    tocLinks.forEach(link => {
-      const id = link.getAttribute('href').slice(1);
-      const heading = document.getElementById(id);
-      if (heading) {
-        headings.push({ id, element: heading, link });
-      }
-    });
+def create_page_script():
+    """Create the page script, written next to the HTML and loaded with defer."""
+    return '''// TOC Toggle
+const tocToggle = document.getElementById('toc-toggle');
+const tocClose = document.getElementById('toc-close');
+const toc = document.getElementById('toc');
 
-    function updateActiveTocItem() {
-      const scrollPos = window.scrollY + 100;
+tocToggle.addEventListener('click', () => {
+  toc.classList.add('open');
+});
 
-      let activeHeading = null;
-      for (const h of headings) {
-        if (h.element.offsetTop <= scrollPos) {
-          activeHeading = h;
-        } else {
-          break;
+tocClose.addEventListener('click', () => {
+  toc.classList.remove('open');
+});
+
+// Close TOC when clicking a link on mobile
+toc.querySelectorAll('a').forEach(link => {
+  link.addEventListener('click', () => {
+    if (window.innerWidth <= 1024) {
+      toc.classList.remove('open');
+    }
+  });
+});
+
+// TOC active section highlighting
+// Headings are observed instead of measured on every scroll: the observer root is
+// everything below the activation line 100px from the top, so a heading stops
+// intersecting exactly when it scrolls above that line. Only the previously and
+// newly active links are touched.
+const headings = [];
+
+toc.querySelectorAll('a[href^="#"]').forEach(link => {
+  const heading = document.getElementById(link.getAttribute('href').slice(1));
+  if (heading) {
+    headings.push({ element: heading, link });
+  }
+});
+
+let activeTocLink = null;
+
+function setActiveTocLink(link) {
+  if (link === activeTocLink) return;
+  if (activeTocLink) activeTocLink.classList.remove('active');
+  if (link) link.classList.add('active');
+  activeTocLink = link;
+}
+
+if ('IntersectionObserver' in window && headings.length > 0) {
+  const passed = new Set();  // headings above the activation line, always a prefix in document order
+
+  const headingObserver = new IntersectionObserver((entries) => {
+    for (const entry of entries) {
+      if (entry.isIntersecting) {
+        passed.delete(entry.target);
+      } else {
+        passed.add(entry.target);
+      }
+    }
+    setActiveTocLink(passed.size > 0 ? headings[passed.size - 1].link : null);
+  }, { rootMargin: '-100px 0px 1000000px 0px' });
+
+  headings.forEach(h => headingObserver.observe(h.element));
+}
+
+// Search (precomputed index, loaded on first use)
+const searchInput = document.getElementById('search-input');
+const searchResults = document.getElementById('search-results');
+const tocContent = toc.querySelector('.toc-content');
+let searchIndex = null;
+let searchIndexLoading = null;
+
+function loadSearchIndex() {
+  if (!searchIndexLoading) {
+    searchIndexLoading = fetch(searchInput.dataset.index)
+      .then(r => r.arrayBuffer())
+      .then(buf => {
+        const bytes = new Uint8Array(buf);
+        // Already decoded if the server sent it with Content-Encoding: gzip
+        if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) {
+          return new TextDecoder().decode(bytes);
         }
+        const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        return new Response(stream).text();
+      })
+      .then(text => {
+        const data = JSON.parse(text);
+        // Postings are delta-encoded document numbers
+        data.postings = data.postings.map(gaps => {
+          let id = 0;
+          return gaps.map(gap => (id += gap));
+        });
+        searchIndex = data;
+      });
+  }
+  return searchIndexLoading;
+}
+
+// Must match tokenize_search_text() in tex2html.py
+function tokenize(text) {
+  const tokens = new Set();
+  const words = text.toLowerCase().match(/[가-힣]+|[0-9a-z]+/g) || [];
+  for (const word of words) {
+    if (word[0] >= '가' && word[0] <= '힣' && word.length > 1) {
+      for (let i = 0; i < word.length - 1; i++) {
+        tokens.add(word.substring(i, i + 2));
       }
+    } else {
+      tokens.add(word);
+    }
+  }
+  return Array.from(tokens);
+}
+
+function lowerBound(terms, key) {
+  let lo = 0;
+  let hi = terms.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >> 1;
+    if (terms[mid] < key) lo = mid + 1;
+    else hi = mid;
+  }
+  return lo;
+}
+
+function docsForToken(token) {
+  const terms = searchIndex.terms;
+  const docs = new Set();
+  const addTerm = i => searchIndex.postings[i].forEach(d => docs.add(d));
+
+  if (token.length === 1 && token >= '가' && token <= '힣') {
+    // Lone syllable (still typing): any bigram containing it
+    terms.forEach((term, i) => {
+      if (term.includes(token)) addTerm(i);
+    });
+  } else {
+    // Prefix match so partially typed words already hit
+    for (let i = lowerBound(terms, token); i < terms.length && terms[i].startsWith(token); i++) {
+      addTerm(i);
+    }
+  }
+  return docs;
+}
+
+function renderSearchResults(query) {
+  const tokens = tokenize(query);
+  searchResults.textContent = '';
+
+  if (tokens.length === 0) {
+    searchResults.style.display = 'none';
+    tocContent.style.display = '';
+    return;
+  }
+  searchResults.style.display = 'block';
+  tocContent.style.display = 'none';
+
+  const hits = new Map();
+  for (const token of tokens) {
+    for (const d of docsForToken(token)) {
+      hits.set(d, (hits.get(d) || 0) + 1);
+    }
+  }
+
+  let best = 0;
+  hits.forEach(count => { best = Math.max(best, count); });
+  const matches = Array.from(hits.keys())
+    .filter(d => hits.get(d) === best)
+    .sort((a, b) => a - b)
+    .slice(0, 30);
+
+  if (matches.length === 0) {
+    const empty = document.createElement('div');
+    empty.className = 'search-empty';
+    empty.textContent = '검색 결과가 없습니다';
+    searchResults.appendChild(empty);
+    return;
+  }
+
+  const pages = searchIndex.pages;
+  const file = window.location.pathname.split('/').pop();
+  const here = pages.includes(file) ? file : pages[0];
+
+  for (const d of matches) {
+    const [anchor, pageIdx, title, snippet] = searchIndex.docs[d];
+    const page = pages[pageIdx];
+    const link = document.createElement('a');
+    link.className = 'search-result';
+    link.href = (!page || page === here ? '' : page) + '#' + anchor;
+
+    const titleEl = document.createElement('span');
+    titleEl.className = 'search-result-title';
+    titleEl.textContent = title;
+    const snippetEl = document.createElement('span');
+    snippetEl.className = 'search-result-snippet';
+    snippetEl.textContent = snippet;
+
+    link.append(titleEl, snippetEl);
+    searchResults.appendChild(link);
+  }
+}
+
+searchInput.addEventListener('focus', loadSearchIndex, { once: true });
+searchInput.addEventListener('input', () => {
+  const query = searchInput.value;
+  loadSearchIndex().then(() => {
+    if (searchInput.value === query) renderSearchResults(query);
+  });
+});
+
+searchResults.addEventListener('click', (e) => {
+  if (e.target.closest('a') && window.innerWidth <= 1024) {
+    toc.classList.remove('open');
+  }
+});
+
+// Dark Mode Toggle
+const themeToggle = document.getElementById('theme-toggle');
+const html = document.documentElement;
+
+// Check saved preference or system preference
+const savedTheme = localStorage.getItem('theme');
+const systemDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
+
+if (savedTheme === 'dark' || (!savedTheme && systemDark)) {
+  html.setAttribute('data-theme', 'dark');
+  themeToggle.textContent = '☀️';
+}
+
+themeToggle.addEventListener('click', () => {
+  const isDark = html.getAttribute('data-theme') === 'dark';
+  if (isDark) {
+    html.removeAttribute('data-theme');
+    localStorage.setItem('theme', 'light');
+    themeToggle.textContent = '🌙';
+  } else {
+    html.setAttribute('data-theme', 'dark');
+    localStorage.setItem('theme', 'dark');
+    themeToggle.textContent = '☀️';
+  }
+});
+
+// Text Selection Share Link
+const shareBtn = document.getElementById('share-selection');
+let selectedText = '';
+let selectionTimeout = null;
+const isMobile = /Android|webOS|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent);
+
+function positionShareButton(rect) {
+  const btnWidth = shareBtn.offsetWidth || 100;
+  const btnHeight = 36;
+  const padding = 10;
+
+  let left, top;
+
+  if (isMobile) {
+    // Mobile: below selection (system menu appears above)
+    left = rect.left + window.scrollX + rect.width / 2 - btnWidth / 2;
+    top = rect.bottom + window.scrollY + 10;
+  } else {
+    // Desktop: above selection
+    left = rect.left + window.scrollX + rect.width / 2 - btnWidth / 2;
+    top = rect.top + window.scrollY - 40;
+  }
+
+  // Clamp to viewport (keep button visible)
+  const maxLeft = window.scrollX + window.innerWidth - btnWidth - padding;
+  const minLeft = window.scrollX + padding;
+  left = Math.max(minLeft, Math.min(maxLeft, left));
+
+  shareBtn.style.transform = 'none';
+  shareBtn.style.left = left + 'px';
+  shareBtn.style.top = top + 'px';
+}
+
+function handleSelection() {
+  clearTimeout(selectionTimeout);
+  selectionTimeout = setTimeout(() => {
+    const selection = window.getSelection();
+    const text = selection.toString().trim();
+
+    if (text.length > 3 && text.length < 200) {
+      selectedText = text;
+      try {
+        const range = selection.getRangeAt(0);
+        const rect = range.getBoundingClientRect();
 
-      tocLinks.forEach(link => link.classList.remove('active'));
-      if (activeHeading) {
-        activeHeading.link.classList.add('active');
+        shareBtn.style.display = 'block';
+        shareBtn.textContent = '🔗 링크 복사';
+        shareBtn.classList.remove('copied');
+        positionShareButton(rect);
+      } catch (e) {
+        shareBtn.style.display = 'none';
       }
+    } else {
+      shareBtn.style.display = 'none';
     }
+  }, 10);
+}
 
-    window.addEventListener('scroll', updateActiveTocItem);
-    updateActiveTocItem();
-
-    // Dark Mode Toggle
-    const themeToggle = document.getElementById('theme-toggle');
-    const html = document.documentElement;
+// Desktop: mouseup
+document.addEventListener('mouseup', handleSelection);
 
-    // Check saved preference or system preference
-    const savedTheme = localStorage.getItem('theme');
-    const systemDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
+// Mobile: selectionchange (for touch selection)
+document.addEventListener('selectionchange', () => {
+  clearTimeout(selectionTimeout);
+  selectionTimeout = setTimeout(() => {
+    const selection = window.getSelection();
+    const text = selection.toString().trim();
 
-    if (savedTheme === 'dark' || (!savedTheme && systemDark)) {
-      html.setAttribute('data-theme', 'dark');
-      themeToggle.textContent = '☀️';
-    }
-
-    themeToggle.addEventListener('click', () => {
-      const isDark = html.getAttribute('data-theme') === 'dark';
-      if (isDark) {
-        html.removeAttribute('data-theme');
-        localStorage.setItem('theme', 'light');
-        themeToggle.textContent = '🌙';
-      } else {
-        html.setAttribute('data-theme', 'dark');
-        localStorage.setItem('theme', 'dark');
-        themeToggle.textContent = '☀️';
+    if (text.length > 3 && text.length < 200) {
+      selectedText = text;
+      try {
+        const range = selection.getRangeAt(0);
+        const rect = range.getBoundingClientRect();
+
+        shareBtn.style.display = 'block';
+        shareBtn.textContent = '🔗 링크 복사';
+        shareBtn.classList.remove('copied');
+        positionShareButton(rect);
+      } catch (e) {
+        // Ignore errors
       }
-    });
-
-    // Text Selection Share Link
-    const shareBtn = document.getElementById('share-selection');
-    let selectedText = '';
-    let selectionTimeout = null;
-    const isMobile = /Android|webOS|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent);
+    } else if (text.length === 0) {
+      // Only hide when selection is completely cleared
+      shareBtn.style.display = 'none';
+    }
+  }, 200);
+});
+
+document.addEventListener('mousedown', (e) => {
+  if (e.target !== shareBtn) {
+    shareBtn.style.display = 'none';
+  }
+});
+
+// Mobile: don't hide on touchstart (allows scrolling with button visible)
+// Button hides when selection is cleared via selectionchange
+
+shareBtn.addEventListener('click', async () => {
+  if (!selectedText) return;
+
+  // Create URL with query parameter for text highlight
+  const baseUrl = window.location.href.split('?')[0].split('#')[0];
+
+  // Get context (prefix/suffix) for precise matching
+  const selection = window.getSelection();
+  let prefix = '';
+  let suffix = '';
+  let item = null;
+  let itemOffset = 0;
+
+  if (selection.rangeCount > 0) {
+    const range = selection.getRangeAt(0);
+    const container = range.commonAncestorContainer;
+
+    // Anchor the link to the enclosing item: #item-... plus the offset of the selection in it
+    const startNode = range.startContainer;
+    const startElement = startNode.nodeType === Node.TEXT_NODE ? startNode.parentElement : startNode;
+    item = startElement.closest('li[id^="item-"]');
+    if (item && item.contains(range.endContainer)) {
+      const before = document.createRange();
+      before.setStart(item, 0);
+      before.setEnd(range.startContainer, range.startOffset);
+      const raw = range.toString();
+      itemOffset = before.toString().length + (raw.length - raw.trimStart().length);
+    } else {
+      item = null;
+    }
 
-    function positionShareButton(rect) {
-      const btnWidth = shareBtn.offsetWidth || 100;
-      const btnHeight = 36;
-      const padding = 10;
+    if (container.nodeType === Node.TEXT_NODE) {
+      const fullText = container.textContent || '';
+      const startOffset = range.startOffset;
+      const endOffset = range.endOffset;
 
-      let left, top;
+      // Extract prefix (up to 30 chars before selection)
+      const prefixStart = Math.max(0, startOffset - 30);
+      prefix = fullText.substring(prefixStart, startOffset);
 
-      if (isMobile) {
-        // Mobile: below selection (system menu appears above)
-        left = rect.left + window.scrollX + rect.width / 2 - btnWidth / 2;
-        top = rect.bottom + window.scrollY + 10;
-      } else {
-        // Desktop: above selection
-        left = rect.left + window.scrollX + rect.width / 2 - btnWidth / 2;
-        top = rect.top + window.scrollY - 40;
+      // Extract suffix (up to 30 chars after selection)
+      const suffixEnd = Math.min(fullText.length, endOffset + 30);
+      suffix = fullText.substring(endOffset, suffixEnd);
+    }
+  }
+
+  // Use start/end markers to reduce URL length while highlighting full text
+  const startMarker = selectedText.substring(0, 15);
+  const endMarker = selectedText.length > 15 ? selectedText.slice(-15) : '';
+
+  let url = baseUrl + '?a=' + encodeURIComponent(startMarker);
+  if (endMarker && endMarker !== startMarker) url += '&b=' + encodeURIComponent(endMarker);
+  if (item) {
+    url += '&o=' + itemOffset + '#' + encodeURIComponent(item.id);
+  } else {
+    if (prefix) url += '&p=' + encodeURIComponent(prefix.slice(-10));
+    if (suffix) url += '&s=' + encodeURIComponent(suffix.slice(0, 10));
+  }
+
+  try {
+    await navigator.clipboard.writeText(url);
+    shareBtn.textContent = '✓ 복사됨';
+    shareBtn.classList.add('copied');
+    selectedText = '';
+    window.getSelection().removeAllRanges();
+    setTimeout(() => {
+      shareBtn.style.display = 'none';
+    }, 1500);
+  } catch (err) {
+    // Fallback for older browsers
+    const textarea = document.createElement('textarea');
+    textarea.value = url;
+    document.body.appendChild(textarea);
+    textarea.select();
+    document.execCommand('copy');
+    document.body.removeChild(textarea);
+    shareBtn.textContent = '✓ 복사됨';
+    shareBtn.classList.add('copied');
+    selectedText = '';
+    window.getSelection().removeAllRanges();
+    setTimeout(() => {
+      shareBtn.style.display = 'none';
+    }, 1500);
+  }
+});
+
+// Back to Previous Position
+const backBtn = document.getElementById('back-to-position');
+let previousScrollPosition = null;
+let backButtonTimeout = null;
+let backButtonShownAt = null;
+
+// Track clicks on internal links
+document.addEventListener('click', (e) => {
+  const link = e.target.closest('a[href^="#"]');
+  if (link) {
+    // Save current scroll position before navigation
+    previousScrollPosition = window.scrollY;
+
+    // Show back button after navigation
+    setTimeout(() => {
+      showBackButton();
+    }, 100);
+  }
+});
+
+function showBackButton() {
+  if (previousScrollPosition !== null) {
+    backBtn.style.display = 'flex';
+    backBtn.classList.add('visible');
+    backButtonShownAt = Date.now();
+
+    // Auto-hide after 20 seconds
+    clearTimeout(backButtonTimeout);
+    backButtonTimeout = setTimeout(() => {
+      hideBackButton();
+    }, 20000);
+  }
+}
+
+function hideBackButton() {
+  backBtn.classList.remove('visible');
+  setTimeout(() => {
+    if (!backBtn.classList.contains('visible')) {
+      backBtn.style.display = 'none';
+    }
+  }, 300);
+}
+
+backBtn.addEventListener('click', () => {
+  if (previousScrollPosition !== null) {
+    window.scrollTo({
+      top: previousScrollPosition,
+      behavior: 'smooth'
+    });
+    previousScrollPosition = null;
+    hideBackButton();
+  }
+});
+
+// Hide back button when user scrolls manually near the original position
+// Only hide if button has been shown for at least 3 seconds
+window.addEventListener('scroll', () => {
+  if (previousScrollPosition !== null && backBtn.classList.contains('visible')) {
+    const timeSinceShown = Date.now() - backButtonShownAt;
+    if (timeSinceShown >= 3000) {
+      const currentPos = window.scrollY;
+      const diff = Math.abs(currentPos - previousScrollPosition);
+      // If user scrolled back close to original position, hide the button
+      if (diff < 100) {
+        previousScrollPosition = null;
+        hideBackButton();
       }
-
-      // Clamp to viewport (keep button visible)
-      const maxLeft = window.scrollX + window.innerWidth - btnWidth - padding;
-      const minLeft = window.scrollX + padding;
-      left = Math.max(minLeft, Math.min(maxLeft, left));
-
-      shareBtn.style.transform = 'none';
-      shareBtn.style.left = left + 'px';
-      shareBtn.style.top = top + 'px';
     }
-
-    function handleSelection() {
-      clearTimeout(selectionTimeout);
-      selectionTimeout = setTimeout(() => {
-        const selection = window.getSelection();
-        const text = selection.toString().trim();
-
-        if (text.length > 3 && text.length < 200) {
-          selectedText = text;
-          try {
-            const range = selection.getRangeAt(0);
-            const rect = range.getBoundingClientRect();
-
-            shareBtn.style.display = 'block';
-            shareBtn.textContent = '🔗 링크 복사';
-            shareBtn.classList.remove('copied');
-            positionShareButton(rect);
-          } catch (e) {
-            shareBtn.style.display = 'none';
-          }
-        } else {
-          shareBtn.style.display = 'none';
-        }
-      }, 10);
+  }
+}, { passive: true });
+
+// Highlight [start, end) of an element's text, wrapping each touched text node part in <mark>
+function highlightTextRange(element, start, end) {
+  const walker = document.createTreeWalker(element, NodeFilter.SHOW_TEXT, null, false);
+  const parts = [];
+  let pos = 0;
+  let node;
+  while ((node = walker.nextNode()) && pos < end) {
+    const length = node.textContent.length;
+    const from = Math.max(start - pos, 0);
+    const to = Math.min(end - pos, length);
+    if (from < to) parts.push({ node, from, to });
+    pos += length;
+  }
+
+  let first = null;
+  for (const { node, from, to } of parts) {
+    const range = document.createRange();
+    range.setStart(node, from);
+    range.setEnd(node, to);
+    const highlight = document.createElement('mark');
+    highlight.className = 'text-highlight';
+    range.surroundContents(highlight);
+    first = first || highlight;
+  }
+  return first;
+}
+
+function scrollToHighlight(highlight) {
+  const rect = highlight.getBoundingClientRect();
+  const scrollTop = window.scrollY + rect.top - window.innerHeight / 2 + rect.height / 2;
+  window.scrollTo({ top: scrollTop, left: 0, behavior: 'smooth' });
+}
+
+// Highlight text from URL parameter on page load
+(function() {
+  const params = new URLSearchParams(window.location.search);
+  const startMarker = params.get('a');
+  if (!startMarker) return;
+
+  const endMarker = params.get('b') || startMarker;
+  const prefix = params.get('p') || '';
+  const suffix = params.get('s') || '';
+  const offset = parseInt(params.get('o'), 10);
+  const anchorId = decodeURIComponent(window.location.hash.slice(1));
+
+  // Clean URL after reading parameter (keep the item fragment)
+  const cleanUrl = window.location.href.split('?')[0].split('#')[0] + window.location.hash;
+  history.replaceState(null, '', cleanUrl);
+
+  // Item-anchored link: direct element lookup, search only within that item
+  const item = anchorId && !isNaN(offset) ? document.getElementById(anchorId) : null;
+  if (item) {
+    const itemText = item.textContent;
+    let start = itemText.startsWith(startMarker, offset) ? offset : -1;
+    if (start === -1) {
+      // Item text changed since the link was made: take the nearest occurrence
+      let best = -1;
+      let idx = itemText.indexOf(startMarker);
+      while (idx !== -1) {
+        if (best === -1 || Math.abs(idx - offset) < Math.abs(best - offset)) best = idx;
+        idx = itemText.indexOf(startMarker, idx + 1);
+      }
+      start = best;
     }
 
-    // Desktop: mouseup
-    document.addEventListener('mouseup', handleSelection);
-
-    // Mobile: selectionchange (for touch selection)
-    document.addEventListener('selectionchange', () => {
-      clearTimeout(selectionTimeout);
-      selectionTimeout = setTimeout(() => {
-        const selection = window.getSelection();
-        const text = selection.toString().trim();
-
-        if (text.length > 3 && text.length < 200) {
-          selectedText = text;
-          try {
-            const range = selection.getRangeAt(0);
-            const rect = range.getBoundingClientRect();
-
-            shareBtn.style.display = 'block';
-            shareBtn.textContent = '🔗 링크 복사';
-            shareBtn.classList.remove('copied');
-            positionShareButton(rect);
-          } catch (e) {
-            // Ignore errors
-          }
-        } else if (text.length === 0) {
-          // Only hide when selection is completely cleared
-          shareBtn.style.display = 'none';
+    if (start !== -1) {
+      let end = start + startMarker.length;
+      if (endMarker !== startMarker) {
+        const endIdx = itemText.indexOf(endMarker, Math.max(start, end - endMarker.length));
+        if (endIdx !== -1) end = endIdx + endMarker.length;
+      }
+      const highlight = highlightTextRange(item, start, end);
+      if (highlight) {
+        scrollToHighlight(highlight);
+        return;
+      }
+    }
+  }
+
+  // Old links (or missing item): scan the whole document
+  const content = document.getElementById('content');
+  const walker = document.createTreeWalker(
+    content,
+    NodeFilter.SHOW_TEXT,
+    null,
+    false
+  );
+
+  let node;
+  while (node = walker.nextNode()) {
+    const nodeText = node.textContent;
+    let startIdx = nodeText.indexOf(startMarker);
+
+    while (startIdx !== -1) {
+      // Check prefix
+      if (prefix) {
+        const beforeText = nodeText.substring(0, startIdx);
+        if (!beforeText.endsWith(prefix)) {
+          startIdx = nodeText.indexOf(startMarker, startIdx + 1);
+          continue;
         }
-      }, 200);
-    });
+      }
 
-    document.addEventListener('mousedown', (e) => {
-      if (e.target !== shareBtn) {
-        shareBtn.style.display = 'none';
+      // Find end marker after start marker
+      const searchFrom = startIdx + startMarker.length;
+      let endIdx = nodeText.indexOf(endMarker, searchFrom - endMarker.length);
+      if (endIdx < startIdx) endIdx = nodeText.indexOf(endMarker, startIdx);
+
+      // If end marker not found or same as start, use start marker end
+      if (endIdx === -1 || endMarker === startMarker) {
+        endIdx = startIdx;
+      }
+      const highlightEnd = endIdx + endMarker.length;
+
+      // Check suffix
+      if (suffix) {
+        const afterText = nodeText.substring(highlightEnd);
+        if (!afterText.startsWith(suffix)) {
+          startIdx = nodeText.indexOf(startMarker, startIdx + 1);
+          continue;
+        }
       }
-    });
 
-    // Mobile: don't hide on touchstart (allows scrolling with button visible)
-    // Button hides when selection is cleared via selectionchange
+      // Highlight from start marker to end of end marker
+      const range = document.createRange();
+      range.setStart(node, startIdx);
+      range.setEnd(node, highlightEnd);
 
-    shareBtn.addEventListener('click', async () => {
-      if (!selectedText) return;
+      const highlight = document.createElement('mark');
+      highlight.className = 'text-highlight';
+      range.surroundContents(highlight);
 
-      // Create URL with query parameter for text highlight
-      const baseUrl = window.location.href.split('?')[0].split('#')[0];
+      // Scroll to highlighted text
+      scrollToHighlight(highlight);
 
-      // Get context (prefix/suffix) for precise matching
-      const selection = window.getSelection();
-      let prefix = '';
-      let suffix = '';
+      return;
+    }
+  }
+})();
+'''
 
-      if (selection.rangeCount > 0) {
-        const range = selection.getRangeAt(0);
-        const container = range.commonAncestorContainer;
 
-        if (container.nodeType === Node.TEXT_NODE) {
-          const fullText = container.textContent || '';
-          const startOffset = range.startOffset;
-          const endOffset = range.endOffset;
+def fingerprint_name(name, digest):
+    """Insert a content hash after the first dot-separated part: style.css -> style.<hash>.css."""
+    stem, _, ext = name.partition('.')
+    return f'{stem}.{digest[:10]}.{ext}'
 
-          // Extract prefix (up to 30 chars before selection)
-          const prefixStart = Math.max(0, startOffset - 30);
-          prefix = fullText.substring(prefixStart, startOffset);
 
-          // Extract suffix (up to 30 chars after selection)
-          const suffixEnd = Math.min(fullText.length, endOffset + 30);
-          suffix = fullText.substring(endOffset, suffixEnd);
-        }
-      }
+def compress_file(path):
+    """Write .gz and, if the brotli module is available, .br variants next to path."""
+    data = path.read_bytes()
+    sizes = {'raw': len(data)}
 
-      // Use start/end markers to reduce URL length while highlighting full text
-      const startMarker = selectedText.substring(0, 15);
-      const endMarker = selectedText.length > 15 ? selectedText.slice(-15) : '';
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    path.with_name(path.name + '.gz').write_bytes(gz)
+    sizes['gzip'] = len(gz)
 
-      let url = baseUrl + '?a=' + encodeURIComponent(startMarker);
-      if (endMarker && endMarker !== startMarker) url += '&b=' + encodeURIComponent(endMarker);
-      if (prefix) url += '&p=' + encodeURIComponent(prefix.slice(-10));
-      if (suffix) url += '&s=' + encodeURIComponent(suffix.slice(0, 10));
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        path.with_name(path.name + '.br').write_bytes(br)
+        sizes['br'] = len(br)
 
-      try {
-        await navigator.clipboard.writeText(url);
-        shareBtn.textContent = '✓ 복사됨';
-        shareBtn.classList.add('copied');
-        selectedText = '';
-        window.getSelection().removeAllRanges();
-        setTimeout(() => {
-          shareBtn.style.display = 'none';
-        }, 1500);
-      } catch (err) {
-        // Fallback for older browsers
-        const textarea = document.createElement('textarea');
-        textarea.value = url;
-        document.body.appendChild(textarea);
-        textarea.select();
-        document.execCommand('copy');
-        document.body.removeChild(textarea);
-        shareBtn.textContent = '✓ 복사됨';
-        shareBtn.classList.add('copied');
-        selectedText = '';
-        window.getSelection().removeAllRanges();
-        setTimeout(() => {
-          shareBtn.style.display = 'none';
-        }, 1500);
-      }
-    });
+    return sizes
 
-    // Back to Previous Position
-    const backBtn = document.getElementById('back-to-position');
-    let previousScrollPosition = null;
-    let backButtonTimeout = null;
-    let backButtonShownAt = null;
-
-    // Track clicks on internal links
-    document.addEventListener('click', (e) => {
-      const link = e.target.closest('a[href^="#"]');
-      if (link) {
-        // Save current scroll position before navigation
-        previousScrollPosition = window.scrollY;
-
-        // Show back button after navigation
-        setTimeout(() => {
-          showBackButton();
-        }, 100);
-      }
-    });
 
-    function showBackButton() {
-      if (previousScrollPosition !== null) {
-        backBtn.style.display = 'flex';
-        backBtn.classList.add('visible');
-        backButtonShownAt = Date.now();
-
-        // Auto-hide after 20 seconds
-        clearTimeout(backButtonTimeout);
-        backButtonTimeout = setTimeout(() => {
-          hideBackButton();
-        }, 20000);
-      }
-    }
+def collect_charset(texts):
+    """Characters that can appear on the published pages: page text, attribute values and UI strings in the script."""
+    chars = set(FONT_BASE_CHARS)
+    for text in texts:
+        chars.update(html.unescape(text))
+    return {c for c in chars if c.isprintable() or c == '\u00a0'}
 
-    function hideBackButton() {
-      backBtn.classList.remove('visible');
-      setTimeout(() => {
-        if (!backBtn.classList.contains('visible')) {
-          backBtn.style.display = 'none';
-        }
-      }, 300);
-    }
 
-    backBtn.addEventListener('click', () => {
-      if (previousScrollPosition !== null) {
-        window.scrollTo({
-          top: previousScrollPosition,
-          behavior: 'smooth'
-        });
-        previousScrollPosition = null;
-        hideBackButton();
-      }
-    });
+def format_unicode_range(codepoints):
+    """Collapse codepoints into a CSS unicode-range value: U+20-7E, U+AC00, ..."""
+    ranges = []
+    for cp in sorted(codepoints):
+        if ranges and cp == ranges[-1][1] + 1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return ', '.join(f'U+{lo:X}' if lo == hi else f'U+{lo:X}-{hi:X}' for lo, hi in ranges)
+
+
+def subset_fonts(css, charset, fonts_dir, output_dir, cache_dir):
+    """
+    Subset every @font-face font in css to the glyphs in charset with fontTools.
+    The full fonts are looked up in fonts_dir by the file name in their url(); subsets are
+    written to output_dir as <name>.<hash>.woff2 and cached by font and character-set hash.
+    Returns the rewritten css (subset urls, unicode-range, font-display: swap) and the
+    written font paths. Skipped when fontTools is not installed.
+    """
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        print("Warning: fontTools not installed, skipping font subsetting (pip install fonttools)")
+        return css, []
+
+    fonts_dir = Path(fonts_dir)
+    output_dir = Path(output_dir)
+    subset_cache = Path(cache_dir) / 'fonts'
+    subset_cache.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # woff2 needs brotli; plain woff (zlib) is the fallback
+    flavor = 'woff2' if brotli is not None else 'woff'
+    charset_hash = hashlib.sha256(''.join(sorted(charset)).encode('utf-8')).hexdigest()
+    written = []
+    stats = {'original': 0, 'subset': 0, 'cached': 0}
+
+    def subset_face(match):
+        block = match.group(0)
+        url = FONT_URL_PATTERN.search(block)
+        if url is None:
+            return block
+        url_path = url.group(1)
+        source = fonts_dir / Path(url_path).name
+        if not source.is_file():
+            print(f"Warning: font not found, keeping full font: {source}")
+            return block
+
+        key = hashlib.sha256((file_hash(source) + charset_hash + flavor).encode()).hexdigest()
+        name = f'{source.name.split(".")[0]}.{key[:10]}.{flavor}'
+        cached = subset_cache / name
+        range_path = cached.with_name(cached.name + '.range')
+        if cached.exists() and range_path.exists():
+            stats['cached'] += 1
+            unicode_range = range_path.read_text(encoding='utf-8')
+        else:
+            font = TTFont(source)
+            codepoints = {ord(c) for c in charset} & set(font.getBestCmap())
+            options = subset.Options()
+            options.flavor = flavor
+            options.layout_features = ['*']
+            options.desubroutinize = True
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(unicodes=codepoints)
+            subsetter.subset(font)
+            font.flavor = flavor
+            font.save(cached)
+            unicode_range = format_unicode_range(codepoints)
+            range_path.write_text(unicode_range, encoding='utf-8')
+
+        shutil.copyfile(cached, output_dir / name)
+        written.append(output_dir / name)
+        stats['original'] += source.stat().st_size
+        stats['subset'] += cached.stat().st_size
+
+        new_url = str(Path(url_path).parent / name) if Path(url_path).parent != Path('.') else name
+        block = block.replace(url.group(0), f"src: url('{new_url}') format('{flavor}')")
+        block = re.sub(r'\s*unicode-range:[^;]*;', '', block)
+        block = re.sub(r'\s*font-display:[^;]*;', '', block)
+        return block.rstrip('}').rstrip() + f'\n  font-display: swap;\n  unicode-range: {unicode_range};\n}}'
+
+    css = FONT_FACE_PATTERN.sub(subset_face, css)
+    if written:
+        print(f"Subset {len(written)} fonts to {len(charset)} characters ({stats['cached']} cached): "
+              f"{stats['original'] / 1024:.0f} KB -> {stats['subset'] / 1024:.0f} KB")
+    return css, written
+
+
+def publish_site(pages, asset_files, publish_dir, asset_dirs=(), fonts_dir=None, cache_dir=None):
+    """
+    Copy the built site to publish_dir for static hosting.
+    Assets (CSS/JS/JSON) get content-hashed names and references to them in the pages'
+    href, src and data-* attributes are rewritten; the first page is also published as index.html. Text files are
+    precompressed (gzip, and brotli when available) and asset-manifest.json records
+    the name mapping and sizes. With fonts_dir, the fonts of the stylesheet's @font-face
+    rules are subset to the characters used on the pages (see subset_fonts).
+    """
+    publish_dir = Path(publish_dir)
+    publish_dir.mkdir(parents=True, exist_ok=True)
+
+    mapping = {}
+    written = []
+    overrides = {}
+    if fonts_dir:
+        texts = [Path(p).read_text(encoding='utf-8') for p in pages]
+        texts += [Path(p).read_text(encoding='utf-8') for p in asset_files if Path(p).suffix == '.js']
+        charset = collect_charset(texts)
+        for path in asset_files:
+            path = Path(path)
+            if path.suffix == '.css':
+                css, fonts = subset_fonts(path.read_text(encoding='utf-8'), charset, fonts_dir,
+                                          publish_dir / 'fonts', cache_dir or get_cache_dir(path))
+                overrides[path] = css.encode('utf-8')
+                written.extend(fonts)
+
+    for path in asset_files:
+        path = Path(path)
+        data = overrides.get(path) or path.read_bytes()
+        name = fingerprint_name(path.name, hashlib.sha256(data).hexdigest())
+        (publish_dir / name).write_bytes(data)
+        mapping[path.name] = name
+        written.append(publish_dir / name)
+
+    if mapping:
+        ref_pattern = re.compile(
+            r"""(\s(?:href|src|data-[\w-]+)=(["']))(""" + '|'.join(re.escape(name) for name in mapping)
+            + r')(?=[?#]|\2)'
+        )
+    for i, page in enumerate(pages):
+        page = Path(page)
+        content = page.read_text(encoding='utf-8')
+        if mapping:
+            content = ref_pattern.sub(lambda m: m.group(1) + mapping[m.group(3)], content)
+        names = [page.name, 'index.html'] if i == 0 and page.name != 'index.html' else [page.name]
+        for name in names:
+            (publish_dir / name).write_text(content, encoding='utf-8')
+            written.append(publish_dir / name)
+
+    for asset_dir in asset_dirs:
+        asset_dir = Path(asset_dir)
+        if asset_dir.is_dir():
+            shutil.copytree(asset_dir, publish_dir / asset_dir.name, dirs_exist_ok=True)
+
+    if brotli is None:
+        print("Warning: brotli not installed, writing gzip variants only (pip install brotli)")
+
+    files = {}
+    for path in written:
+        if path.suffix in COMPRESSIBLE_SUFFIXES:
+            files[path.name] = compress_file(path)
+        else:
+            files[path.name] = {'raw': path.stat().st_size}
 
-    // Hide back button when user scrolls manually near the original position
-    // Only hide if button has been shown for at least 3 seconds
-    window.addEventListener('scroll', () => {
-      if (previousScrollPosition !== null && backBtn.classList.contains('visible')) {
-        const timeSinceShown = Date.now() - backButtonShownAt;
-        if (timeSinceShown >= 3000) {
-          const currentPos = window.scrollY;
-          const diff = Math.abs(currentPos - previousScrollPosition);
-          // If user scrolled back close to original position, hide the button
-          if (diff < 100) {
-            previousScrollPosition = null;
-            hideBackButton();
-          }
-        }
-      }
-    });
+    with open(publish_dir / 'asset-manifest.json', 'w', encoding='utf-8') as f:
+        json.dump({'assets': mapping, 'files': files}, f, ensure_ascii=False, indent=2)
 
-    // Highlight text from URL parameter on page load
-    (function() {
-      const params = new URLSearchParams(window.location.search);
-      const startMarker = params.get('a');
-      if (!startMarker) return;
-
-      const endMarker = params.get('b') || startMarker;
-      const prefix = params.get('p') || '';
-      const suffix = params.get('s') || '';
-
-      // Clean URL after reading parameter
-      const cleanUrl = window.location.href.split('?')[0];
-      history.replaceState(null, '', cleanUrl);
-
-      const content = document.getElementById('content');
-      const walker = document.createTreeWalker(
-        content,
-        NodeFilter.SHOW_TEXT,
-        null,
-        false
-      );
-
-      let node;
-      while (node = walker.nextNode()) {
-        const nodeText = node.textContent;
-        let startIdx = nodeText.indexOf(startMarker);
-
-        while (startIdx !== -1) {
-          // Check prefix
-          if (prefix) {
-            const beforeText = nodeText.substring(0, startIdx);
-            if (!beforeText.endsWith(prefix)) {
-              startIdx = nodeText.indexOf(startMarker, startIdx + 1);
-              continue;
-            }
-          }
-
-          // Find end marker after start marker
-          const searchFrom = startIdx + startMarker.length;
-          let endIdx = nodeText.indexOf(endMarker, searchFrom - endMarker.length);
-          if (endIdx < startIdx) endIdx = nodeText.indexOf(endMarker, startIdx);
-
-          // If end marker not found or same as start, use start marker end
-          if (endIdx === -1 || endMarker === startMarker) {
-            endIdx = startIdx;
-          }
-          const highlightEnd = endIdx + endMarker.length;
-
-          // Check suffix
-          if (suffix) {
-            const afterText = nodeText.substring(highlightEnd);
-            if (!afterText.startsWith(suffix)) {
-              startIdx = nodeText.indexOf(startMarker, startIdx + 1);
-              continue;
-            }
-          }
-
-          // Highlight from start marker to end of end marker
-          const range = document.createRange();
-          range.setStart(node, startIdx);
-          range.setEnd(node, highlightEnd);
-
-          const highlight = document.createElement('mark');
-          highlight.className = 'text-highlight';
-          range.surroundContents(highlight);
-
-          // Scroll to highlighted text
-          const rect = highlight.getBoundingClientRect();
-          const scrollTop = window.scrollY + rect.top - window.innerHeight / 2 + rect.height / 2;
-          window.scrollTo({ top: scrollTop, left: 0, behavior: 'smooth' });
-
-          return;
-        }
-      }
-    })();
-  </script>
-</body>
-</html>
-'''
+    totals = {key: sum(sizes.get(key, sizes['raw']) for sizes in files.values())
+              for key in ('raw', 'gzip', 'br')}
+    print(f"Published {len(files)} files to {publish_dir}: {totals['raw'] / 1024:.0f} KB raw, "
+          f"{totals['gzip'] / 1024:.0f} KB gzip" +
+          (f", {totals['br'] / 1024:.0f} KB brotli" if brotli is not None else ''))
+    return mapping
 
 
-def convert_to_html(tex_path, output_path):
-    """Main conversion function."""
+def convert_to_html(tex_path, output_path, split=False, publish_dir=None, fonts_dir=None, aux_path=None,
+                    script_stats=False):
+    """Main conversion function. aux_path defaults to the .aux next to tex_path."""
     tex_path = Path(tex_path)
     output_path = Path(output_path)
-    aux_path = tex_path.with_suffix('.aux')
+    aux_path = Path(aux_path) if aux_path else tex_path.with_suffix('.aux')
 
     if not aux_path.exists():
         print(f"Error: {aux_path} not found. Please compile the LaTeX document first.")
         print("Run: pdflatex formula.tex (multiple times to resolve references)")
         sys.exit(1)
 
-    print("Parsing .aux file for label references...")
-    labels = parse_aux_file(aux_path)
-    print(f"Found {len(labels)} labels")
+    cache_dir = get_cache_dir(tex_path)
+
+    print("Loading label index...")
+    start = time.perf_counter()
+    labels, from_cache = load_label_index(aux_path, cache_dir)
+    source = 'cached index' if from_cache else 'parsed .aux'
+    print(f"Found {len(labels)} labels ({source}, {(time.perf_counter() - start) * 1000:.1f} ms)")
 
     print("Reading LaTeX source...")
     with open(tex_path, 'r', encoding='utf-8') as f:
         tex_content = f.read()
 
     print("Resolving references...")
-    tex_content = resolve_refs_in_tex(tex_content, labels)
+    start = time.perf_counter()
+    unresolved = set()
+    tex_content = resolve_refs_in_tex(tex_content, labels, unresolved)
+    print(f"Resolved references in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if unresolved:
+        print(f"Warning: {len(unresolved)} unresolved labels:")
+        for label in sorted(unresolved):
+            print(f"  {label}")
+
+    print("Assigning item anchors...")
+    tex_content, item_map = assign_item_anchors(tex_content)
+    print(f"Anchored {len(set(item_map.values()))} items")
 
     print("Preprocessing for pandoc...")
     tex_content = preprocess_tex_for_pandoc(tex_content)
@@ -889,54 +2173,273 @@ def convert_to_html(tex_path, output_path):
     with open(preprocessed_path, 'w', encoding='utf-8') as f:
         f.write(tex_content)
 
-    template_path = tex_path.with_name('pandoc_template.html')
-    with open(template_path, 'w', encoding='utf-8') as f:
-        f.write(create_pandoc_template())
-
     print("Converting to HTML with pandoc...")
-    cmd = [
-        'pandoc',
-        str(preprocessed_path),
-        '-f', 'latex',
-        '-t', 'html5',
-        '-o', str(output_path),
-        '--standalone',
-        '--template', str(template_path),
-        '--metadata', 'title=Formula Student Korea 차량기술규정',
-        '--mathjax',
-        '--wrap=none',
-    ]
-
+    start = time.perf_counter()
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"Pandoc warnings/errors:\n{result.stderr}")
+        body, converted, cached, backend = run_pandoc(tex_content, cache_dir)
     except FileNotFoundError:
         print("Error: pandoc not found. Please install pandoc.")
         sys.exit(1)
+    except PandocError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Converted {converted} chapter chunks ({cached} cached) with {backend} in "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms")
 
-    print("Post-processing HTML...")
-    with open(output_path, 'r', encoding='utf-8') as f:
-        html_content = f.read()
+    html_content = fill_template(create_pandoc_template(), {
+        'title': html.escape(DOCUMENT_TITLE),
+        'search-index': search_index_name(output_path),
+        'page-script': page_script_name(output_path),
+        'body': body.rstrip('\n'),
+    })
 
+    print("Post-processing HTML...")
     html_content = postprocess_html(html_content)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    print("Optimizing figures...")
+    html_content = optimize_images(html_content, output_path.parent, cache_dir)
+
+    manifest = None
+    page_paths = [output_path]
+    generated = []
+    if split:
+        print("Splitting into chapter pages...")
+        pages, manifest = split_html_pages(html_content, output_path)
+        page_paths = []
+        for name, page in pages.items():
+            page_paths.append(output_path.with_name(name))
+            with open(page_paths[-1], 'w', encoding='utf-8') as f:
+                f.write(page)
+
+        manifest_path = output_path.with_name(f'{output_path.stem}.manifest.json')
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+        generated.append(manifest_path)
+        print(f"Wrote {len(pages)} pages, anchor manifest: {manifest_path}")
+    else:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+
+    item_map_path = output_path.with_name(f'{output_path.stem}.items.json')
+    with open(item_map_path, 'w', encoding='utf-8') as f:
+        json.dump(item_map, f, ensure_ascii=False, separators=(',', ':'))
+    generated.append(item_map_path)
+    print(f"Item anchor map: {item_map_path}")
+
+    script = create_page_script()
+    script_path = output_path.with_name(page_script_name(output_path))
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(script)
+    generated.append(script_path)
+
+    print(f"Page script: {script_path}")
+    if script_stats:
+        stats = page_script_stats(script)
+        listeners = ', '.join(f'{event} {n}' for event, n in sorted(stats['listeners'].items()))
+        print(f"  {stats['script_bytes'] / 1024:.1f} KB ({stats['script_gzip_bytes'] / 1024:.1f} KB gzip), "
+              f"{sum(stats['listeners'].values())} listeners ({listeners}), "
+              f"{len(stats['observers'])} observers ({', '.join(stats['observers']) or 'none'})")
+
+    print("Building search index...")
+    search_index = build_search_index(html_content, manifest)
+    search_path = output_path.with_name(search_index_name(output_path))
+    with gzip.open(search_path, 'wt', encoding='utf-8', compresslevel=9) as f:
+        json.dump(search_index, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"Indexed {len(search_index['docs'])} anchors, {len(search_index['terms'])} terms "
+          f"({search_path.stat().st_size / 1024:.1f} KB): {search_path}")
+    generated.append(search_path)
+
+    if publish_dir:
+        print("Publishing site...")
+        style_path = output_path.with_name('style.css')
+        assets = ([style_path] if style_path.exists() else []) + generated
+        publish_site(page_paths, assets, publish_dir, asset_dirs=[output_path.with_name('assets')],
+                     fonts_dir=fonts_dir, cache_dir=cache_dir)
 
     # preprocessed_path.unlink(missing_ok=True)
-    template_path.unlink(missing_ok=True)
 
     print(f"HTML output saved to: {output_path}")
     return output_path
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python tex2html.py <input.tex> [output.html]")
-        sys.exit(1)
+def watched_files(tex_path, output_path):
+    """Inputs that --watch polls: the source, its .aux, the stylesheet and figure assets."""
+    tex_path = Path(tex_path)
+    output_path = Path(output_path)
+    files = [tex_path, tex_path.with_suffix('.aux'), output_path.with_name('style.css')]
+    assets = output_path.with_name('assets')
+    if assets.is_dir():
+        files += [p for p in assets.rglob('*')
+                  if p.is_file() and IMAGE_VARIANT_DIR not in p.relative_to(assets).parts]
+    return files
+
+
+def snapshot(files):
+    """Map each file to its (mtime_ns, size); missing files map to None."""
+    state = {}
+    for path in files:
+        try:
+            st = path.stat()
+            state[path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            state[path] = None
+    return state
+
+
+class ReloadHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the built site without caching and injects the live-reload client into HTML pages."""
+
+    index_name = 'index.html'
+    reloader = None
+
+    def end_headers(self):
+        self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == RELOAD_PATH:
+            return self.stream_reloads()
+        if path == '/':
+            path = '/' + self.index_name
+        if not path.endswith('.html'):
+            return super().do_GET()
+
+        file_path = Path(self.translate_path(path))
+        try:
+            content = file_path.read_text(encoding='utf-8')
+        except OSError:
+            return self.send_error(404)
+        content = content.replace('</body>', RELOAD_SCRIPT + '</body>', 1).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def stream_reloads(self):
+        """Server-Sent Events: one `reload` event per finished rebuild."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        generation = self.reloader.generation
+        try:
+            while True:
+                with self.reloader.changed:
+                    self.reloader.changed.wait_for(lambda: self.reloader.generation != generation, timeout=15)
+                if self.reloader.generation != generation:
+                    generation = self.reloader.generation
+                    self.wfile.write(b'event: reload\ndata: {}\n\n')
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class Reloader:
+    """Build generation counter that SSE clients wait on."""
+
+    def __init__(self):
+        self.generation = 0
+        self.changed = threading.Condition()
+
+    def notify(self):
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+
+
+def serve_site(directory, index_name, port):
+    """Start a threaded HTTP server for directory in the background; returns its Reloader."""
+    reloader = Reloader()
+    handler = type('Handler', (ReloadHandler,), {'index_name': index_name, 'reloader': reloader})
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', port), lambda *args: handler(*args, directory=str(directory)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {directory} at http://127.0.0.1:{port}/ (live reload)")
+    return reloader
+
+
+def watch(tex_path, output_path, build, reloader=None):
+    """
+    Poll the inputs and rebuild on change. A stylesheet-only change needs no rebuild
+    (style.css is served as is) and just reloads the browser; a failed build keeps watching.
+    """
+    tex_path = Path(tex_path)
+    output_path = Path(output_path)
+    style_path = output_path.with_name('style.css')
+    state = snapshot(watched_files(tex_path, output_path))
+    print(f"Watching {len(state)} files for changes (Ctrl+C to stop)...")
+
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        current = snapshot(watched_files(tex_path, output_path))
+        changed = [path for path in current.keys() | state.keys() if current.get(path) != state.get(path)]
+        if not changed:
+            continue
+        state = current
+
+        names = ', '.join(sorted(path.name for path in changed))
+        start = time.perf_counter()
+        if changed != [style_path] or build.publishes:
+            print(f"\nChanged: {names}, rebuilding...")
+            try:
+                build()
+            except Exception as e:
+                print(f"Build failed: {e}")
+                continue
+            except SystemExit:
+                print("Build failed, waiting for the next change")
+                continue
+        print(f"Rebuilt in {(time.perf_counter() - start) * 1000:.0f} ms ({names})")
+        if reloader is not None:
+            reloader.notify()
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else Path(input_file).with_suffix('.html')
 
-    convert_to_html(input_file, output_file)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert formula.tex to HTML")
+    parser.add_argument('input', help="Input .tex file")
+    parser.add_argument('output', nargs='?', help="Output .html file (default: input with .html suffix)")
+    parser.add_argument('--split', action='store_true',
+                        help="Write one page per chapter with a shared TOC and an anchor manifest")
+    parser.add_argument('--publish', metavar='DIR',
+                        help="Also publish the site to DIR with hashed asset names and precompressed files")
+    parser.add_argument('--fonts', metavar='DIR',
+                        help="With --publish: subset the web fonts found in DIR to the characters used")
+    parser.add_argument('--watch', action='store_true',
+                        help="Rebuild whenever the source, .aux, style.css or assets change")
+    parser.add_argument('--serve', action='store_true',
+                        help="Serve the output on localhost and reload the browser after each rebuild")
+    parser.add_argument('--port', type=int, default=8000, help="Port for --serve (default: 8000)")
+    parser.add_argument('--script-stats', action='store_true',
+                        help="Report the page script size and the listeners and observers it registers")
+    args = parser.parse_args()
+    if args.fonts and not args.publish:
+        parser.error("--fonts requires --publish")
+
+    output_file = Path(args.output or Path(args.input).with_suffix('.html'))
+
+    def build():
+        convert_to_html(args.input, output_file, split=args.split, publish_dir=args.publish,
+                        fonts_dir=args.fonts, script_stats=args.script_stats)
+
+    build.publishes = bool(args.publish)
+    build()
+
+    reloader = None
+    if args.serve:
+        serve_dir = Path(args.publish) if args.publish else output_file.parent
+        reloader = serve_site(serve_dir, 'index.html' if args.publish else output_file.name, args.port)
+
+    try:
+        if args.watch:
+            watch(args.input, output_file, build, reloader)
+        elif args.serve:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        print("\nStopped")